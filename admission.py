@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from performance_statistics import LatencyHistogram
+
+
+class ClientQueue:
+    def __init__(self):
+        self.items = deque()
+        self.deficit = 0
+        # whether the client got its quantum for the current round
+        self.served = False
+        self.closed = False
+
+
+class FairQueue:
+    """
+    Requests of every client wait in their own queue of at most
+    `client_limit` entries, and clients take turns by deficit round robin:
+    each turn a client may send up to `quantum` commands' worth of
+    requests, so a client sending big batches gets the same share of
+    commands as one sending single gets. put() blocks while a client's
+    queue is full, which stops its connection from being read and lets
+    TCP push back on it. Requests that waited longer than `slo` seconds
+    are handed out as overloaded, to be answered right away with an error.
+    """
+    def __init__(self, client_limit: int = 64, quantum: int = 64, slo: float = 0.5):
+        self.client_limit = client_limit
+        self.quantum = quantum
+        self.slo_ns = int(slo * 1e9) if slo else None
+        self.clients = {}
+        # clients with queued requests, in round robin order
+        self.active = deque()
+        self.depth = 0
+        self.max_depth = 0
+        self.shed_requests = 0
+        self.shed_commands = 0
+        self.backpressure_waits = 0
+        self.wait = LatencyHistogram()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def register(self, client) -> None:
+        with self.lock:
+            self.clients[client] = ClientQueue()
+
+    def unregister(self, client) -> None:
+        """
+        Forget a disconnected client once its queued requests are served
+        """
+        with self.lock:
+            queue = self.clients.get(client)
+            if queue is not None:
+                queue.closed = True
+                if not queue.items:
+                    del self.clients[client]
+                self.not_full.notify_all()
+
+    def put(self, client, item, cost: int = 1) -> None:
+        """
+        Queue item for client, cost is the number of commands in it
+        """
+        with self.lock:
+            queue = self.clients[client]
+            if len(queue.items) >= self.client_limit:
+                self.backpressure_waits += 1
+                while len(queue.items) >= self.client_limit and not queue.closed:
+                    self.not_full.wait()
+            if not queue.items:
+                self.active.append(client)
+            queue.items.append((item, max(1, cost), time.perf_counter_ns()))
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            self.not_empty.notify()
+
+    def get(self) -> tuple:
+        """
+        Next request by deficit round robin, returns (item, overloaded)
+        """
+        with self.lock:
+            while not self.active:
+                self.not_empty.wait()
+            while True:
+                client = self.active[0]
+                queue = self.clients[client]
+                if not queue.served:
+                    queue.deficit += self.quantum
+                    queue.served = True
+                item, cost, enqueued_at = queue.items[0]
+                if cost <= queue.deficit:
+                    break
+                # a batch bigger than the quantum waits until enough turns added up
+                queue.served = False
+                self.active.rotate(-1)
+            queue.items.popleft()
+            queue.deficit -= cost
+            if not queue.items:
+                queue.deficit = 0
+                queue.served = False
+                self.active.popleft()
+                if queue.closed:
+                    del self.clients[client]
+            self.depth -= 1
+            self.not_full.notify_all()
+            waited = time.perf_counter_ns() - enqueued_at
+            self.wait.record(waited)
+            overloaded = self.slo_ns is not None and waited > self.slo_ns
+            if overloaded:
+                self.shed_requests += 1
+                self.shed_commands += cost
+            return item, overloaded
+
+    def get_statistics(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": self.depth,
+                "queue_max_depth": self.max_depth,
+                "queue_clients": len(self.clients),
+                "queue_busy_clients": len(self.active),
+                "queue_shed_requests": self.shed_requests,
+                "queue_shed_commands": self.shed_commands,
+                "queue_backpressure_waits": self.backpressure_waits,
+                "queue_wait": self.wait.summary(),
+            }
@@ -0,0 +1,255 @@
+from array import array
+from lruCache import LRUCache
+import time
+
+NIL = -1
+
+
+class SlotIndex:
+    """
+    Open addressing hash index from key to slot. Only slot numbers are
+    stored, the keys themselves are compared through the cache's key array,
+    which avoids a dict entry and an int object per cached item.
+    """
+    def __init__(self, keys: list, size: int = 2048):
+        self.keys = keys
+        self.count = 0
+        self.table = array('i', [NIL]) * size
+        self.mask = size - 1
+
+    def find(self, key) -> int:
+        """
+        Table position holding key, or the empty position where it would go
+        """
+        table = self.table
+        keys = self.keys
+        position = hash(key) & self.mask
+        while True:
+            slot = table[position]
+            if slot == NIL or keys[slot] == key:
+                return position
+            position = (position + 1) & self.mask
+
+    def __contains__(self, key) -> bool:
+        return self.table[self.find(key)] != NIL
+
+    def __getitem__(self, key) -> int:
+        slot = self.table[self.find(key)]
+        if slot == NIL:
+            raise KeyError(key)
+        return slot
+
+    def __setitem__(self, key, slot: int) -> None:
+        position = self.find(key)
+        if self.table[position] != NIL:
+            self.table[position] = slot
+        else:
+            self.insert(position, key, slot)
+
+    def insert(self, position: int, key, slot: int) -> None:
+        """
+        Store a new key's slot at the empty position find() returned for it.
+        The table must not have changed in between.
+        """
+        if (self.count + 1) * 2 > len(self.table):
+            self.resize(len(self.table) * 2)
+            position = self.find(key)
+        self.table[position] = slot
+        self.count += 1
+
+    def __delitem__(self, key) -> None:
+        table = self.table
+        mask = self.mask
+        position = self.find(key)
+        if table[position] == NIL:
+            raise KeyError(key)
+        # backward shift deletion keeps probe chains intact without tombstones
+        next_position = position
+        while True:
+            next_position = (next_position + 1) & mask
+            slot = table[next_position]
+            if slot == NIL:
+                break
+            home = hash(self.keys[slot]) & mask
+            if (next_position - home) & mask >= (next_position - position) & mask:
+                table[position] = slot
+                position = next_position
+        table[position] = NIL
+        self.count -= 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return (self.keys[slot] for slot in self.table if slot != NIL)
+
+    def resize(self, size: int) -> None:
+        table = array('i', [NIL]) * size
+        mask = size - 1
+        keys = self.keys
+        for slot in self.table:
+            if slot != NIL:
+                # keys are unique, so only empty positions need looking for
+                position = hash(keys[slot]) & mask
+                while table[position] != NIL:
+                    position = (position + 1) & mask
+                table[position] = slot
+        self.table = table
+        self.mask = mask
+
+
+class ArrayLRUCache(LRUCache):
+    """
+    LRU cache without per-entry Node objects. Entries live in preallocated
+    slot arrays, the recency list is kept as integer prev/next indices and
+    free slots are chained through the next array. Capacity is a byte
+    budget over key and value sizes instead of an entry count.
+    """
+    cache_map: SlotIndex
+
+    def __init__(self, capacity_bytes: int, disk_path: str = "cache_disk", storage: str = "log",
+                 initial_slots: int = 1024, **storage_options):
+        super().__init__(capacity_bytes, disk_path, storage, **storage_options)
+        self.history = None
+        self.used_bytes = 0
+        self.head = NIL
+        self.tail = NIL
+        self.free = NIL
+        self.slot_keys = []
+        self.values = []
+        self.sizes = array('I')
+        self.prev = array('i')
+        self.next = array('i')
+        self.cache_map = SlotIndex(self.slot_keys)
+        self.grow(initial_slots)
+
+    def grow(self, slots: int) -> None:
+        """
+        Append slots to the arrays and put them on the free list
+        """
+        start = len(self.slot_keys)
+        self.slot_keys.extend([None] * slots)
+        self.values.extend([None] * slots)
+        self.sizes.extend(array('I', [0]) * slots)
+        self.prev.extend(array('i', [NIL]) * slots)
+        self.next.extend(range(start + 1, start + slots + 1))
+        self.next[start + slots - 1] = self.free
+        self.free = start
+
+    def entry_size(self, key, value) -> int:
+        return len(str(key)) + len(str(value))
+
+    def link_to_head(self, slot: int) -> None:
+        self.prev[slot] = NIL
+        self.next[slot] = self.head
+        if self.head != NIL:
+            self.prev[self.head] = slot
+        self.head = slot
+        if self.tail == NIL:
+            self.tail = slot
+
+    def unlink(self, slot: int) -> None:
+        prev_slot = self.prev[slot]
+        next_slot = self.next[slot]
+        if prev_slot != NIL:
+            self.next[prev_slot] = next_slot
+        else:
+            self.head = next_slot
+        if next_slot != NIL:
+            self.prev[next_slot] = prev_slot
+        else:
+            self.tail = prev_slot
+
+    def get_from_memory(self, key):
+        self.stats.record_read_request()
+        start_time = time.perf_counter_ns()
+        slot = self.cache_map[key]
+        if self.head != slot:
+            # make item the most recently used
+            self.unlink(slot)
+            self.link_to_head(slot)
+        self.stats.record_hit()
+        self.stats.record_memory_hit()
+        self.stats.record_cache_read_time(start_time)
+        return self.values[slot]
+
+    def memory_value(self, key):
+        return self.values[self.cache_map[key]]
+
+    def snapshot_items(self) -> list:
+        items = []
+        slot = self.tail
+        while slot != NIL:
+            items.append((self.slot_keys[slot], self.values[slot]))
+            slot = self.prev[slot]
+        return items
+
+    def put(self, key, value) -> None:
+        """
+        Add or replace a key-value pair, evicting least recently used items
+        until it fits in the byte budget
+        """
+        self.stats.record_write_request()
+        size = self.entry_size(key, value)
+        cache_map = self.cache_map
+        # one probe of the index serves both the lookup and the insert
+        position = cache_map.find(key)
+        slot = cache_map.table[position]
+
+        if slot != NIL:
+            # replace in place, the key keeps its slot
+            self.used_bytes += size - self.sizes[slot]
+            self.values[slot] = value
+            self.sizes[slot] = size
+            if self.head != slot:
+                self.unlink(slot)
+                self.link_to_head(slot)
+            while self.used_bytes > self.capacity and self.tail != slot:
+                self.evict_least_recent_item()
+            return
+
+        evicted = False
+        while self.used_bytes + size > self.capacity and self.tail != NIL:
+            # no space left, needs to evict the least recently used item
+            self.evict_least_recent_item()
+            evicted = True
+
+        if self.free == NIL:
+            self.grow(len(self.slot_keys))
+        slot = self.free
+        self.free = self.next[slot]
+        self.slot_keys[slot] = key
+        self.values[slot] = value
+        self.sizes[slot] = size
+        self.used_bytes += size
+        self.link_to_head(slot)
+        if evicted:
+            # deletions shift entries of the index around
+            position = cache_map.find(key)
+        cache_map.insert(position, key, slot)
+
+    def evict_least_recent_item(self) -> None:
+        """
+        Evict the least recently used item
+        """
+        slot = self.tail
+        if slot == NIL:
+            return
+
+        key, value = self.slot_keys[slot], self.values[slot]
+        self.remove_item(slot)
+        self.spill(key, value)
+
+    def remove_item(self, slot: int) -> None:
+        """
+        Remove the item in slot from the map and the list and free the slot
+        """
+        self.unlink(slot)
+        del self.cache_map[self.slot_keys[slot]]
+        self.used_bytes -= self.sizes[slot]
+        self.slot_keys[slot] = None
+        self.values[slot] = None
+        self.sizes[slot] = 0
+        self.prev[slot] = NIL
+        self.next[slot] = self.free
+        self.free = slot
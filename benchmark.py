@@ -0,0 +1,873 @@
+"""
+Benchmarks for the DHT components.
+
+    python benchmark.py server [--connections N] [--requests N] [--concurrency N]
+    python benchmark.py workers [--worker-counts 1,2,4] [--clients N] [--connections N] [--requests N]
+    python benchmark.py ring [--nodes N] [--keys N] [--vnodes N]
+    python benchmark.py cache [--capacity N] [--shards N] [--operations N] [--disk-delay-us N]
+    python benchmark.py memory [--entries N]
+    python benchmark.py policies [--trace FILE] [--capacity N] [--operations N]
+    python benchmark.py writeback [--capacity N] [--operations N]
+    python benchmark.py parse [--operations N]
+    python benchmark.py compression [--value-size N] [--operations N]
+    python benchmark.py kademlia [--dht-nodes N] [--lookups N] [--latency-ms MS]
+    python benchmark.py cluster [--servers N] [--workload uniform|zipf|scan | --trace FILE]
+                                [--read-ratio F] [--clients N] [--rate N] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from protocol import AsyncPipelinedConnection, MAGIC_BINARY, FRAME_HEADER, encode_request, decode_request, decode_response
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Server on port {port} did not come up")
+
+
+def start_process(args: list, cwd: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable] + args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_server(port: int, extra_args: list, cwd: str) -> subprocess.Popen:
+    process = start_process([os.path.join(ROOT, 'dht.py'), '127.0.0.1', str(port)] + extra_args, cwd)
+    wait_for_port(port)
+    return process
+
+
+async def run_connection(port: int, index: int, requests: int, connect_times: list, latencies: list) -> None:
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    handshake = bytes([MAGIC_BINARY])
+    for request_id in range(requests):
+        key = f"k{index}x{request_id}"
+        op = ('set', key, 'v') if request_id % 2 == 0 else ('get', f"k{index}x{request_id - 1}", None)
+        payload = encode_request(request_id, [op])
+        sent = time.perf_counter()
+        writer.write(handshake + FRAME_HEADER.pack(len(payload)) + payload)
+        handshake = b''
+        (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        decode_response(await reader.readexactly(length))
+        latencies.append(time.perf_counter() - sent)
+        if request_id == 0:
+            connect_times.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def drive_connections(port: int, connections: int, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    connect_times, latencies = [], []
+
+    async def bounded(index):
+        async with semaphore:
+            await run_connection(port, index, requests, connect_times, latencies)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+    return {
+        "connections_per_sec": connections / elapsed,
+        "requests_per_sec": len(latencies) / elapsed,
+        "connect_p99_ms": percentile(connect_times, 99) * 1000,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def bench_server(args) -> dict:
+    """
+    Compare the thread-per-connection server with the asyncio server
+    """
+    report = {}
+    for name, extra_args in (('threaded', []), ('asyncio', ['--async'])):
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(port, extra_args, workdir)
+            try:
+                report[name] = asyncio.run(drive_connections(port, args.connections, args.requests, args.concurrency))
+            finally:
+                process.terminate()
+                process.wait()
+    return report
+
+
+def drive_from_process(port: int, connections: int, requests: int, concurrency: int) -> dict:
+    return asyncio.run(drive_connections(port, connections, requests, concurrency))
+
+
+def bench_workers(args) -> dict:
+    """
+    Throughput of one asyncio server with --workers N, driven from
+    --clients processes so a single client process is not the bottleneck
+    """
+    report = {}
+    counts = [int(count) for count in args.worker_counts.split(',')]
+    clients = max(1, min(args.clients, args.connections))
+    with multiprocessing.Pool(clients) as pool:
+        for count in counts:
+            with tempfile.TemporaryDirectory() as workdir:
+                port = free_port()
+                process = start_server(port, ['--async', '--workers', str(count)] + shlex.split(args.server_args), workdir)
+                # the port answers once the first worker listens, give the others time to start
+                time.sleep(1 + count * 0.5)
+                try:
+                    start = time.perf_counter()
+                    results = pool.starmap(drive_from_process, [(port, args.connections // clients, args.requests,
+                                                                 max(1, args.concurrency // clients))] * clients)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    process.terminate()
+                    process.wait()
+            requests = args.connections // clients * clients * args.requests
+            report[f"workers_{count}"] = {
+                "requests_per_sec": requests / elapsed,
+                "latency_p99_ms": max(result["latency_p99_ms"] for result in results),
+            }
+    baseline = report[f"workers_{counts[0]}"]["requests_per_sec"] / counts[0]
+    for count in counts:
+        # 1.0 means throughput grew linearly with the workers
+        report[f"workers_{count}"]["scaling_efficiency"] = report[f"workers_{count}"]["requests_per_sec"] / (baseline * count)
+    report["cpu_count"] = os.cpu_count()
+    return report
+
+
+def bench_ring(args) -> dict:
+    """
+    Key placement speed and load balance of the consistent hash ring
+    """
+    from coordinator_node import ConsistentHashing
+    nodes = [('127.0.0.1', 5000 + i) for i in range(args.nodes)]
+    keys = [f"key{i}" for i in range(args.keys)]
+    report = {}
+    for replicas in (1, args.vnodes):
+        ring = ConsistentHashing(nodes=nodes, replicas=replicas)
+        start = time.perf_counter()
+        for key in keys[:100000]:
+            ring.get_node(key)
+        single_rate = min(len(keys), 100000) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        placement = ring.get_nodes_batch(keys)
+        batch_rate = len(keys) / (time.perf_counter() - start)
+        loads = [0] * len(nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        for node in placement:
+            loads[index[node]] += 1
+        mean = len(keys) / len(nodes)
+        stddev = (sum((load - mean) ** 2 for load in loads) / len(nodes)) ** 0.5
+        report[f"vnodes_{replicas}"] = {
+            "lookups_per_sec": single_rate,
+            "batch_lookups_per_sec": batch_rate,
+            "load_stddev": stddev,
+            "load_stddev_pct_of_mean": 100 * stddev / mean,
+            "max_load_over_mean": max(loads) / mean,
+        }
+    return report
+
+
+def check_lru_invariants(cache) -> None:
+    """
+    Walk the history list of an LRUCache and make sure it matches the map
+    """
+    seen = 0
+    node = cache.history.head
+    previous = None
+    while node is not None:
+        assert node.prev is previous, "broken back link in history list"
+        assert cache.cache_map.get(node.key) is node, "history node missing from map"
+        previous = node
+        node = node.next
+        seen += 1
+    assert cache.history.tail is previous, "history tail out of sync"
+    assert seen == len(cache.cache_map) <= cache.capacity, "history length out of sync"
+
+
+class SingleLockCache:
+    """
+    LRUCache behind one lock, the baseline ShardedLRUCache is compared with
+    """
+    def __init__(self, capacity: int, disk_path: str):
+        import threading
+        from lruCache import LRUCache
+        self.cache = LRUCache(capacity, disk_path)
+        self.shards = [self.cache]
+        self.stats = self.cache.stats
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.cache.get(key)
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self.cache.put(key, value)
+
+    def close(self) -> None:
+        self.cache.close()
+
+
+def run_cache_threads(cache, threads: int, args) -> tuple:
+    """
+    Random gets and puts from several threads, returns (seconds, errors)
+    """
+    import random
+    import threading
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(args.operations // threads):
+                key = f"k{rng.randrange(args.capacity * 2)}"
+                if rng.random() < 0.2:
+                    cache.put(key, key.upper())
+                else:
+                    value = cache.get(key)
+                    assert value == -1 or value == key.upper(), f"corrupt value {value} for {key}"
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+
+def delayed(read, seconds: float):
+    """
+    Storage read that takes at least seconds, like one that misses the page cache
+    """
+    def read_slowly(key):
+        time.sleep(seconds)
+        return read(key)
+    return read_slowly
+
+
+def bench_cache(args) -> dict:
+    """
+    Multi-threaded stress and throughput of ShardedLRUCache by thread count,
+    next to a single LRUCache behind one lock
+    """
+    from shardedLruCache import ShardedLRUCache
+    report = {
+        "note": "cache operations are pure Python and hold the GIL, threads only overlap while reading "
+                "the disk tier, which the sharded cache does outside its locks. With disk reads served "
+                "from the page cache striping only adds work, --disk-delay-us shows slow reads",
+    }
+    caches = {
+        "sharded": lambda workdir: ShardedLRUCache(args.capacity, workdir, shards=args.shards),
+        "single_lock": lambda workdir: SingleLockCache(args.capacity, workdir),
+    }
+    for threads in (1, 2, 4, 8):
+        results = {}
+        for name, make_cache in caches.items():
+            with tempfile.TemporaryDirectory() as workdir:
+                cache = make_cache(workdir)
+                if args.disk_delay_us:
+                    for shard in cache.shards:
+                        shard.storage.read = delayed(shard.storage.read, args.disk_delay_us / 1e6)
+                elapsed, errors = run_cache_threads(cache, threads, args)
+                for shard in cache.shards:
+                    check_lru_invariants(shard)
+                results[name] = {
+                    "ops_per_sec": args.operations / elapsed,
+                    "errors": [str(e) for e in errors],
+                    "hit_rate": cache.stats.get_hit_rate(),
+                }
+                cache.close()
+        results["speedup"] = results["sharded"]["ops_per_sec"] / results["single_lock"]["ops_per_sec"]
+        report[f"threads_{threads}"] = results
+    return report
+
+
+def bench_memory(args) -> dict:
+    """
+    Memory held per cached entry by LRUCache and ArrayLRUCache, measured
+    with tracemalloc, and their put throughput, measured on a second fill
+    without it since tracing every allocation skews the timing
+    """
+    import tracemalloc
+    from lruCache import LRUCache
+    from arrayLruCache import ArrayLRUCache
+    entries = args.entries
+    keys = [f"key{i:09d}" for i in range(entries)]
+    values = [f"value{i:09d}" for i in range(entries)]
+    entry_bytes = len(keys[0]) + len(values[0])
+    report = {"entries": entries}
+    for name, make_cache in (('lru', lambda path: LRUCache(entries, path)),
+                             ('array_lru', lambda path: ArrayLRUCache(entries * entry_bytes, path))):
+        with tempfile.TemporaryDirectory() as workdir:
+            tracemalloc.start()
+            cache = make_cache(os.path.join(workdir, "traced"))
+            before = tracemalloc.get_traced_memory()[0]
+            for key, value in zip(keys, values):
+                cache.put(key, value)
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            assert len(cache.cache_map) == entries and cache.get(keys[0]) == values[0]
+            cache.close()
+            cache = make_cache(os.path.join(workdir, "timed"))
+            start = time.perf_counter()
+            for key, value in zip(keys, values):
+                cache.put(key, value)
+            elapsed = time.perf_counter() - start
+            cache.close()
+            report[name] = {
+                "bytes_per_entry": used / entries,
+                "total_mb": used / 1024 / 1024,
+                "puts_per_sec": entries / elapsed,
+            }
+    return report
+
+
+def zipf_sampler(keyspace: int, theta: float, rng):
+    """
+    Return a function drawing key indexes from a zipfian distribution
+    """
+    cumulative = list(itertools.accumulate(1.0 / (rank ** theta) for rank in range(1, keyspace + 1)))
+    return lambda count: rng.choices(range(keyspace), cum_weights=cumulative, k=count)
+
+
+def synthetic_policy_trace(capacity: int, operations: int, seed: int = 7) -> list:
+    """
+    Zipfian reads over a hot keyspace interrupted by one-off scans of cold
+    keys, the pattern that flushes a plain LRU
+    """
+    import random
+    rng = random.Random(seed)
+    sample = zipf_sampler(capacity * 10, 0.9, rng)
+    trace = []
+    scan_id = 0
+    while len(trace) < operations:
+        trace.extend(('get', f"hot{index}") for index in sample(capacity * 5))
+        trace.extend(('get', f"scan{scan_id}x{index}") for index in range(capacity * 2))
+        scan_id += 1
+    return trace[:operations]
+
+
+def load_trace(path: str) -> list:
+    """
+    Read a key trace: one `get <key>` or `set <key> <value>` per line, a
+    bare key counts as a get
+    """
+    trace = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] in ('get', 'set') and len(parts) > 1:
+                trace.append((parts[0], parts[1]))
+            else:
+                trace.append(('get', parts[0]))
+    return trace
+
+
+def bench_policies(args) -> dict:
+    """
+    Replay a key trace against every eviction policy and compare hit rates.
+    Reads that miss are filled with a set, as a cache-aside client would.
+    The disk tier ends up holding every key, so only reads served from
+    memory count as hits of the policy.
+    """
+    from policyCache import PolicyCache
+    from evictionPolicies import EVICTION_POLICIES
+    trace = load_trace(args.trace) if args.trace else synthetic_policy_trace(args.capacity, args.operations)
+    report = {"requests": len(trace), "capacity": args.capacity}
+    for policy in sorted(EVICTION_POLICIES):
+        with tempfile.TemporaryDirectory() as workdir:
+            cache = PolicyCache(args.capacity, workdir, policy=policy)
+            start = time.perf_counter()
+            for op, key in trace:
+                if op == 'set' or cache.get(key) == -1:
+                    cache.put(key, key)
+            elapsed = time.perf_counter() - start
+            stats = cache.stats
+            report[policy] = {
+                "hit_rate": stats.get_memory_hit_rate(),
+                "disk_hit_rate": stats.get_hit_rate() - stats.get_memory_hit_rate(),
+                "requests_per_sec": len(trace) / elapsed,
+            }
+            cache.close()
+    return report
+
+
+def bench_writeback(args) -> dict:
+    """
+    Put latency with a full cache, synchronous eviction against write-back,
+    for every durability mode
+    """
+    from hashtable import HashTable
+    from storage import DURABILITY_MODES
+    report = {}
+    for write_back in (False, True):
+        for durability in DURABILITY_MODES:
+            if durability == "batch" and not write_back:
+                # batch durability always buffers its writes
+                continue
+            with tempfile.TemporaryDirectory() as workdir:
+                ht = HashTable(capacity=args.capacity, disk_path=workdir, write_back=write_back, durability=durability)
+                for i in range(args.capacity):
+                    ht.set(f"warm{i}", "x" * 100)
+                latencies = []
+                start = time.perf_counter()
+                for i in range(args.operations):
+                    sent = time.perf_counter()
+                    ht.set(f"k{i}", "x" * 100)
+                    latencies.append(time.perf_counter() - sent)
+                elapsed = time.perf_counter() - start
+                ht.close()
+                report[f"{'write_back' if write_back else 'sync'}_{durability}"] = {
+                    "puts_per_sec": args.operations / elapsed,
+                    "latency_p50_us": percentile(latencies, 50) * 1e6,
+                    "latency_p99_us": percentile(latencies, 99) * 1e6,
+                }
+    return report
+
+
+def bench_kademlia(args) -> dict:
+    """
+    Simulated Kademlia network in one process. Nodes bootstrap through the
+    first node, values are stored from random nodes and then looked up
+    from random nodes with sequential (alpha 1) and parallel (alpha 3)
+    iterative lookups over links with --latency-ms of one-way delay.
+    """
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from kademlia import KademliaNode, InProcessTransport
+    rng = random.Random(7)
+    transport = InProcessTransport()
+    executor = ThreadPoolExecutor(max_workers=16)
+    nodes = [KademliaNode('10.0.0.1', 10000 + i, transport=transport, executor=executor)
+             for i in range(args.dht_nodes)]
+    for node in nodes:
+        transport.register(node)
+    start = time.perf_counter()
+    for node in nodes[1:]:
+        node.join(nodes[0].ip, nodes[0].port)
+    keys = [f"key{i}" for i in range(args.lookups)]
+    for key in keys:
+        rng.choice(nodes).store(key, f"value{key}")
+    report = {
+        "nodes": len(nodes),
+        "bootstrap_seconds": time.perf_counter() - start,
+        "mean_routing_table_size": sum(len(node.closest_nodes(0, 10 ** 6)) for node in nodes) / len(nodes),
+    }
+    delay = args.latency_ms / 1000
+    transport.latency = lambda: rng.uniform(0.5 * delay, 1.5 * delay)
+    for alpha in (1, 3):
+        for node in nodes:
+            node.alpha = alpha
+        hops, rpcs, latencies = [], [], []
+        found = 0
+        for key in keys:
+            node = rng.choice(nodes)
+            sent = time.perf_counter()
+            _, value, hop_count, rpc_count = node.iterative_find(node.hash(key), key)
+            latencies.append(time.perf_counter() - sent)
+            found += value == f"value{key}"
+            hops.append(hop_count)
+            rpcs.append(rpc_count)
+        report[f"alpha_{alpha}"] = {
+            "success_rate": found / len(keys),
+            "mean_hops": sum(hops) / len(hops),
+            "max_hops": max(hops),
+            "mean_rpcs": sum(rpcs) / len(rpcs),
+            "latency_p50_ms": percentile(latencies, 50) * 1000,
+            "latency_p99_ms": percentile(latencies, 99) * 1000,
+        }
+    # one hot key looked up from everywhere, with and without path caching
+    for path_caching in (False, True):
+        hot_key = f"hot{path_caching}"
+        rng.choice(nodes).store(hot_key, "hot")
+        for node in nodes:
+            node.path_caching = path_caching
+            node.values_served = 0
+        hops = []
+        for _ in range(args.lookups):
+            node = rng.choice(nodes)
+            hops.append(node.iterative_find(node.hash(hot_key), hot_key)[2])
+        served = sorted((node.values_served for node in nodes), reverse=True)
+        report[f"hot_key_{'cached' if path_caching else 'uncached'}"] = {
+            "mean_hops": sum(hops) / len(hops),
+            "nodes_serving": sum(1 for count in served if count),
+            "max_share_per_node": served[0] / args.lookups,
+        }
+    # churn: a fifth of the nodes leave, the rest drop them from their
+    # buckets as lookups fail and republish the values they hold
+    transport.latency = None
+    departed = rng.sample(nodes[1:], len(nodes) // 5)
+    for node in departed:
+        del transport.nodes[(node.ip, node.port)]
+    alive = [node for node in nodes if node not in departed]
+    for stage in ("churn_before_republish", "churn_after_republish"):
+        if stage == "churn_after_republish":
+            for node in alive:
+                node.republish_interval = 0
+                node.maintain()
+        found = 0
+        for key in keys:
+            node = rng.choice(alive)
+            found += node.iterative_find(node.hash(key), key)[1] == f"value{key}"
+        report[stage] = {"success_rate": found / len(keys)}
+    executor.shutdown()
+    return report
+
+
+def regex_parse_command(command: str):
+    """
+    The previous parser, one uncompiled re.match per command kind, kept as
+    the baseline of the parse benchmark
+    """
+    import re
+    set_ht = re.match('^set ([a-zA-Z0-9]+) ([a-zA-Z0-9]+)$', command)
+    get_ht = re.match('^get ([a-zA-Z0-9]+)$', command)
+    stats_ht = re.match('^stats$', command)
+    if set_ht:
+        return ('set',) + set_ht.groups()
+    if get_ht:
+        return ('get', get_ht.groups()[0], None)
+    if stats_ht:
+        return ('stats', None, None)
+    return None
+
+
+def bench_parse(args) -> dict:
+    """
+    Per command cost of parsing text commands and of encoding and decoding
+    binary frames
+    """
+    from protocol import parse_command
+    texts = [f"get key{i}" if i % 2 else f"set key{i} value{i}" for i in range(1000)]
+    report = {}
+    for name, parse in (('regex_baseline', regex_parse_command), ('tokenizer', parse_command)):
+        start = time.perf_counter()
+        for _ in range(args.operations // len(texts)):
+            for text in texts:
+                parse(text)
+        report[f"{name}_ns_per_command"] = (time.perf_counter() - start) / args.operations * 1e9
+    commands = [parse_command(text) for text in texts]
+    batches = [commands[i:i + 100] for i in range(0, len(commands), 100)]
+    rounds = args.operations // len(commands)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        payloads = [encode_request(1, batch) for batch in batches]
+    report["binary_encode_ns_per_command"] = (time.perf_counter() - start) / args.operations * 1e9
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            decode_request(payload)
+    report["binary_decode_ns_per_command"] = (time.perf_counter() - start) / args.operations * 1e9
+    return report
+
+
+def bench_compression(args) -> dict:
+    """
+    Ratio and throughput of every installed codec on small, similar JSON
+    values, one at a time with and without a trained dictionary and as
+    batches of 100 like a pipelined frame
+    """
+    import random
+    from compression import CODECS, Compressor, train_dictionary
+    rng = random.Random(7)
+    values = [json.dumps({"id": i, "user": f"user{rng.randrange(10000)}", "status": rng.choice(["active", "idle"]),
+                          "plan": rng.choice(["free", "pro", "team"]), "note": "x" * max(0, args.value_size - 90)}
+                         ).encode() for i in range(2000)]
+    dictionary = train_dictionary(values[:1000])
+    samples = values[1000:]
+    batches = [b''.join(samples[i:i + 100]) for i in range(0, len(samples), 100)]
+    rounds = max(1, args.operations // len(samples))
+    report = {}
+    for codec in CODECS:
+        for name, payloads, codec_dictionary in (('value', samples, None), ('value_dict', samples, dictionary),
+                                                 ('batch', batches, None)):
+            compressor = Compressor(codec, threshold=0, dictionary=codec_dictionary, min_saving=0)
+            raw = sum(len(payload) for payload in payloads)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                compressed = [compressor.encode(payload) for payload in payloads]
+            compress_time = (time.perf_counter() - start) / rounds
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for data in compressed:
+                    compressor.decode(data)
+            decompress_time = (time.perf_counter() - start) / rounds
+            report[f"{codec}_{name}"] = {
+                "ratio": raw / sum(len(data) for data in compressed),
+                "compress_mb_per_sec": raw / compress_time / 1e6,
+                "decompress_mb_per_sec": raw / decompress_time / 1e6,
+            }
+    return report
+
+
+def start_cluster(servers: int, server_args: list, coordinator_args: list, workdir: str) -> tuple:
+    """
+    Launch `servers` dht.py processes and a coordinator in front of them,
+    returns (coordinator port, processes)
+    """
+    processes = []
+    addresses = []
+    for index in range(servers):
+        server_dir = os.path.join(workdir, f"server{index}")
+        os.makedirs(server_dir)
+        port = free_port()
+        processes.append(start_server(port, server_args, server_dir))
+        addresses.append(f"127.0.0.1:{port}")
+    port = free_port()
+    processes.append(start_process([os.path.join(ROOT, 'coordinator_node.py'), '127.0.0.1', str(port)]
+                                   + addresses + coordinator_args, workdir))
+    wait_for_port(port)
+    return port, processes
+
+
+def synthetic_load_trace(workload: str, operations: int, keyspace: int, read_ratio: float,
+                         theta: float, seed: int = 7) -> list:
+    """
+    Reads and writes at the given mix over uniform, zipfian or sequential
+    (scan) keys
+    """
+    import random
+    rng = random.Random(seed)
+    if workload == 'zipf':
+        indexes = zipf_sampler(keyspace, theta, rng)(operations)
+    elif workload == 'scan':
+        indexes = [index % keyspace for index in range(operations)]
+    else:
+        indexes = [rng.randrange(keyspace) for _ in range(operations)]
+    return [('get' if rng.random() < read_ratio else 'set', f"key{index}") for index in indexes]
+
+
+class LoadResults:
+    def __init__(self):
+        self.latencies = []
+        self.gets = 0
+        self.found = 0
+        self.errors = 0
+
+    def record(self, commands: list, results: list, latency: float) -> None:
+        self.latencies.append(latency)
+        for (op, _, _), result in zip(commands, results):
+            if result.startswith("Error") and result != "Error: Non existent key":
+                self.errors += 1
+            if op == 'get':
+                self.gets += 1
+                self.found += not result.startswith("Error")
+
+
+async def run_load(port: int, requests: list, clients: int, rate: float) -> tuple:
+    """
+    Send the requests over `clients` connections. Without a rate every
+    connection keeps one request in flight (closed loop). With a rate
+    requests start on a fixed schedule whether or not earlier ones were
+    answered (open loop), and latency is measured from the scheduled start
+    so a stalled server is not hidden by a stalled client.
+    """
+    connections = [await AsyncPipelinedConnection.open(('127.0.0.1', port)) for _ in range(clients)]
+    results = LoadResults()
+    start = time.perf_counter()
+    if rate:
+        async def timed(connection, commands, scheduled):
+            response = await connection.submit(commands)
+            results.record(commands, response, time.perf_counter() - scheduled)
+
+        tasks = []
+        for index, commands in enumerate(requests):
+            scheduled = start + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(timed(connections[index % clients], commands, scheduled)))
+        await asyncio.gather(*tasks)
+    else:
+        position = itertools.count()
+
+        async def closed_loop(connection):
+            for index in position:
+                if index >= len(requests):
+                    return
+                sent = time.perf_counter()
+                response = await connection.submit(requests[index])
+                results.record(requests[index], response, time.perf_counter() - sent)
+
+        await asyncio.gather(*(closed_loop(connection) for connection in connections))
+    elapsed = time.perf_counter() - start
+    stats = json.loads((await connections[0].submit([('stats', None, None)]))[0])
+    for connection in connections:
+        connection.close()
+    return results, elapsed, stats
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Metrics that got worse than the baseline by more than `tolerance`
+    (a fraction)
+    """
+    regressions = []
+    checks = []
+    if report["mode"] == baseline.get("mode") == "closed":
+        # an open loop run's throughput is just its arrival rate
+        checks.append(("requests_per_sec", report["requests_per_sec"], baseline["requests_per_sec"], False))
+    for name, value in report["latency_ms"].items():
+        if name in baseline["latency_ms"] and name != "max":
+            checks.append((f"latency_{name}_ms", value, baseline["latency_ms"][name], True))
+    for name, value, previous, lower_is_better in checks:
+        if previous <= 0:
+            continue
+        change = (value - previous) / previous
+        if (change if lower_is_better else -change) > tolerance:
+            regressions.append({"metric": name, "baseline": previous, "current": value, "change": change})
+    return regressions
+
+
+def bench_cluster(args) -> dict:
+    """
+    Launch servers and a coordinator on localhost and drive them with a
+    replayed trace or a synthetic workload
+    """
+    if args.trace:
+        trace = load_trace(args.trace)
+        workload = args.trace
+    else:
+        trace = synthetic_load_trace(args.workload, args.load_operations, args.keyspace, args.read_ratio, args.theta)
+        workload = args.workload
+    value = 'v' * args.value_size
+    commands = [(op, key, value if op == 'set' else None) for op, key in trace]
+    requests = [commands[i:i + args.batch] for i in range(0, len(commands), args.batch)]
+    with tempfile.TemporaryDirectory() as workdir:
+        port, processes = start_cluster(args.servers, shlex.split(args.server_args),
+                                        shlex.split(args.coordinator_args), workdir)
+        try:
+            if args.preload and not args.trace:
+                keys = [('set', f"key{index}", value) for index in range(args.keyspace)]
+                asyncio.run(run_load(port, [keys[i:i + 100] for i in range(0, len(keys), 100)], args.clients, 0))
+            results, elapsed, stats = asyncio.run(run_load(port, requests, args.clients, args.rate))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+    report = {
+        "commit": git_commit(),
+        "workload": workload,
+        "mode": "open" if args.rate else "closed",
+        "servers": args.servers,
+        "clients": args.clients,
+        "operations": len(commands),
+        "requests": len(requests),
+        "duration_sec": elapsed,
+        "requests_per_sec": len(requests) / elapsed,
+        "operations_per_sec": len(commands) / elapsed,
+        "latency_ms": {f"p{pct:g}": percentile(results.latencies, pct) * 1000 for pct in (50, 90, 99, 99.9)},
+        "errors": results.errors,
+        "client_hit_rate": results.found / results.gets if results.gets else 0,
+        "server": {name: stats.get(name) for name in ("hit_rate", "memory_hit_rate", "latency")},
+    }
+    report["latency_ms"]["max"] = max(results.latencies, default=0) * 1000
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare_reports(report, json.load(f), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
+
+
+BENCHMARKS = {
+    'cache': bench_cache,
+    'cluster': bench_cluster,
+    'compression': bench_compression,
+    'kademlia': bench_kademlia,
+    'policies': bench_policies,
+    'memory': bench_memory,
+    'parse': bench_parse,
+    'ring': bench_ring,
+    'server': bench_server,
+    'workers': bench_workers,
+    'writeback': bench_writeback,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DHT benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=1000000)
+    parser.add_argument('--vnodes', type=int, default=160)
+    parser.add_argument('--capacity', type=int, default=10000)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--disk-delay-us', type=float, default=0,
+                        help="cache: add this much latency to every disk tier read")
+    parser.add_argument('--operations', type=int, default=200000)
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--trace', default=None, help="key trace file to replay")
+    parser.add_argument('--dht-nodes', type=int, default=300)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=2.0)
+    parser.add_argument('--servers', type=int, default=3)
+    parser.add_argument('--worker-counts', default='1,2,4', help="comma separated --workers values to compare")
+    parser.add_argument('--server-args', default='', help="extra dht.py arguments, e.g. \"--capacity 1000\"")
+    parser.add_argument('--coordinator-args', default='', help="extra coordinator_node.py arguments")
+    parser.add_argument('--workload', choices=['uniform', 'zipf', 'scan'], default='zipf')
+    parser.add_argument('--load-operations', type=int, default=20000)
+    parser.add_argument('--keyspace', type=int, default=10000)
+    parser.add_argument('--theta', type=float, default=0.99, help="zipfian skew")
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=1, help="commands per request")
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help="do not write the keyspace before the run")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=0, help="requests per second, open loop (0: closed loop)")
+    parser.add_argument('--output', default=None, help="also write the report to this file")
+    parser.add_argument('--baseline', default=None, help="earlier report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed regression as a fraction")
+    args = parser.parse_args()
+    report = BENCHMARKS[args.benchmark](args)
+    print(json.dumps(report, indent=4))
+    if report.get("regressions"):
+        sys.exit(1)
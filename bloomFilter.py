@@ -0,0 +1,65 @@
+import hashlib
+import math
+import os
+import struct
+
+HEADER = struct.Struct('!QIQ')
+
+
+class BloomFilter:
+    """
+    Bloom filter over the keys held in the disk tier. A negative answer is
+    definite, so lookups for keys that were never spilled skip the disk.
+    """
+    def __init__(self, expected_items: int = 1000000, false_positive_rate: float = 0.01):
+        self.size = max(8, int(-expected_items * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / expected_items * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str):
+        digest = hashlib.blake2b(str(key).encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def might_contain(self, key: str) -> bool:
+        for position in self.positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, path: str) -> None:
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(self.size, self.hash_count, self.count))
+            f.write(self.bits)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Load a filter saved by save(), None if missing or unreadable
+        """
+        try:
+            with open(path, 'rb') as f:
+                size, hash_count, count = HEADER.unpack(f.read(HEADER.size))
+                bits = bytearray(f.read())
+        except (OSError, struct.error):
+            return None
+        if len(bits) != (size + 7) // 8:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.size = size
+        bloom.hash_count = hash_count
+        bloom.bits = bits
+        bloom.count = count
+        return bloom
@@ -1,33 +1,23 @@
-import sys, socket
-from threading import Thread
+import sys
 from logger import Logger
-import json
+from protocol import parse_command, format_command
+from dhtClient import DHTClient
 
 logger = Logger(name='ClientLogger')
 
-def get_socket():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    return sock
-
 if len(sys.argv) != 3:
     logger.error("Correct usage: script, IP address, port number")
     exit()
 
 coordinator_ip_address = str(sys.argv[1])
 coordinator_port = int(sys.argv[2])
-coordinator = get_socket()
-coordinator.connect((coordinator_ip_address, coordinator_port))
-
-def listen_for_messages():
-    while True:
-        output = coordinator.recv(2048).decode()
-        if output:
-            logger.info(output)
+client = DHTClient((coordinator_ip_address, coordinator_port))
 
-t = Thread(target=listen_for_messages)
-t.daemon = True
-t.start()
+def report(command, future):
+    try:
+        logger.info("%s: %s", format_command(command), future.result())
+    except Exception as e:
+        logger.error("%s: %s", format_command(command), e)
 
 while True:
     commands = []
@@ -36,7 +26,13 @@ while True:
         command = input()
         if command.lower() == 'done':
             break
-        commands.append(command)
-    
-    json_data = json.dumps(commands)
-    coordinator.send(json_data.encode())
\ No newline at end of file
+        parsed = parse_command(command)
+        if parsed is None:
+            logger.error(f"Invalid command: {command}")
+            continue
+        commands.append(parsed)
+
+    # the commands go out as one request, results are logged as they arrive
+    for command, future in zip(commands, client.submit_many(commands)):
+        future.add_done_callback(lambda done, command=command: report(command, done))
+    logger.info(f"Sent {len(commands)} commands")
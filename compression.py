@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import threading
+import time
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+# Compressed data starts with the id of the codec that produced it, 0 marks
+# data sent as it is.
+RAW = 0
+
+
+class ZlibCodec:
+    name = 'zlib'
+    codec_id = 1
+
+    def __init__(self, dictionary: bytes = None, level: int = 6):
+        self.dictionary = dictionary
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        if self.dictionary is None:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.dictionary is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class ZstdCodec:
+    name = 'zstd'
+    codec_id = 2
+
+    def __init__(self, dictionary: bytes = None, level: int = 3):
+        self.level = level
+        self.dictionary = None
+        if dictionary is not None:
+            self.dictionary = zstandard.ZstdCompressionDict(dictionary)
+            self.dictionary.precompute_compress(level)
+        # zstd contexts are not thread-safe, every thread gets its own
+        self.contexts = threading.local()
+
+    def context(self):
+        if not hasattr(self.contexts, 'compressor'):
+            self.contexts.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+            self.contexts.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        return self.contexts
+
+    def compress(self, data: bytes) -> bytes:
+        return self.context().compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.context().decompressor.decompress(data)
+
+
+class Lz4Codec:
+    name = 'lz4'
+    codec_id = 3
+
+    def __init__(self, dictionary: bytes = None):
+        self.dictionary = dictionary or b''
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.block.compress(data, store_size=True, dict=self.dictionary)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.block.decompress(data, dict=self.dictionary)
+
+
+# Codecs usable in this process, fastest and best compressing first.
+CODECS = {}
+if zstandard is not None:
+    CODECS['zstd'] = ZstdCodec
+if lz4 is not None:
+    CODECS['lz4'] = Lz4Codec
+CODECS['zlib'] = ZlibCodec
+CODEC_CHOICES = ('auto', 'none', 'zstd', 'lz4', 'zlib')
+
+
+def dictionary_digest(dictionary: bytes) -> str:
+    return hashlib.blake2b(dictionary, digest_size=8).hexdigest()
+
+
+def load_dictionary(path: str):
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def train_dictionary(samples: list, size: int = 16 * 1024) -> bytes:
+    """
+    Build a dictionary from sample values (bytes). zstd's trainer is used
+    when installed, otherwise the samples themselves become a raw preset
+    dictionary, the most recent last since deflate matches nearby data
+    best.
+    """
+    if zstandard is not None and len(samples) >= 8:
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass
+    content = bytearray()
+    for sample in reversed(samples):
+        if len(content) + len(sample) > size:
+            break
+        content[:0] = sample
+    return bytes(content)
+
+
+class Compressor:
+    """
+    Adaptive compression with one codec. Data shorter than `threshold`
+    bytes is left as it is, and so is data the codec shrinks by less than
+    `min_saving`. After `give_up` such misses in a row the next `backoff`
+    payloads are not even tried, so incompressible traffic costs no CPU.
+    Any codec's output can be decompressed as long as it is installed,
+    also by a Compressor without a codec, which never compresses. The
+    reader and writer threads of a connection share its Compressor, so the
+    miss and backoff counters are updated under state_lock.
+    """
+    def __init__(self, codec: str = 'zlib', threshold: int = 512, dictionary: bytes = None, min_saving: float = 0.1,
+                 give_up: int = 8, backoff: int = 64, stats=None, lock=None, name: str = 'wire'):
+        self.codecs = {codec_class.codec_id: codec_class(dictionary) for codec_class in CODECS.values()}
+        self.codec = CODECS[codec](dictionary) if codec is not None else None
+        self.threshold = threshold
+        self.min_saving = min_saving
+        self.give_up = give_up
+        self.backoff = backoff
+        self.misses = 0
+        self.skip = 0
+        self.state_lock = threading.Lock()
+        self.stats = stats
+        self.lock = lock or threading.Lock()
+        self.name = name
+
+    def compress(self, data: bytes):
+        """
+        Codec id followed by the compressed data, None if compressing does
+        not pay
+        """
+        if self.codec is None:
+            return None
+        with self.state_lock:
+            skipped = len(data) < self.threshold or self.skip > 0
+            if skipped:
+                self.skip = max(0, self.skip - 1)
+        if skipped:
+            self.record(len(data), len(data), 0)
+            return None
+        start_time = time.perf_counter_ns()
+        compressed = self.codec.compress(data)
+        elapsed = time.perf_counter_ns() - start_time
+        missed = len(compressed) + 1 > len(data) * (1 - self.min_saving)
+        with self.state_lock:
+            if not missed:
+                self.misses = 0
+            else:
+                self.misses += 1
+                if self.misses >= self.give_up:
+                    self.misses = 0
+                    self.skip = self.backoff
+        if missed:
+            self.record(len(data), len(data), elapsed)
+            return None
+        self.record(len(data), len(compressed) + 1, elapsed)
+        return bytes([self.codec.codec_id]) + compressed
+
+    def decompress(self, data: bytes) -> bytes:
+        codec = self.codecs.get(data[0])
+        if codec is None:
+            raise ValueError(f"Data compressed with unavailable codec {data[0]}")
+        start_time = time.perf_counter_ns()
+        decompressed = codec.decompress(data[1:])
+        if self.stats is not None:
+            with self.lock:
+                self.stats.record_decompression(self.name, time.perf_counter_ns() - start_time)
+        return decompressed
+
+    def encode(self, data: bytes) -> bytes:
+        """
+        Compressed data, or data behind a RAW marker when that is smaller
+        """
+        compressed = self.compress(data)
+        return compressed if compressed is not None else bytes([RAW]) + data
+
+    def decode(self, data: bytes) -> bytes:
+        return data[1:] if data[0] == RAW else self.decompress(data)
+
+    def record(self, size: int, stored: int, elapsed: int) -> None:
+        if self.stats is not None:
+            with self.lock:
+                self.stats.record_compression(self.name, size, stored, elapsed)
+
+
+class CompressionOptions:
+    """
+    What one side of a connection offers. The connecting side sends its
+    codecs in order of preference and the digest of its dictionary, the
+    accepting side picks the first codec it supports too and uses the
+    dictionary only if both hold the same one.
+    """
+    def __init__(self, codec: str = 'auto', threshold: int = 512, dictionary: bytes = None, stats=None, lock=None):
+        if codec == 'auto':
+            self.codecs = list(CODECS)
+        elif codec == 'none':
+            self.codecs = []
+        elif codec in CODECS:
+            self.codecs = [codec]
+        else:
+            raise ValueError(f"Compression codec {codec} is not installed")
+        self.threshold = threshold
+        self.dictionary = dictionary
+        self.digest = dictionary_digest(dictionary) if dictionary is not None else ''
+        self.stats = stats
+        self.lock = lock
+
+    def compressor(self, codec: str, use_dictionary: bool):
+        if codec not in CODECS:
+            return None
+        return Compressor(codec, self.threshold, self.dictionary if use_dictionary else None,
+                          stats=self.stats, lock=self.lock)
+
+    def storage_compressor(self):
+        """
+        Compressor for the disk tier with the preferred codec, without the
+        dictionary so stored values stay readable if it changes
+        """
+        return Compressor(self.codecs[0] if self.codecs else None, self.threshold,
+                          stats=self.stats, lock=self.lock, name='disk')
+
+    def hello(self) -> list:
+        return [','.join(self.codecs), self.digest]
+
+    def accept(self, hello: list) -> tuple:
+        """
+        Answer a peer's hello, returns (reply, Compressor or None)
+        """
+        offered, digest = (hello + ['', ''])[:2]
+        codec = next((name for name in offered.split(',') if name in self.codecs), 'none')
+        use_dictionary = bool(digest) and digest == self.digest
+        return [codec, '1' if use_dictionary else '0'], self.compressor(codec, use_dictionary)
+
+    def finish(self, reply: list):
+        """
+        Compressor for the codec the peer picked, None for no compression
+        """
+        codec, use_dictionary = (reply + ['none', '0'])[:2]
+        return self.compressor(codec, use_dictionary == '1')
+
+
+if __name__ == "__main__":
+    from storage import create_storage
+    parser = argparse.ArgumentParser(description="Train a compression dictionary from the values on a server's disk tier")
+    parser.add_argument('output')
+    parser.add_argument('disk_paths', nargs='+', help="disk directories, e.g. cache_disk/127.0.0.1_5000/shard0")
+    parser.add_argument('--storage', choices=['log', 'json'], default='log')
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=16 * 1024)
+    args = parser.parse_args()
+    samples = []
+    for path in args.disk_paths:
+        storage = create_storage(args.storage, path)
+        for key in storage.keys()[:args.samples - len(samples)]:
+            value = storage.read(key)
+            if value != -1:
+                samples.append(value.encode('utf-8', 'surrogateescape'))
+        storage.close()
+    dictionary = train_dictionary(samples, args.size)
+    with open(args.output, 'wb') as f:
+        f.write(dictionary)
+    print(f"Wrote a {len(dictionary)} byte dictionary trained on {len(samples)} values")
@@ -1,128 +1,625 @@
-import sys, socket, threading, re, hashlib, bisect, json
-from queue import Queue
-from logger import Logger
+import socket, threading, bisect, json, itertools, argparse, time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from functools import partial
+from array import array
+from logger import Logger, configure_logging
+from nearCache import NearCache
+from admission import FairQueue
+from performance_statistics import PerformanceStatistics, CompressionStatistics, aggregate_statistics
+from migration import TOMBSTONE_TTL, KeyMigration, transfer_plan
+from replication import MISSING_KEY, QuorumOperation, VersionClock, LatencyTracker, encode_versioned
+from protocol import MULTI_KEY_OPS, ServerPool, has_empty_key, ring_hash, parse_command, accept_peer, recv_frame, send_frame, decode_request, encode_response
+from compression import CODEC_CHOICES, CompressionOptions, load_dictionary
 
 logger = Logger(name='CoordinatorLogger')
 
+# seconds a server has to answer before it counts as unavailable
+SERVER_TIMEOUT = 10.0
+
 class ConsistentHashing:
-    def __init__(self, nodes=None, replicas=1):
+    """
+    Consistent hash ring with virtual nodes. Every server owns `replicas`
+    points on the ring (scaled by its weight) which keeps the key
+    distribution even with only a handful of servers. Ring points are kept
+    in a sorted array of 64-bit hashes with the owning node of each point
+    at the same index in `ring_nodes`.
+    """
+    def __init__(self, nodes=None, replicas=160, weights=None):
         self.replicas = replicas
-        self.ring = dict()
-        self.sorted_keys = []
+        self.weights = dict(weights) if weights else {}
+        self.nodes = []
+        self.sorted_keys = array('Q')
+        self.ring_nodes = []
+        self.successor_tables = {}
         if nodes:
             for node in nodes:
-                self.add_node(node)
+                self.nodes.append(node)
+            self.rebuild()
 
     def hash(self, key: str) -> int:
-        return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16)
-
-    def add_node(self, node: str) -> None:
-        for i in range(self.replicas):
-            key = self.hash(f"{node}:{i}")
-            self.ring[key] = node
-            bisect.insort(self.sorted_keys, key)
-
-    def remove_node(self, node: str) -> None:
-        for i in range(self.replicas):
-            key = self.hash(f"{node}:{i}")
-            del self.ring[key]
-            self.sorted_keys.remove(key)
-
-    def get_node(self, key: str) -> str:
-        if not self.ring:
+        return ring_hash(key)
+
+    def virtual_nodes(self, node) -> int:
+        return max(1, int(round(self.replicas * self.weights.get(node, 1.0))))
+
+    def rebuild(self) -> None:
+        points = sorted((self.hash(f"{node}:{i}"), node)
+                        for node in self.nodes for i in range(self.virtual_nodes(node)))
+        self.sorted_keys = array('Q', (point for point, _ in points))
+        self.ring_nodes = [node for _, node in points]
+        self.successor_tables = {}
+
+    def add_node(self, node, weight: float = None) -> None:
+        if weight is not None:
+            self.weights[node] = weight
+        if node not in self.nodes:
+            self.nodes.append(node)
+        self.rebuild()
+
+    def copy(self):
+        return ConsistentHashing(list(self.nodes), self.replicas, self.weights)
+
+    def remove_node(self, node) -> None:
+        self.nodes.remove(node)
+        self.weights.pop(node, None)
+        self.rebuild()
+
+    def get_node(self, key: str):
+        if not self.ring_nodes:
             return None
-        hash_key = self.hash(key)
-        idx = bisect.bisect(self.sorted_keys, hash_key)
+        idx = bisect.bisect(self.sorted_keys, self.hash(key))
         if idx == len(self.sorted_keys):
             idx = 0
-        return self.ring[self.sorted_keys[idx]]
+        return self.ring_nodes[idx]
+
+    def ring_indexes(self, keys: list) -> list:
+        """
+        Ring position owning each key
+        """
+        sorted_keys = self.sorted_keys
+        size = len(sorted_keys)
+        search = bisect.bisect
+        return [search(sorted_keys, point) % size for point in map(ring_hash, keys)]
+
+    def get_nodes_batch(self, keys: list) -> list:
+        """
+        Place a whole batch of keys on the ring
+        """
+        if not self.ring_nodes:
+            return [None] * len(keys)
+        ring_nodes = self.ring_nodes
+        return [ring_nodes[idx] for idx in self.ring_indexes(keys)]
+
+    def successors(self, count: int) -> list:
+        """
+        For every ring position, the first `count` distinct nodes met
+        walking clockwise from it
+        """
+        table = self.successor_tables.get(count)
+        if table is None:
+            ring_nodes = self.ring_nodes
+            count = min(count, len(self.nodes))
+            table = []
+            for start in range(len(ring_nodes)):
+                preference = []
+                idx = start
+                while len(preference) < count:
+                    node = ring_nodes[idx]
+                    if node not in preference:
+                        preference.append(node)
+                    idx = (idx + 1) % len(ring_nodes)
+                table.append(tuple(preference))
+            self.successor_tables[count] = table
+        return table
+
+    def get_preference_list(self, key: str, count: int) -> tuple:
+        return self.get_preference_lists_batch([key], count)[0]
+
+    def get_preference_lists_batch(self, keys: list, count: int) -> list:
+        """
+        The `count` distinct servers responsible for each key, owner first
+        """
+        if not self.ring_nodes:
+            return [()] * len(keys)
+        table = self.successors(count)
+        return [table[idx] for idx in self.ring_indexes(keys)]
 
 class CoordinatorNode:
-    def __init__(self, ip: str, port: int, server_addresses: list):
+    def __init__(self, ip: str, port: int, server_addresses: list, pool_size: int = 4,
+                 virtual_nodes: int = 160, weights: dict = None, near_cache_size: int = 0,
+                 near_cache_ttl: float = 1.0, replication_factor: int = 1, read_quorum: int = None,
+                 write_quorum: int = None, hedged_reads: bool = True, hedge_percentile: float = 95,
+                 migration_batch: int = 256, migration_rate: float = 10000, compression: str = 'auto',
+                 compression_threshold: int = 512, compression_dictionary: bytes = None, client_queue_limit: int = 64,
+                 fair_quantum: int = 64, queue_slo: float = 0.5, server_timeout: float = SERVER_TIMEOUT):
+        if not 1 <= replication_factor <= len(server_addresses):
+            raise ValueError("Replication factor must be between 1 and the number of servers")
+        majority = replication_factor // 2 + 1
+        read_quorum = read_quorum or majority
+        write_quorum = write_quorum or majority
+        if not (1 <= read_quorum <= replication_factor and 1 <= write_quorum <= replication_factor):
+            raise ValueError("Read and write quorums must be between 1 and the replication factor")
         self.ip = ip
         self.port = port
         self.server_addresses = server_addresses
-        self.server_sockets = {addr: self.connect_to_server(addr) for addr in server_addresses}
-        self.request_queue = Queue()
-        self.consistent_hashing = ConsistentHashing(nodes=server_addresses)
+        self.pool_size = pool_size
+        self.server_timeout = server_timeout
+        # offered to servers and clients alike, the stats only hold what
+        # the coordinator compressed itself
+        self.compression_stats = PerformanceStatistics()
+        self.compression_lock = threading.Lock()
+        self.compression = CompressionOptions(compression, compression_threshold, compression_dictionary,
+                                              stats=self.compression_stats, lock=self.compression_lock)
+        self.server_pools = {addr: self.connect_to_server(addr) for addr in server_addresses}
+        # requests wait per client, see FairQueue
+        self.request_queue = FairQueue(client_queue_limit, fair_quantum, queue_slo)
+        self.consistent_hashing = ConsistentHashing(nodes=server_addresses, replicas=virtual_nodes, weights=weights)
+        self.near_cache = NearCache(near_cache_size, near_cache_ttl) if near_cache_size > 0 else None
+        self.replication_factor = replication_factor
+        self.read_quorum = read_quorum
+        self.write_quorum = write_quorum
+        self.hedged_reads = hedged_reads
+        self.hedge_percentile = hedge_percentile
+        self.version_clock = VersionClock()
+        self.latency = LatencyTracker()
+        self.hedged_reads_count = 0
+        self.read_repairs = 0
+        # ring before the running membership change, reads fall back to it
+        self.previous_ring = None
+        self.migration = None
+        self.migration_thread = None
+        self.failed_change = None
+        self.migration_batch = migration_batch
+        self.migration_rate = migration_rate
 
-    def connect_to_server(self, address: tuple) -> socket.socket:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect(address)
-        return sock
+    def connect_to_server(self, address: tuple) -> ServerPool:
+        return ServerPool(address, self.pool_size, self.compression if self.compression.codecs else None)
 
     def forward_request_to_server(self, command: str) -> str:
-        set_ht = re.match('^set ([a-zA-Z0-9]+) ([a-zA-Z0-9]+)$', command)
-        get_ht = re.match('^get ([a-zA-Z0-9]+)$', command)
-        stats_ht = re.match('^stats$', command)
-
-        if set_ht:
-            key = set_ht.groups()[0]
-            server_address = self.consistent_hashing.get_node(key)
-            server_socket = self.server_sockets[server_address]
-            server_socket.send(json.dumps([command]).encode())
-            response = server_socket.recv(2048).decode()
-            return response
-        elif get_ht:
-            key = get_ht.groups()[0]
-            server_address = self.consistent_hashing.get_node(key)
-            server_socket = self.server_sockets[server_address]
-            server_socket.send(json.dumps([command]).encode())
-            response = server_socket.recv(2048).decode()
-            return response
-        elif stats_ht:
-            results = []
-            for server_address, server_socket in self.server_sockets.items():
-                server_socket.send(json.dumps([command]).encode())
-                response = server_socket.recv(2048).decode()
-                results.append(json.loads(response)[0])
-            aggregated_stats = self.aggregate_stats(results)
-            return json.dumps(aggregated_stats, indent=4)
-        else:
+        return self.forward_commands([command])[0]
+
+    def forward_commands(self, commands: list) -> list:
+        """
+        Run a batch of text commands, see process_batch
+        """
+        return self.process_batch([parse_command(command) for command in commands])
+
+    def process_multi_key_batch(self, commands: list) -> list:
+        """
+        Split mget/mset/mdel into single key commands so every key goes to
+        its own replicas, then fold their results back into one result per
+        command
+        """
+        flat = []
+        spans = []
+        for command in commands:
+            start = len(flat)
+            if command is None or command[0] not in MULTI_KEY_OPS:
+                flat.append(command)
+            elif command[0] == 'mset':
+                keys, values = command[1], command[2]
+                if len(keys) != len(values):
+                    flat.append(None)
+                else:
+                    flat.extend(('set', key, value) for key, value in zip(keys, values))
+            else:
+                op = 'get' if command[0] == 'mget' else 'del'
+                flat.extend((op, key, None) for key in command[1])
+            spans.append((start, len(flat)))
+        flat_results = self.process_batch(flat)
+        results = []
+        for command, (start, end) in zip(commands, spans):
+            part = flat_results[start:end]
+            if command is None or command[0] not in MULTI_KEY_OPS:
+                results.append(part[0])
+                continue
+            errors = [result for result in part if result.startswith("Error") and result != MISSING_KEY]
+            if errors:
+                results.append(errors[0])
+            elif command[0] == 'mget':
+                results.append(json.dumps([None if result == MISSING_KEY else result for result in part]))
+            elif command[0] == 'mset':
+                results.append("Inserted")
+            else:
+                results.append(f"Deleted {sum(result == 'Deleted' for result in part)}")
+        return results
+
+    def process_batch(self, commands: list) -> list:
+        """
+        Scatter a batch of parsed commands to their replicas and gather the
+        results back in the original order. Each server receives a single
+        sub-batch and all sub-batches are in flight at the same time, so the
+        batch costs the slowest round trip instead of the sum of them.
+        Sets carry a last-write-wins version stamp and gets return the
+        newest version among the replicas that answered.
+        Invalid commands are passed in as None.
+        """
+        if any(command is not None and command[0] in MULTI_KEY_OPS for command in commands):
+            return self.process_multi_key_batch(commands)
+        results = [None] * len(commands)
+        stats_positions = []
+        keyed = []
+        written = set()
+        previous_ring = self.previous_ring
+        for position, command in enumerate(commands):
+            if command is None:
+                results[position] = "Error: Invalid command"
+            elif command[0] == 'stats':
+                stats_positions.append(position)
+            elif command[0] in ('join', 'leave'):
+                results[position] = self.change_membership(command[0], command[1])
+            elif has_empty_key(command):
+                results[position] = "Error: Empty key"
+            elif self.near_cache is None:
+                keyed.append(position)
+            elif command[0] != 'get':
+                self.near_cache.invalidate(command[1])
+                written.add(command[1])
+                keyed.append(position)
+            else:
+                # a key written earlier in this batch must be read from its owner
+                value = self.near_cache.get(command[1]) if command[1] not in written else None
+                if value is None:
+                    keyed.append(position)
+                else:
+                    results[position] = value
+
+        operations = []
+        assignments = {}
+        preference_lists = self.consistent_hashing.get_preference_lists_batch(
+            [commands[p][1] for p in keyed], self.replication_factor)
+        for position, replicas in zip(keyed, preference_lists):
+            command = commands[position]
+            if command[0] == 'get':
+                operation = QuorumOperation(position, command, replicas, self.read_quorum)
+            else:
+                if command[0] == 'set':
+                    command = (command[0], command[1], encode_versioned(command[2], self.version_clock.next()))
+                elif command[0] == 'setex':
+                    value, ttl = command[2]
+                    stamped = encode_versioned(value, self.version_clock.next(), time.time() + ttl)
+                    command = (command[0], command[1], (stamped, ttl))
+                elif command[0] == 'del' and previous_ring is not None:
+                    command = (command[0], command[1], str(TOMBSTONE_TTL))
+                operation = QuorumOperation(position, command, replicas, self.write_quorum)
+            operations.append(operation)
+        previous_deletes = []
+        if previous_ring is not None:
+            previous_deletes = self.delete_from_previous_owners(previous_ring, operations)
+            operations.extend(extra for _, extra in previous_deletes)
+        for operation in operations:
+            for replica in operation.initial_targets():
+                assignments.setdefault(replica, []).append(operation)
+        self.gather(operations, assignments)
+        for operation, extra in previous_deletes:
+            # the key may not have reached its new owner yet
+            operation.deleted = operation.deleted or extra.deleted
+        if self.previous_ring is not None:
+            self.read_from_previous_owners(operations)
+
+        for operation in operations:
+            if operation.position is None:
+                continue
+            result = operation.result()
+            results[operation.position] = result
+            if operation.is_read():
+                self.repair(operation)
+                if self.near_cache is not None and operation.key not in written and not result.startswith("Error"):
+                    self.near_cache.put(operation.key, result)
+        if stats_positions:
+            # collected last so the statistics include the rest of the batch
+            stats = self.collect_stats()
+            for position in stats_positions:
+                results[position] = stats
+        return results
+
+    def delete_from_previous_owners(self, previous_ring, operations: list) -> list:
+        """
+        While keys are being moved, deletes also go to the replicas of the
+        ring before the membership change, so reads falling back to them do
+        not find the key either. Returns (delete, extra operation) pairs,
+        the extra operations have no position in the batch.
+        """
+        deletes = [operation for operation in operations if operation.op == 'del']
+        if not deletes:
+            return []
+        preference_lists = previous_ring.get_preference_lists_batch(
+            [operation.key for operation in deletes], self.replication_factor)
+        extra = []
+        for operation, replicas in zip(deletes, preference_lists):
+            previous_owners = [replica for replica in replicas if replica not in operation.replicas]
+            if previous_owners:
+                extra.append((operation, QuorumOperation(None, ('del', operation.key, None), previous_owners, 1)))
+        return extra
+
+    def read_from_previous_owners(self, operations: list) -> None:
+        """
+        Keys of a range that is still being moved may not have reached
+        their new owner yet. Reads that found nothing are retried on the
+        replicas of the ring before the membership change.
+        """
+        previous_ring = self.previous_ring
+        missing = [operation for operation in operations
+                   if operation.is_read() and operation.result() == MISSING_KEY]
+        if previous_ring is None or not missing:
+            return
+        preference_lists = previous_ring.get_preference_lists_batch(
+            [operation.key for operation in missing], self.replication_factor)
+        fallbacks = []
+        assignments = {}
+        for operation, replicas in zip(missing, preference_lists):
+            if tuple(operation.replicas) == tuple(replicas):
+                continue
+            fallback = QuorumOperation(operation.position, (operation.op, operation.key, None), replicas, self.read_quorum)
+            fallbacks.append((operation, fallback))
+            for replica in fallback.initial_targets():
+                assignments.setdefault(replica, []).append(fallback)
+        self.gather([fallback for _, fallback in fallbacks], assignments)
+        for operation, fallback in fallbacks:
+            if fallback.successes >= fallback.required and fallback.latest()[2] is not None:
+                operation.responses = fallback.responses
+                operation.successes = fallback.successes
+
+    def change_membership(self, op: str, server: str) -> str:
+        """
+        Add a server to the ring or drain one out of it. The new ring takes
+        effect at once and the affected key ranges are streamed to their
+        new owners in the background. After a failed migration only the
+        same change is accepted, it resumes moving the keys.
+        """
+        if self.migration_thread is not None and self.migration_thread.is_alive():
+            return "Error: Migration in progress"
+        try:
+            address, weight = parse_server_address(server)
+        except ValueError:
             return "Error: Invalid command"
+        if self.migration is not None and self.migration.state == "failed":
+            # previous_ring still holds the keys that were not moved yet
+            if self.failed_change != (op, address):
+                return "Error: Previous migration failed, retry it first"
+            self.start_migration(op, address)
+            logger.info(f"Retrying membership change: {op} {address}")
+            return f"Migration restarted: {op} {server}"
+        old_ring = self.consistent_hashing
+        new_ring = old_ring.copy()
+        if op == 'join':
+            if address in old_ring.nodes:
+                return "Error: Server already in the ring"
+            try:
+                self.server_pools[address] = self.connect_to_server(address)
+            except OSError as e:
+                logger.error(f"Error connecting to server {address}: {e}")
+                return "Error: Server unavailable"
+            new_ring.add_node(address, weight)
+        else:
+            if address not in old_ring.nodes:
+                return "Error: Server not in the ring"
+            if len(old_ring.nodes) <= self.replication_factor:
+                return "Error: Not enough servers left for the replication factor"
+            new_ring.remove_node(address)
+        copies, drops = transfer_plan(old_ring, new_ring, self.replication_factor)
+        self.migration = KeyMigration(self.server_pools, copies, drops, self.migration_batch, self.migration_rate)
+        self.previous_ring = old_ring
+        self.consistent_hashing = new_ring
+        self.start_migration(op, address)
+        logger.info(f"Membership change: {op} {address}")
+        return f"Migration started: {op} {server}"
+
+    def start_migration(self, op: str, address: tuple) -> None:
+        self.failed_change = None
+        self.migration.state = "copying"
+        self.migration_thread = threading.Thread(target=self.migrate, args=(self.migration, op, address))
+        self.migration_thread.daemon = True
+        self.migration_thread.start()
+
+    def migrate(self, migration: KeyMigration, op: str, address: tuple) -> None:
+        try:
+            migration.copy_keys()
+            # every moved key has reached its new owner
+            self.previous_ring = None
+            migration.drop_keys()
+            if op == 'leave':
+                self.server_pools.pop(address).close()
+            migration.state = "done"
+            logger.info(f"Migration for {op} {address} finished")
+        except Exception as e:
+            self.failed_change = (op, address)
+            migration.state = "failed"
+            logger.error(f"Migration for {op} {address} failed: {e}")
+
+    def dispatch(self, assignments: dict, in_flight: dict) -> None:
+        """
+        Send each replica one sub-batch with the commands of its operations
+        """
+        for replica, operations in assignments.items():
+            sub_batch, runs = coalesce_commands([(operation.op, operation.key, operation.value)
+                                                 for operation in operations])
+            try:
+                future = self.server_pools[replica].submit(sub_batch)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            started = time.perf_counter()
+            future.add_done_callback(partial(self.record_latency, started))
+            in_flight[future] = (replica, operations, runs, started + self.server_timeout)
+
+    def record_latency(self, started: float, future: Future) -> None:
+        if future.exception() is None:
+            self.latency.record(time.perf_counter() - started)
+
+    def gather(self, operations: list, assignments: dict) -> None:
+        """
+        Wait until every operation reached its quorum or ran out of
+        replicas. A read whose replica failed moves on to the next one in
+        its preference list, and reads still waiting after the p95 round
+        trip are hedged to one more replica. Whichever answers first wins,
+        late answers are ignored. A server that has not answered within
+        server_timeout counts as failed, like one that cannot be reached.
+        """
+        in_flight = {}
+        self.dispatch(assignments, in_flight)
+        hedge_at = None
+        if self.hedged_reads and any(operation.needs_hedge() for operation in operations):
+            hedge_at = time.perf_counter() + self.latency.percentile(self.hedge_percentile)
+        while in_flight and not all(operation.done for operation in operations):
+            wake_at = min(deadline for _, _, _, deadline in in_flight.values())
+            if hedge_at is not None:
+                wake_at = min(wake_at, hedge_at)
+            done, _ = wait(in_flight, timeout=max(0, wake_at - time.perf_counter()), return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            retries = {}
+            if hedge_at is not None and not done and now >= hedge_at:
+                hedge_at = None
+                for operation in operations:
+                    if operation.needs_hedge():
+                        self.hedged_reads_count += 1
+                        retries.setdefault(operation.take_replica(), []).append(operation)
+            for future in done:
+                replica, replica_operations, runs, _ = in_flight.pop(future)
+                try:
+                    sub_results = split_results(future.result(), runs)
+                except Exception as e:
+                    self.fail_replica(replica, replica_operations, e, retries)
+                    continue
+                for operation, result in zip(replica_operations, sub_results):
+                    operation.record_result(replica, result)
+            for future in [future for future, (*_, deadline) in in_flight.items() if deadline <= now]:
+                replica, replica_operations, _, _ = in_flight.pop(future)
+                self.fail_replica(replica, replica_operations, TimeoutError("no answer in time"), retries)
+            self.dispatch(retries, in_flight)
+
+    def fail_replica(self, replica, operations: list, error: Exception, retries: dict) -> None:
+        """
+        Count a failed sub-batch against its operations and move the reads
+        that still need a reply on to their next replica
+        """
+        logger.error(f"Error forwarding request to server {replica}: {error}")
+        for operation in operations:
+            operation.record_failure()
+            if operation.needs_hedge():
+                retries.setdefault(operation.take_replica(), []).append(operation)
+
+    def repair(self, operation: QuorumOperation) -> None:
+        """
+        Write the newest version back to replicas that returned an older one
+        """
+        stale_replicas = operation.stale_replicas()
+        if not stale_replicas:
+            return
+        version, expires_at, value = operation.latest()
+        if expires_at is None:
+            command = [('set', operation.key, encode_versioned(value, version))]
+        elif expires_at > time.time():
+            # the replica's copy expires with the winner's
+            command = [('setex', operation.key, (encode_versioned(value, version, expires_at), expires_at - time.time()))]
+        else:
+            return
+        for replica in stale_replicas:
+            try:
+                self.server_pools[replica].submit(command)
+                self.read_repairs += 1
+            except Exception as e:
+                logger.error(f"Error repairing {operation.key} on server {replica}: {e}")
+
+    def collect_stats(self) -> str:
+        results = []
+        unavailable_servers = 0
+        futures = []
+        for address, pool in list(self.server_pools.items()):
+            try:
+                futures.append((address, pool.submit([('stats', None, None)])))
+            except Exception as e:
+                logger.error(f"Error collecting stats from server {address}: {e}")
+                unavailable_servers += 1
+        deadline = time.perf_counter() + self.server_timeout
+        for address, future in futures:
+            try:
+                results.append(json.loads(future.result(max(0, deadline - time.perf_counter()))[0]))
+            except Exception as e:
+                logger.error(f"Error collecting stats from server {address}: {e}")
+                unavailable_servers += 1
+        aggregated_stats = self.aggregate_stats(results)
+        aggregated_stats["unavailable_servers"] = unavailable_servers
+        if self.replication_factor > 1:
+            aggregated_stats.update({
+                "replication_factor": self.replication_factor,
+                "read_quorum": self.read_quorum,
+                "write_quorum": self.write_quorum,
+                "hedged_reads": self.hedged_reads_count,
+                "hedge_delay": self.latency.percentile(self.hedge_percentile),
+                "read_repairs": self.read_repairs,
+            })
+        if self.near_cache is not None:
+            aggregated_stats.update(self.near_cache.get_statistics())
+        if self.migration is not None:
+            aggregated_stats["migration"] = self.migration.get_statistics()
+        aggregated_stats.update(self.request_queue.get_statistics())
+        return json.dumps(aggregated_stats, indent=4)
 
     def aggregate_stats(self, stats_list: list) -> dict:
-        aggregated_stats = {
-            "hit_rate": 0,
-            "read_requests": 0,
-            "write_requests": 0,
-            "cache_read_time": 0,
-            "disk_read_time": 0
-        }
-        for stats in stats_list:
-            aggregated_stats["hit_rate"] += stats["hit_rate"]
-            aggregated_stats["read_requests"] += stats["read_requests"]
-            aggregated_stats["write_requests"] += stats["write_requests"]
-            aggregated_stats["cache_read_time"] += stats["cache_read_time"]
-            aggregated_stats["disk_read_time"] += stats["disk_read_time"]
-        num_servers = len(stats_list)
-        aggregated_stats["hit_rate"] /= num_servers
-        return aggregated_stats
+        """
+        Combine the statistics of every server, see aggregate_statistics
+        """
+        compression = {}
+        with self.compression_lock:
+            for name, statistics in self.compression_stats.compression.items():
+                compression.setdefault(name, CompressionStatistics()).merge(statistics)
+        return aggregate_statistics(stats_list, compression)
 
     def process_requests(self) -> None:
         while True:
-            conn, msg = self.request_queue.get()
+            (conn, compressor, request_id, msg), overloaded = self.request_queue.get()
             try:
-                logger.info(f"Processing request: {msg}")
-                commands = json.loads(msg)
-                results = [self.forward_request_to_server(command) for command in commands]
-                response = json.dumps(results)
-                conn.send(response.encode())
+                logger.debug("Processing request: %s", msg)
+                if request_id is None:
+                    # shed requests that waited past the SLO instead of adding to the backlog
+                    results = ["Error: overloaded"] * len(msg) if overloaded else self.forward_commands(msg)
+                    response = json.dumps(results)
+                    conn.send(response.encode())
+                else:
+                    try:
+                        results = ["Error: overloaded"] * len(msg) if overloaded else self.process_batch(msg)
+                    except Exception as e:
+                        # every pipelined request needs its reply, or the client waits for it forever
+                        logger.error(f"Error processing request {request_id}: {e}")
+                        results = ["Error: Internal error"] * len(msg)
+                    send_frame(conn, encode_response(request_id, results), compressor)
             except Exception as e:
                 logger.error(f"Error processing request: {e}")
-            finally:
-                self.request_queue.task_done()
 
     def process_request(self, conn: socket.socket) -> None:
-        while True:
-            try:
+        try:
+            binary, compressor = accept_peer(conn, self.compression)
+        except Exception as e:
+            logger.error(f"Error negotiating protocol with client: {e}")
+            return
+        self.request_queue.register(conn)
+        try:
+            while True:
+                # blocks while this client's queue is full, so it is not read any further
+                if binary:
+                    payload = recv_frame(conn, compressor)
+                    if payload is None:
+                        break
+                    request_id, commands = decode_request(payload)
+                    self.request_queue.put(conn, (conn, compressor, request_id, commands), len(commands))
+                    continue
                 msg = conn.recv(2048).decode()
                 if not msg:
                     break
-                self.request_queue.put((conn, msg))
-            except Exception as e:
-                logger.error(f"Error receiving message from client: {e}")
-                break
+                try:
+                    # parsed here so the request is charged for every command in it
+                    commands = json.loads(msg)
+                    if not isinstance(commands, list):
+                        raise ValueError("not a list of commands")
+                except ValueError as e:
+                    logger.error(f"Invalid request from client: {e}")
+                    continue
+                self.request_queue.put(conn, (conn, None, None, commands), len(commands))
+        except Exception as e:
+            logger.error(f"Error receiving message from client: {e}")
+        finally:
+            self.request_queue.unregister(conn)
 
     def listen_to_clients(self) -> None:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -138,7 +635,9 @@ class CoordinatorNode:
         while True:
             try:
                 client_socket, client_address = sock.accept()
-                logger.info(f"Connected to new client at address {client_address}")
+                # pipelined responses must not wait for the client's delayed ACK
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                logger.info("Connected to new client at address %s", client_address)
                 my_thread = threading.Thread(target=self.process_request, args=(client_socket,))
                 my_thread.daemon = True
                 my_thread.start()
@@ -146,15 +645,102 @@ class CoordinatorNode:
                 logger.error(f"Error accepting connection: {e}")
                 break
 
+def coalesce_commands(commands: list) -> tuple:
+    """
+    Merge runs of consecutive gets or sets into one mget or mset, which the
+    server runs in a single pass. Returns the new commands and the number
+    of original commands behind each of them.
+    """
+    coalesced = []
+    runs = []
+    for command in commands:
+        op = command[0]
+        if op in ('get', 'set') and runs and coalesced[-1][0] in (op, 'm' + op):
+            previous = coalesced[-1]
+            if previous[0] == op:
+                previous = coalesced[-1] = ('m' + op, [previous[1]], [previous[2]] if op == 'set' else None)
+            previous[1].append(command[1])
+            if op == 'set':
+                previous[2].append(command[2])
+            runs[-1] += 1
+        else:
+            coalesced.append(command)
+            runs.append(1)
+    return coalesced, runs
+
+
+def split_results(results: list, runs: list) -> list:
+    """
+    Results of coalesce_commands output back in the original command order
+    """
+    if len(results) == len(runs) and all(run == 1 for run in runs):
+        return results
+    split = []
+    for result, run in zip(results, runs):
+        if run == 1:
+            split.append(result)
+        elif result.startswith('['):
+            split.extend(MISSING_KEY if value is None else value for value in json.loads(result))
+        else:
+            # mset acknowledgement or an error for the whole run
+            split.extend([result] * run)
+    return split
+
+
+def parse_server_address(value: str) -> tuple:
+    """
+    Parse SERVER_IP:SERVER_PORT[:WEIGHT] into ((ip, port), weight)
+    """
+    parts = value.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"invalid server address {value}")
+    weight = float(parts[2]) if len(parts) > 2 else None
+    return (parts[0], int(parts[1])), weight
+
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print("Usage: python coordinator_node.py <IP> <PORT> <SERVER_IP:SERVER_PORT> ...")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="DHT coordinator node")
+    parser.add_argument('ip')
+    parser.add_argument('port', type=int)
+    parser.add_argument('servers', nargs='+', type=parse_server_address, metavar='SERVER_IP:SERVER_PORT[:WEIGHT]')
+    parser.add_argument('--near-cache', type=int, default=0,
+                        help="answer repeated gets from a coordinator cache of up to N keys")
+    parser.add_argument('--near-cache-ttl', type=float, default=1.0,
+                        help="seconds a near cache entry stays valid")
+    parser.add_argument('--replicas', type=int, default=1, help="store every key on N successive servers")
+    parser.add_argument('--read-quorum', type=int, default=None, help="replies needed for a get (majority by default)")
+    parser.add_argument('--write-quorum', type=int, default=None, help="acknowledgements needed for a set (majority by default)")
+    parser.add_argument('--no-hedged-reads', dest='hedged_reads', action='store_false',
+                        help="never send a slow read to an extra replica")
+    parser.add_argument('--server-timeout', type=float, default=SERVER_TIMEOUT,
+                        help="seconds a server has to answer before it counts as unavailable")
+    parser.add_argument('--migration-batch', type=int, default=256, help="keys per page when moving ranges")
+    parser.add_argument('--migration-rate', type=float, default=10000, help="keys per second moved between servers")
+    parser.add_argument('--compression', choices=CODEC_CHOICES, default='auto',
+                        help="codec offered to servers and clients, auto picks the best installed one")
+    parser.add_argument('--compression-threshold', type=int, default=512,
+                        help="frames smaller than this many bytes are not compressed")
+    parser.add_argument('--compression-dict', default=None,
+                        help="dictionary file used on connections whose peer has the same one")
+    parser.add_argument('--client-queue', type=int, default=64,
+                        help="requests queued per client before its connection stops being read")
+    parser.add_argument('--fair-quantum', type=int, default=64, help="commands served per client per round")
+    parser.add_argument('--queue-slo-ms', type=float, default=500,
+                        help="answer requests queued longer than this with an overloaded error, 0 to disable")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--log-rate', type=int, default=1000, help="log lines per second per logger, 0 for no limit")
+    args = parser.parse_args()
+    configure_logging(level=args.log_level, rate_limit=args.log_rate)
 
-    ip_address = str(sys.argv[1])
-    port = int(sys.argv[2])
-    server_addresses = [tuple(addr.split(':')) for addr in sys.argv[3:]]
-    server_addresses = [(ip, int(port)) for ip, port in server_addresses]
+    server_addresses = [address for address, _ in args.servers]
+    weights = {address: weight for address, weight in args.servers if weight is not None}
 
-    coordinator = CoordinatorNode(ip=ip_address, port=port, server_addresses=server_addresses)
+    coordinator = CoordinatorNode(ip=args.ip, port=args.port, server_addresses=server_addresses, weights=weights,
+                                  near_cache_size=args.near_cache, near_cache_ttl=args.near_cache_ttl,
+                                  replication_factor=args.replicas, read_quorum=args.read_quorum,
+                                  write_quorum=args.write_quorum, hedged_reads=args.hedged_reads,
+                                  migration_batch=args.migration_batch, migration_rate=args.migration_rate,
+                                  compression=args.compression, compression_threshold=args.compression_threshold,
+                                  compression_dictionary=load_dictionary(args.compression_dict),
+                                  client_queue_limit=args.client_queue, fair_quantum=args.fair_quantum,
+                                  queue_slo=args.queue_slo_ms / 1000, server_timeout=args.server_timeout)
     coordinator.listen_to_clients()
\ No newline at end of file
@@ -1,103 +1,563 @@
-import sys, re, socket, time
+import sys, os, socket, time, asyncio, argparse, signal, bisect, itertools, multiprocessing
+import multiprocessing.connection
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashtable import HashTable
-from threading import Thread
+from evictionPolicies import EVICTION_POLICIES
+from storage import DURABILITY_MODES, JsonFileStorage, legacy_json_files
+from expiry import encode_expiring
+from threading import Thread, Lock
 from queue import Queue
-from logger import Logger
+from logger import Logger, configure_logging
+from performance_statistics import PerformanceStatistics, aggregate_statistics
+from protocol import MAGIC_BINARY, MAGIC_COMPRESSED, FRAME_HEADER, MAX_FRAME_SIZE, MULTI_KEY_OPS, ProtocolError, ServerPool, has_empty_key, ring_hash, parse_command, accept_peer, negotiate, pack_items, unpack_items, decompress_payload, recv_frame, send_frame, decode_request, encode_response
+from compression import CODEC_CHOICES, CompressionOptions, load_dictionary
 import json
 
 logger = Logger(name='DHTLogger')
 
+# where the original server spilled evicted keys, one <key>.json per key
+LEGACY_DISK_PATH = "cache_disk"
+MAX_OPEN_SCANS = 8
+# Commands that go to the worker owning their key.
+KEYED_OPS = ('get', 'set', 'setex', 'del', 'migrate')
+FORWARD_TIMEOUT = 10.0
+# requests of one binary connection the async engine runs at the same time
+MAX_PIPELINED = 128
+
 class DHT:
-    def __init__(self, ip: str, port: int):
+    def __init__(self, ip: str, port: int, queue_workers: int = 1, snapshot_interval: float = 0,
+                 expiry_slice: int = 1000, compression: str = 'auto', compression_threshold: int = 512,
+                 compression_dictionary: bytes = None, worker_id: int = 0, workers: int = 1,
+                 import_legacy: bool = False, **table_options):
+        """
+        table_options are passed on to HashTable (capacity, storage, shards,
+        eviction_policy, ...). With a snapshot_interval the keys held in
+        memory are saved every that many seconds and on shutdown, and
+        loaded back on the next start. Keys whose time to live ran out are
+        deleted in the background, at most expiry_slice per timer tick.
+        compression picks the codec for values on disk and the codecs
+        offered to binary clients, see compression.CompressionOptions.
+        With several workers this is worker worker_id of a node whose
+        processes share the port, each owning the keys that hash to it.
+        import_legacy loads the keys spilled to disk by the original
+        server, without it their files are only reported.
+        """
         self.ip = ip
         self.port = port
-        self.ht = HashTable(capacity=10, disk_path="cache_disk")
+        self.worker_id = worker_id
+        self.workers = workers
+        self.peer_pools = {}
+        self.peer_lock = Lock()
+        # per-command latency, queue wait, traffic and compression, the cache keeps its own
+        self.stats = PerformanceStatistics()
+        self.stats_lock = Lock()
+        self.compression = CompressionOptions(compression, compression_threshold, compression_dictionary,
+                                              stats=self.stats, lock=self.stats_lock)
+        table_options['compressor'] = self.compression.storage_compressor()
+        if queue_workers > 1 and not table_options.get('shards'):
+            table_options['shards'] = queue_workers
+        if not table_options.get('shards'):
+            # the expiry and snapshot threads use the cache next to the request workers
+            table_options['shards'] = 1
+        self.node_path = os.path.join("cache_disk", f"{ip}_{port}")
+        disk_path = self.node_path if workers == 1 else os.path.join(self.node_path, f"worker{worker_id}")
+        self.ht = HashTable(disk_path=disk_path, **table_options)
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_path = os.path.join(disk_path, "snapshot.bin")
+        self.snapshot_lock = Lock()
+        if snapshot_interval > 0:
+            start_time = time.perf_counter()
+            restored = self.ht.load_snapshot(self.snapshot_path)
+            logger.info(f"Restored {restored} keys from snapshot in {time.perf_counter() - start_time:.3f} seconds")
+            snapshot_thread = Thread(target=self.snapshot_loop)
+            snapshot_thread.daemon = True
+            snapshot_thread.start()
+        if import_legacy:
+            imported = self.import_legacy_files(LEGACY_DISK_PATH)
+            logger.info(f"Imported {imported} keys from {LEGACY_DISK_PATH}")
+        elif worker_id == 0 and legacy_json_files(LEGACY_DISK_PATH):
+            logger.warning(f"{len(legacy_json_files(LEGACY_DISK_PATH))} key files of an older version in "
+                           f"{LEGACY_DISK_PATH} are not served, start with --import-legacy-disk to load them")
+        self.expiry_slice = expiry_slice
+        self.ht.schedule_sweep()
+        expiry_thread = Thread(target=self.expiry_loop)
+        expiry_thread.daemon = True
+        expiry_thread.start()
+        self.queue_workers = queue_workers
         self.request_queue = Queue()
+        self.scans = {}
+        self.scan_ids = itertools.count(1)
+        self.scan_lock = Lock()
+
+    def import_legacy_files(self, path: str) -> int:
+        """
+        Load the keys an older version spilled to path into this server
+        and remove their files. Values written since are kept. With several
+        workers each one takes the keys it owns. Returns the number of keys
+        loaded.
+        """
+        imported = 0
+        for file_path in legacy_json_files(path):
+            items = JsonFileStorage.read_file(file_path)
+            if not items or self.workers > 1 and any(self.owner(key) != self.worker_id for key in items):
+                continue
+            try:
+                for key, value in items.items():
+                    # untagged values would be read back as they are, tag them anyway
+                    imported += self.ht.set_if_absent(key, encode_expiring(value))
+            except ValueError as e:
+                logger.error(f"Error importing {file_path}: {e}")
+                continue
+            os.remove(file_path)
+        return imported
 
     def handle_command(self, command: str) -> str:
-        set_ht = re.match('^set ([a-zA-Z0-9]+) ([a-zA-Z0-9]+)$', command)
-        get_ht = re.match('^get ([a-zA-Z0-9]+)$', command)
-        stats_ht = re.match('^stats$', command)
-
-        start_time = time.time()
-        if set_ht:
-            key, value = set_ht.groups()
-            self.ht.set(key=key, value=value)
-            output = "Inserted"
-            logger.info(f"Inserted key: {key} value: {value}")
-
-        elif get_ht:
-            key = get_ht.groups()[0]
+        parsed = parse_command(command)
+        if parsed is None:
+            logger.error(f"Invalid command: {command}")
+            return "Error: Invalid command"
+        return self.execute_command(*parsed)
+
+    def execute_command(self, op: str, key: str = None, value: str = None) -> str:
+        start_time = time.perf_counter_ns()
+        if has_empty_key((op, key, value)):
+            output = "Error: Empty key"
+
+        elif op == 'set':
+            try:
+                self.ht.set(key=key, value=value)
+                output = "Inserted"
+            except ValueError as e:
+                output = f"Error: {e}"
+
+        elif op == 'setex':
+            value, ttl = value
+            if not 0 < ttl < float('inf'):
+                output = "Error: Invalid expire time"
+            else:
+                try:
+                    self.ht.set(key=key, value=value, ttl=ttl)
+                    output = "Inserted"
+                except ValueError as e:
+                    output = f"Error: {e}"
+
+        elif op == 'get':
             output = self.ht.get(key=key)
-            if output is None:
+            if output is None or output == -1:
                 output = "Error: Non existent key"
-                logger.warning(f"Key {key} does not exist")
+        elif op == 'mget':
+            values = self.ht.get_many(key)
+            output = json.dumps([None if value is None or value == -1 else value for value in values])
+
+        elif op == 'mset':
+            if len(key) != len(value):
+                output = "Error: Invalid command"
             else:
-                logger.info(f"Retrieved value: {output}")
-        elif stats_ht:
+                try:
+                    self.ht.set_many(key, value)
+                    output = "Inserted"
+                except ValueError as e:
+                    output = f"Error: {e}"
+
+        elif op == 'mdel':
+            output = f"Deleted {self.ht.delete_many(key)}"
+
+        elif op == 'stats':
             output = self.get_performance_statistics()
             logger.info("Performance statistics requested")
 
+        elif op == 'del' and value is not None:
+            # sent by the coordinator while keys are being migrated
+            try:
+                tombstone_ttl = float(value)
+            except ValueError:
+                tombstone_ttl = 0
+            if not 0 < tombstone_ttl < float('inf'):
+                output = "Error: Invalid expire time"
+            else:
+                output = "Deleted" if self.ht.delete(key, tombstone_ttl) else "Error: Non existent key"
+
+        elif op == 'del':
+            output = "Deleted" if self.ht.delete(key) else "Error: Non existent key"
+
+        elif op == 'migrate':
+            try:
+                output = "Inserted" if self.ht.set_if_absent(key, value) else "Exists"
+            except ValueError as e:
+                output = f"Error: {e}"
+
+        elif op == 'scan':
+            output = self.scan(key, value)
+            logger.info("Key scan requested")
+
         else:
             output = "Error: Invalid command"
-            logger.error(f"Invalid command: {command}")
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"Time taken for command '{command}': {elapsed_time:.6f} seconds")
+            logger.error("Invalid command: %s", op)
+        self.record_request(op, key, start_time)
         return output
+
+    def record_request(self, op: str, key, start_time: int) -> None:
+        with self.stats_lock:
+            elapsed_time = self.stats.record_latency(op, start_time) / 1e9
+        logger.request("Command '%s %s' took %.6f seconds", op, key, elapsed_time, duration=elapsed_time)
     
+    def scan(self, cursor: str, options: str) -> str:
+        """
+        Page through the stored keys whose ring hash falls in the requested
+        [start, end) ranges, for moving them to another server. The first
+        call (no cursor) snapshots the matching keys, later calls pass back
+        the cursor it returned until that is null.
+        """
+        try:
+            request = json.loads(options)
+            count = int(request.get("count", 512))
+            with self.scan_lock:
+                if cursor is None:
+                    ranges = sorted(request["ranges"])
+                    starts = [start for start, _ in ranges]
+                    keys = []
+                    for key in self.ht.keys():
+                        point = ring_hash(key)
+                        position = bisect.bisect(starts, point) - 1
+                        if position >= 0 and point < ranges[position][1]:
+                            keys.append(key)
+                    scan_id = next(self.scan_ids)
+                    self.scans[scan_id] = keys
+                    while len(self.scans) > MAX_OPEN_SCANS:
+                        # drop scans abandoned by their coordinator
+                        del self.scans[next(iter(self.scans))]
+                    offset = 0
+                else:
+                    scan_id, offset = (int(part) for part in cursor.split(':'))
+                    keys = self.scans.get(scan_id)
+                    if keys is None:
+                        return "Error: Unknown scan cursor"
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid scan request: {e}")
+            return "Error: Invalid command"
+        items = []
+        for key in keys[offset:offset + count]:
+            # the stored value, so the key keeps its expiry time on the new server
+            value = self.ht.peek_stored(key)
+            if value != -1:
+                items.append([key, value])
+        offset += count
+        next_cursor = f"{scan_id}:{offset}"
+        if offset >= len(keys):
+            next_cursor = None
+            with self.scan_lock:
+                self.scans.pop(scan_id, None)
+        return json.dumps({"cursor": next_cursor, "items": items})
+
+    def expiry_loop(self) -> None:
+        while True:
+            time.sleep(self.ht.timers.tick)
+            try:
+                reclaimed = self.ht.reclaim_expired(self.expiry_slice)
+                if reclaimed:
+                    logger.debug("Reclaimed %d expired keys", reclaimed)
+            except Exception as e:
+                logger.error(f"Error reclaiming expired keys: {e}")
+
+    def snapshot_loop(self) -> None:
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+    def save_snapshot(self, clean: bool = False) -> None:
+        try:
+            start_time = time.perf_counter()
+            with self.snapshot_lock:
+                saved = self.ht.save_snapshot(self.snapshot_path, clean)
+            logger.info(f"Saved {saved} keys to snapshot in {time.perf_counter() - start_time:.3f} seconds")
+        except OSError as e:
+            logger.error(f"Error saving snapshot: {e}")
+
+    def shutdown(self) -> None:
+        logger.info("Shutting down")
+        if self.snapshot_interval > 0:
+            self.save_snapshot(clean=True)
+        self.ht.close()
+        with self.peer_lock:
+            for pool in self.peer_pools.values():
+                pool.close()
+        if self.workers > 1 and os.path.exists(self.worker_socket(self.worker_id)):
+            os.unlink(self.worker_socket(self.worker_id))
+
     def get_performance_statistics(self) -> str:
-        stats = self.ht.cache.stats.get_statistics()
-        return json.dumps(stats, indent=4)
+        stats = PerformanceStatistics()
+        with self.stats_lock:
+            stats.merge(self.stats)
+        stats.merge(self.ht.cache.stats)
+        statistics = stats.get_statistics()
+        statistics["expired_keys"] = self.ht.expired_keys
+        statistics["expiring_keys"] = len(self.ht.timers)
+        return json.dumps(statistics, indent=4)
+
+    def record_traffic(self, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        with self.stats_lock:
+            self.stats.record_bytes(bytes_in, bytes_out)
 
     def handle_commands(self, commands: list) -> list:
-        results = []
+        parsed = self.parse_commands(commands)
+        results = iter(self.execute_batch([command for command in parsed if command is not None]))
+        return ["Error: Invalid command" if command is None else next(results) for command in parsed]
+
+    def parse_commands(self, commands: list) -> list:
+        parsed = [parse_command(command) for command in commands]
+        for command, parsed_command in zip(commands, parsed):
+            if parsed_command is None:
+                logger.error(f"Invalid command: {command}")
+        return parsed
+
+    def execute_batch(self, commands: list) -> list:
+        """
+        Run parsed commands, sending those for keys of other workers to
+        their owners and running them at the same time as the local ones
+        """
+        if self.workers == 1:
+            return [self.execute_command(*command) for command in commands]
+        parts, plans = self.route(commands)
+        futures = {worker: self.forward(worker, batch) for worker, batch in parts.items() if worker != self.worker_id}
+        results = {}
+        if self.worker_id in parts:
+            results[self.worker_id] = [self.execute_command(*command) for command in parts[self.worker_id]]
+        for worker, future in futures.items():
+            try:
+                results[worker] = future.result(FORWARD_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error forwarding to worker {worker}: {e}")
+                results[worker] = ["Error: Worker unavailable"] * len(parts[worker])
+        return self.assemble(commands, plans, results)
+
+    def owner(self, key: str) -> int:
+        return ring_hash(key) % self.workers
+
+    def worker_socket(self, worker: int) -> str:
+        return os.path.join(self.node_path, f"worker{worker}.sock")
+
+    def forward(self, worker: int, commands: list) -> Future:
+        try:
+            with self.peer_lock:
+                pool = self.peer_pools.get(worker)
+                if pool is None:
+                    pool = self.peer_pools[worker] = ServerPool(self.worker_socket(worker), 2)
+            return pool.submit(commands)
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def route(self, commands: list) -> tuple:
+        """
+        Split a batch by the worker owning each key. Returns the commands
+        for every worker and, for every original command, the (worker,
+        index) of its parts, with the key positions of multi-key parts.
+        """
+        parts = {}
+        plans = []
+
+        def add(worker, command, positions=None):
+            batch = parts.setdefault(worker, [])
+            batch.append(command)
+            return worker, len(batch) - 1, positions
+
         for command in commands:
-            result = self.handle_command(command)
-            results.append(result)
-        return results
+            op, key, value = command
+            if op in MULTI_KEY_OPS and not (op == 'mset' and len(key) != len(value)):
+                groups = {}
+                for position, item in enumerate(key):
+                    groups.setdefault(self.owner(item), []).append(position)
+                plans.append([add(worker, (op, [key[p] for p in positions],
+                                           [value[p] for p in positions] if op == 'mset' else None), positions)
+                              for worker, positions in groups.items()])
+            elif op == 'stats':
+                plans.append([add(worker, command) for worker in range(self.workers)])
+            elif op == 'scan' and self.scan_worker(key) is not None:
+                cursor = key.partition(':')[2] if key else ''
+                plans.append([add(self.scan_worker(key), (op, cursor or None, value))])
+            elif op in KEYED_OPS and key is not None:
+                plans.append([add(self.owner(key), command)])
+            else:
+                plans.append([add(self.worker_id, command)])
+        return parts, plans
+
+    def scan_worker(self, cursor: str):
+        """
+        Worker a scan cursor continues on, workers are scanned one after
+        another and their cursors prefixed with "worker:"
+        """
+        worker = (cursor or '0:').partition(':')[0]
+        return int(worker) if worker.isdigit() and int(worker) < self.workers else None
+
+    def assemble(self, commands: list, plans: list, results: dict) -> list:
+        """
+        Combine the results of the parts of every command, see route
+        """
+        output = []
+        for (op, key, _), placed in zip(commands, plans):
+            answers = [results[worker][index] for worker, index, _ in placed]
+            errors = [answer for answer in answers if answer.startswith("Error")]
+            if op == 'stats':
+                output.append(self.aggregate_worker_stats(answers))
+            elif op == 'scan' and not errors and self.scan_worker(key) is not None:
+                worker = placed[0][0]
+                page = json.loads(answers[0])
+                if page["cursor"] is not None:
+                    page["cursor"] = f"{worker}:{page['cursor']}"
+                elif worker + 1 < self.workers:
+                    page["cursor"] = f"{worker + 1}:"
+                output.append(json.dumps(page))
+            elif op not in MULTI_KEY_OPS or len(placed) == 1 and placed[0][2] is None:
+                output.append(answers[0])
+            elif errors:
+                output.append(errors[0])
+            elif op == 'mget':
+                values = [None] * len(key)
+                for (_, _, positions), answer in zip(placed, answers):
+                    for position, value in zip(positions, json.loads(answer)):
+                        values[position] = value
+                output.append(json.dumps(values))
+            elif op == 'mdel':
+                output.append(f"Deleted {sum(int(answer.split()[-1]) for answer in answers)}")
+            else:
+                output.append("Inserted")
+        return output
+
+    def aggregate_worker_stats(self, answers: list) -> str:
+        reports = [json.loads(answer) for answer in answers if not answer.startswith("Error")]
+        statistics = aggregate_statistics(reports)
+        statistics["eviction_policy"] = reports[0]["eviction_policy"] if reports else None
+        statistics["workers"] = self.workers
+        statistics["unavailable_workers"] = len(answers) - len(reports)
+        return json.dumps(statistics, indent=4)
     
     def process_requests_from_queue(self) -> None:
         while True:
-            conn, msg = self.request_queue.get() #Get the request from the queue
+            conn, send_lock, compressor, request_id, msg, enqueued_at = self.request_queue.get() #Get the request from the queue
+            with self.stats_lock:
+                self.stats.record_latency('queue_wait', enqueued_at)
             try:
-                logger.info(f"Processing request: {msg}")
-                commands = json.loads(msg)
-                results = self.handle_commands(commands)
-                response = json.dumps(results)
-                conn.send(response.encode())
+                logger.debug("Processing request: %s", msg)
+                if request_id is None:
+                    commands = json.loads(msg)
+                    results = self.handle_commands(commands)
+                    response = json.dumps(results).encode()
+                    with send_lock:
+                        conn.sendall(response)
+                    self.record_traffic(bytes_out=len(response))
+                else:
+                    try:
+                        results = self.execute_batch(msg)
+                    except Exception as e:
+                        # every pipelined request needs its reply, or the client waits for it forever
+                        logger.error(f"Error processing request {request_id}: {e}")
+                        results = ["Error: Internal error"] * len(msg)
+                    payload = encode_response(request_id, results)
+                    if compressor is not None:
+                        payload = compressor.encode(payload)
+                    with send_lock:
+                        send_frame(conn, payload)
+                    self.record_traffic(bytes_out=FRAME_HEADER.size + len(payload))
             except Exception as e:
                 logger.error(f"Error processing request: {e}")
             finally:
                 self.request_queue.task_done() #Mark the request as done
     
     def client_handler(self, conn: socket.socket) -> None:
+        try:
+            binary, compressor = accept_peer(conn, self.compression)
+        except Exception as e:
+            logger.error(f"Error negotiating protocol with client: {e}")
+            return
+        # several queue workers can answer requests of this connection at once
+        send_lock = Lock()
         while True:
             try:
-                msg = conn.recv(2048).decode()
+                if binary:
+                    payload = recv_frame(conn)
+                    if payload is None:
+                        break
+                    self.record_traffic(bytes_in=FRAME_HEADER.size + len(payload))
+                    if compressor is not None:
+                        payload = decompress_payload(payload, compressor)
+                    request_id, commands = decode_request(payload)
+                    self.request_queue.put((conn, send_lock, compressor, request_id, commands, time.perf_counter_ns()))
+                    continue
+                msg = conn.recv(2048)
                 if not msg:
                     break
-                self.request_queue.put((conn, msg)) #Add the request to the queue
+                self.record_traffic(bytes_in=len(msg))
+                self.request_queue.put((conn, send_lock, None, None, msg.decode(), time.perf_counter_ns())) #Add the request to the queue
             except Exception as e:
                 logger.error(f"Error processing message from client: {e}")
                 break
     
+    def serve_forwarded(self, conn: socket.socket) -> None:
+        """
+        Run the commands other workers forward for keys owned by this one
+        """
+        try:
+            binary, _ = accept_peer(conn)
+            while binary:
+                payload = recv_frame(conn)
+                if payload is None:
+                    break
+                request_id, commands = decode_request(payload)
+                try:
+                    results = [self.execute_command(*command) for command in commands]
+                except Exception as e:
+                    logger.error(f"Error processing forwarded request {request_id}: {e}")
+                    results = ["Error: Internal error"] * len(commands)
+                send_frame(conn, encode_response(request_id, results))
+        except Exception as e:
+            logger.error(f"Error processing forwarded request: {e}")
+        finally:
+            conn.close()
+
+    def listen_to_workers(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.bind_worker_socket())
+        sock.listen(64)
+        while True:
+            conn, _ = sock.accept()
+            forwarded_thread = Thread(target=self.serve_forwarded, args=(conn,))
+            forwarded_thread.daemon = True
+            forwarded_thread.start()
+
+    def bind_worker_socket(self) -> str:
+        path = self.worker_socket(self.worker_id)
+        os.makedirs(self.node_path, exist_ok=True)
+        if os.path.exists(path):
+            # left behind by a previous run of this worker
+            os.unlink(path)
+        return path
+
     def listen_to_clients(self) -> None:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers > 1:
+            # the kernel spreads new connections over the workers
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            workers_thread = Thread(target=self.listen_to_workers)
+            workers_thread.daemon = True
+            workers_thread.start()
         sock.bind((self.ip, int(self.port)))
         sock.listen(5)
-        logger.info(f"Listening on  {self.ip}:{self.port}")
+        logger.info(f"Listening on  {self.ip}:{self.port}" + (f" (worker {self.worker_id})" if self.workers > 1 else ""))
 
-        # Start the thread to process requests
-        process_requestThread = Thread(target=self.process_requests_from_queue)
-        process_requestThread.daemon = True
-        process_requestThread.start()
+        # Start the threads to process requests
+        for _ in range(self.queue_workers):
+            process_requestThread = Thread(target=self.process_requests_from_queue)
+            process_requestThread.daemon = True
+            process_requestThread.start()
 
         while True:
             try:
                 client_socket, client_address = sock.accept()
-                logger.info(f"Connected to new client at address {client_address}")
+                # pipelined responses must not wait for the client's delayed ACK
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                logger.info("Connected to new client at address %s", client_address)
                 client_handlerThread = Thread(target=self.client_handler, args=(client_socket,))
                 client_handlerThread.daemon = True
                 client_handlerThread.start()
@@ -105,8 +565,292 @@ class DHT:
                 logger.error(f"Error accepting connection: {e}")
                 break
     
+class AsyncDHT(DHT):
+    """
+    Event loop based server. All connections are multiplexed on one asyncio
+    loop (uvloop when installed). Only gets and mgets answered from memory
+    run on the loop, every other command runs in a bounded thread pool so
+    the loop never blocks on file I/O or on a shard lock held during it.
+    """
+    def __init__(self, ip: str, port: int, disk_workers: int = 4, **table_options):
+        # disk reads run on executor threads, so the cache has to be thread-safe
+        table_options['shards'] = table_options.get('shards') or 1
+        super().__init__(ip, port, **table_options)
+        self.disk_executor = ThreadPoolExecutor(max_workers=disk_workers, thread_name_prefix='dht-disk')
+
+    async def execute_command_async(self, op: str, key: str = None, value: str = None) -> str:
+        start_time = time.perf_counter_ns()
+        if op == 'get' and key != '':
+            output = self.ht.try_get_from_memory(key)
+            if output is not None:
+                self.record_request(op, key, start_time)
+                return output
+        elif op == 'mget' and '' not in key:
+            values = [self.ht.try_get_from_memory(k) for k in key]
+            if None not in values:
+                self.record_request(op, key, start_time)
+                return json.dumps(values)
+        elif op == 'stats':
+            return self.execute_command(op, key, value)
+        # writes can evict to disk and misses read from it
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.disk_executor, self.execute_command, op, key, value)
+
+    async def execute_batch_async(self, commands: list) -> list:
+        """
+        execute_batch without blocking the loop, see DHT.execute_batch
+        """
+        if self.workers == 1:
+            return [await self.execute_command_async(*command) for command in commands]
+        parts, plans = self.route(commands)
+        futures = {worker: asyncio.wrap_future(self.forward(worker, batch))
+                   for worker, batch in parts.items() if worker != self.worker_id}
+        results = {}
+        if self.worker_id in parts:
+            results[self.worker_id] = [await self.execute_command_async(*command) for command in parts[self.worker_id]]
+        for worker, future in futures.items():
+            try:
+                results[worker] = await asyncio.wait_for(future, FORWARD_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error forwarding to worker {worker}: {e}")
+                results[worker] = ["Error: Worker unavailable"] * len(parts[worker])
+        return self.assemble(commands, plans, results)
+
+    async def handle_forwarded(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            if (await reader.readexactly(1))[0] == MAGIC_BINARY:
+                await self.serve_binary(reader, writer, forwarded=True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error processing forwarded request: {e}")
+        finally:
+            writer.close()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        logger.info("Connected to new client at address %s", writer.get_extra_info('peername'))
+        try:
+            first = await reader.read(1)
+            if not first:
+                return
+            if first[0] == MAGIC_BINARY:
+                await self.serve_binary(reader, writer)
+            elif first[0] == MAGIC_COMPRESSED:
+                (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                reply, compressor = negotiate(unpack_items(await reader.readexactly(length)), self.compression)
+                reply = pack_items(reply)
+                writer.write(FRAME_HEADER.pack(len(reply)) + reply)
+                await self.serve_binary(reader, writer, compressor)
+            else:
+                await self.serve_json(first, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Error processing message from client: {e}")
+        finally:
+            writer.close()
+
+    async def serve_binary(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                           compressor=None, forwarded: bool = False) -> None:
+        """
+        Read frames and run each as its own task, so a request waiting on
+        the disk does not hold up the ones behind it. Responses go out as
+        they finish, the client matches them by request id.
+        """
+        in_flight = asyncio.Semaphore(MAX_PIPELINED)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                (length,) = FRAME_HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+                payload = await reader.readexactly(length)
+                if compressor is not None:
+                    payload = decompress_payload(payload, compressor)
+                request_id, commands = decode_request(payload)
+                # stop reading the connection while it has too many requests running
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self.answer_frame(writer, write_lock, compressor, forwarded, request_id,
+                                                               commands, FRAME_HEADER.size + length))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: in_flight.release())
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def answer_frame(self, writer: asyncio.StreamWriter, write_lock: asyncio.Lock, compressor, forwarded: bool,
+                           request_id: int, commands: list, bytes_in: int) -> None:
+        try:
+            if forwarded:
+                # sent by another worker for keys owned by this one
+                results = [await self.execute_command_async(*command) for command in commands]
+            else:
+                results = await self.execute_batch_async(commands)
+        except Exception as e:
+            logger.error(f"Error processing request {request_id}: {e}")
+            results = ["Error: Internal error"] * len(commands)
+        payload = encode_response(request_id, results)
+        if compressor is not None:
+            payload = compressor.encode(payload)
+        self.record_traffic(bytes_in, FRAME_HEADER.size + len(payload))
+        try:
+            async with write_lock:
+                writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+                await writer.drain()
+        except ConnectionError:
+            # the client went away, the reading side notices it too
+            pass
+
+    async def serve_json(self, first: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        msg = first + await reader.read(2048)
+        while msg:
+            self.record_traffic(bytes_in=len(msg))
+            parsed = self.parse_commands(json.loads(msg.decode()))
+            results = iter(await self.execute_batch_async([command for command in parsed if command is not None]))
+            results = ["Error: Invalid command" if command is None else next(results) for command in parsed]
+            response = json.dumps(results).encode()
+            self.record_traffic(bytes_out=len(response))
+            writer.write(response)
+            await writer.drain()
+            msg = await reader.read(2048)
+
+    async def serve(self) -> None:
+        server = await asyncio.start_server(self.handle_connection, self.ip, int(self.port),
+                                            reuse_address=True, reuse_port=self.workers > 1, backlog=4096)
+        if self.workers > 1:
+            await asyncio.start_unix_server(self.handle_forwarded, self.bind_worker_socket())
+        logger.info(f"Listening on  {self.ip}:{self.port} (asyncio)")
+        async with server:
+            await server.serve_forever()
+
+    def listen_to_clients(self) -> None:
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
+        asyncio.run(self.serve())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DHT server node")
+    parser.add_argument('ip')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--async', dest='use_async', action='store_true', help="use the asyncio server engine")
+    parser.add_argument('--storage', choices=['log', 'json'], default='log', help="disk tier storage engine")
+    parser.add_argument('--shards', type=int, default=None, help="split the cache into N independently locked shards")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes sharing the port, each owning a part of the keys")
+    parser.add_argument('--queue-workers', type=int, default=1, help="threads draining the request queue")
+    parser.add_argument('--capacity', type=int, default=10, help="number of entries kept in memory")
+    parser.add_argument('--capacity-bytes', type=int, default=None,
+                        help="keep entries in a compact array-backed cache limited to this many bytes")
+    parser.add_argument('--eviction-policy', choices=sorted(EVICTION_POLICIES), default='lru')
+    parser.add_argument('--write-back', action='store_true',
+                        help="buffer evictions and write them to disk in the background")
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default='none',
+                        help="fsync never, once per flushed batch (implies --write-back), or on every write")
+    parser.add_argument('--import-legacy-disk', action='store_true',
+                        help=f"load the keys an older version spilled to {LEGACY_DISK_PATH}/<key>.json")
+    parser.add_argument('--snapshot-interval', type=float, default=60,
+                        help="seconds between snapshots of the keys held in memory, 0 to disable")
+    parser.add_argument('--expiry-slice', type=int, default=1000,
+                        help="most expired keys deleted per 100 ms timer tick")
+    parser.add_argument('--compression', choices=CODEC_CHOICES, default='auto',
+                        help="codec for values on disk and offered to clients, auto picks the best installed one")
+    parser.add_argument('--compression-threshold', type=int, default=512,
+                        help="values and frames smaller than this many bytes are not compressed")
+    parser.add_argument('--compression-dict', default=None,
+                        help="dictionary file used on connections whose peer has the same one")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--log-sample', type=int, default=1000, help="log 1 in N requests")
+    parser.add_argument('--log-slow-ms', type=float, default=10.0, help="always log requests slower than this")
+    parser.add_argument('--log-rate', type=int, default=1000, help="log lines per second per logger, 0 for no limit")
+    return parser.parse_args()
+
+
+def apply_logging_options(args) -> None:
+    configure_logging(level=args.log_level, sample_every=args.log_sample, slow_threshold=args.log_slow_ms / 1000,
+                      rate_limit=args.log_rate)
+
+
+def run_worker(args, worker_id: int = 0) -> None:
+    apply_logging_options(args)
+    table_options = {
+        "storage": args.storage,
+        "shards": args.shards,
+        "capacity": args.capacity,
+        "capacity_bytes": args.capacity_bytes,
+        "eviction_policy": args.eviction_policy,
+        "write_back": args.write_back,
+        "durability": args.durability,
+    }
+    server_options = {
+        "snapshot_interval": args.snapshot_interval,
+        "expiry_slice": args.expiry_slice,
+        "compression": args.compression,
+        "compression_threshold": args.compression_threshold,
+        "compression_dictionary": load_dictionary(args.compression_dict),
+        "worker_id": worker_id,
+        "workers": args.workers,
+        "import_legacy": args.import_legacy_disk,
+    }
+    if args.use_async:
+        dht = AsyncDHT(ip=args.ip, port=args.port, **server_options, **table_options)
+    else:
+        dht = DHT(ip=args.ip, port=args.port, queue_workers=args.queue_workers, **server_options, **table_options)
+    if args.workers > 1:
+        # Ctrl-C reaches the whole process group, the supervisor stops the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        dht.listen_to_clients()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        dht.shutdown()
+
+
+def supervise(args) -> None:
+    """
+    Run args.workers worker processes and start a new one whenever one dies
+    """
+    # spawn rather than fork, the logger's writer thread is already running
+    context = multiprocessing.get_context('spawn')
+    apply_logging_options(args)
+    processes = {}
+
+    def start(worker_id):
+        process = context.Process(target=run_worker, args=(args, worker_id), name=f"dht-worker{worker_id}")
+        process.start()
+        processes[worker_id] = process
+
+    for worker_id in range(args.workers):
+        start(worker_id)
+    logger.info(f"Started {args.workers} workers on {args.ip}:{args.port}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes.values()])
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.error(f"Worker {worker_id} exited with code {process.exitcode}, restarting it")
+                    time.sleep(1)
+                    start(worker_id)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
 if __name__ == "__main__":
-    ip_address = str(sys.argv[1])
-    port = int(sys.argv[2])
-    dht = DHT(ip=ip_address, port=port)
-    dht.listen_to_clients()
\ No newline at end of file
+    args = parse_args()
+    if args.workers > 1:
+        supervise(args)
+    else:
+        run_worker(args)
@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import json
+import threading
+from concurrent.futures import Future
+from protocol import ServerPool, AsyncPipelinedConnection
+from compression import CompressionOptions
+from replication import MISSING_KEY
+
+
+class DHTError(Exception):
+    pass
+
+
+def convert_result(command: tuple, result: str):
+    """
+    Turn the text result of a command into the value a caller expects,
+    raises DHTError for errors other than a missing key
+    """
+    op = command[0]
+    if result == MISSING_KEY and op in ('get', 'del'):
+        return None if op == 'get' else False
+    if result.startswith("Error"):
+        raise DHTError(result)
+    if op == 'mget' or op == 'stats':
+        return json.loads(result)
+    if op in ('set', 'setex', 'mset', 'del'):
+        return True
+    if op == 'mdel':
+        return int(result.split()[-1])
+    return result
+
+
+def resolve(futures: list, commands: list, batch_future) -> None:
+    """
+    Hand every command of a finished batch its own result
+    """
+    try:
+        results = batch_future.result()
+    except Exception as e:
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for future, command, result in zip(futures, commands, results):
+        if future.done():
+            continue
+        try:
+            future.set_result(convert_result(command, result))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class DHTClient:
+    """
+    Thread-safe client for the coordinator. Every call returns a Future
+    right away and is queued for a sender thread, which sends everything
+    that piled up while it was busy as one frame. Frames are spread over a
+    pool of pipelined connections, so throughput grows with the number of
+    requests in flight instead of being bound to one round trip per call.
+    Frames are compressed with the best codec both sides have unless
+    compression is 'none', see compression.CompressionOptions.
+    """
+    def __init__(self, address: tuple, pool_size: int = 2, compression: str = 'auto', dictionary: bytes = None):
+        options = CompressionOptions(compression, dictionary=dictionary)
+        self.pool = ServerPool(tuple(address), pool_size, options if options.codecs else None)
+        self.pending = []
+        self.ready = threading.Condition()
+        self.closed = False
+        sender = threading.Thread(target=self.send_queued)
+        sender.daemon = True
+        sender.start()
+
+    def get(self, key: str) -> Future:
+        return self.submit(('get', key, None))
+
+    def set(self, key: str, value: str, ex: float = None) -> Future:
+        """
+        Store value, with ex it expires after that many seconds
+        """
+        if ex is not None:
+            return self.submit(('setex', key, (value, float(ex))))
+        return self.submit(('set', key, value))
+
+    def delete(self, key: str) -> Future:
+        return self.submit(('del', key, None))
+
+    def mget(self, keys: list) -> Future:
+        return self.submit(('mget', list(keys), None))
+
+    def mset(self, items: dict) -> Future:
+        return self.submit(('mset', list(items), list(items.values())))
+
+    def mdelete(self, keys: list) -> Future:
+        return self.submit(('mdel', list(keys), None))
+
+    def stats(self) -> Future:
+        return self.submit(('stats', None, None))
+
+    def submit(self, command: tuple) -> Future:
+        return self.submit_many([command])[0]
+
+    def submit_many(self, commands: list) -> list:
+        """
+        Queue parsed (op, key, value) commands, returns one Future each
+        """
+        futures = [Future() for _ in commands]
+        with self.ready:
+            if self.closed:
+                raise ConnectionError("Client is closed")
+            self.pending.extend(zip(commands, futures))
+            self.ready.notify()
+        return futures
+
+    def send_queued(self) -> None:
+        while True:
+            with self.ready:
+                while not self.pending and not self.closed:
+                    self.ready.wait()
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+            self.send(batch)
+
+    def send(self, batch: list) -> None:
+        commands = [command for command, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            batch_future = self.pool.submit(commands)
+        except Exception as e:
+            batch_future = Future()
+            batch_future.set_exception(e)
+        batch_future.add_done_callback(lambda done: resolve(futures, commands, done))
+
+    def close(self) -> None:
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncDHTClient:
+    """
+    asyncio client for the coordinator. Calls made in the same event loop
+    iteration are sent as one frame on one of the pooled connections.
+
+        client = await AsyncDHTClient.connect(('127.0.0.1', 4000))
+        await client.set('key', 'value')
+        values = await asyncio.gather(*(client.get(key) for key in keys))
+    """
+    def __init__(self, address: tuple, connections: list, compression: CompressionOptions = None):
+        self.address = tuple(address)
+        self.connections = connections
+        self.compression = compression
+        self.next_connection = itertools.cycle(range(len(connections)))
+        self.reconnecting = set()
+        self.pending = []
+
+    @classmethod
+    async def connect(cls, address: tuple, pool_size: int = 2, compression: str = 'auto', dictionary: bytes = None):
+        options = CompressionOptions(compression, dictionary=dictionary)
+        options = options if options.codecs else None
+        connections = [await AsyncPipelinedConnection.open(address, options) for _ in range(pool_size)]
+        return cls(address, connections, options)
+
+    def get(self, key: str) -> asyncio.Future:
+        return self.submit(('get', key, None))
+
+    def set(self, key: str, value: str, ex: float = None) -> asyncio.Future:
+        """
+        Store value, with ex it expires after that many seconds
+        """
+        if ex is not None:
+            return self.submit(('setex', key, (value, float(ex))))
+        return self.submit(('set', key, value))
+
+    def delete(self, key: str) -> asyncio.Future:
+        return self.submit(('del', key, None))
+
+    def mget(self, keys: list) -> asyncio.Future:
+        return self.submit(('mget', list(keys), None))
+
+    def mset(self, items: dict) -> asyncio.Future:
+        return self.submit(('mset', list(items), list(items.values())))
+
+    def mdelete(self, keys: list) -> asyncio.Future:
+        return self.submit(('mdel', list(keys), None))
+
+    def stats(self) -> asyncio.Future:
+        return self.submit(('stats', None, None))
+
+    def submit(self, command: tuple) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.pending:
+            loop.call_soon(self.flush)
+        self.pending.append((command, future))
+        return future
+
+    def flush(self) -> None:
+        batch, self.pending = self.pending, []
+        commands = [command for command, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            batch_future = self.connection().submit(commands)
+        except Exception as e:
+            batch_future = asyncio.get_running_loop().create_future()
+            batch_future.set_exception(e)
+        batch_future.add_done_callback(lambda done: resolve(futures, commands, done))
+
+    def connection(self) -> AsyncPipelinedConnection:
+        index = next(self.next_connection)
+        if self.connections[index].closed:
+            # reconnect in the background, use a live connection meanwhile
+            if index not in self.reconnecting:
+                self.reconnecting.add(index)
+                asyncio.ensure_future(self.reconnect(index))
+            live = [connection for connection in self.connections if not connection.closed]
+            if not live:
+                raise ConnectionError(f"No connection to {self.address}")
+            return live[0]
+        return self.connections[index]
+
+    async def reconnect(self, index: int) -> None:
+        try:
+            self.connections[index] = await AsyncPipelinedConnection.open(self.address, self.compression)
+        except OSError:
+            pass
+        finally:
+            self.reconnecting.discard(index)
+
+    def close(self) -> None:
+        for connection in self.connections:
+            connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,268 @@
+import hashlib
+from array import array
+from collections import OrderedDict
+
+HALVE = bytes(value >> 1 for value in range(256))
+
+
+class LRUPolicy:
+    """
+    Plain least recently used ordering. Policies only track keys, the
+    cache owns the values and asks the policy what to evict.
+    """
+    name = 'lru'
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.order = OrderedDict()
+
+    def access(self, key) -> None:
+        """
+        A cached key was read or overwritten
+        """
+        self.order.move_to_end(key)
+
+    def record(self, key) -> None:
+        """
+        A key that is not cached was requested
+        """
+        pass
+
+    def insert(self, key) -> list:
+        """
+        Start tracking a new key, returns the keys to evict
+        """
+        self.order[key] = None
+        evicted = []
+        while len(self.order) > self.capacity:
+            evicted.append(self.order.popitem(last=False)[0])
+        return evicted
+
+    def remove(self, key) -> None:
+        self.order.pop(key, None)
+
+
+class TwoQPolicy:
+    """
+    2Q: new keys enter a small FIFO (A1in) and only keys seen again after
+    leaving it, remembered in the ghost queue A1out, get into the main LRU
+    (Am). One-off scans therefore never reach the main queue.
+    """
+    name = '2q'
+
+    def __init__(self, capacity: int, in_ratio: float = 0.25, out_ratio: float = 0.5):
+        self.capacity = capacity
+        self.in_capacity = max(1, int(capacity * in_ratio))
+        self.out_capacity = max(1, int(capacity * out_ratio))
+        self.a1in = OrderedDict()
+        self.a1out = OrderedDict()
+        self.am = OrderedDict()
+
+    def access(self, key) -> None:
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def record(self, key) -> None:
+        pass
+
+    def insert(self, key) -> list:
+        if key in self.a1out:
+            del self.a1out[key]
+            self.am[key] = None
+        else:
+            self.a1in[key] = None
+        evicted = []
+        while len(self.a1in) + len(self.am) > self.capacity:
+            if len(self.a1in) > self.in_capacity or not self.am:
+                victim = self.a1in.popitem(last=False)[0]
+                self.a1out[victim] = None
+                if len(self.a1out) > self.out_capacity:
+                    self.a1out.popitem(last=False)
+            else:
+                victim = self.am.popitem(last=False)[0]
+            evicted.append(victim)
+        return evicted
+
+    def remove(self, key) -> None:
+        self.a1in.pop(key, None)
+        self.am.pop(key, None)
+
+
+class ARCPolicy:
+    """
+    Adaptive Replacement Cache. T1 holds keys seen once, T2 keys seen at
+    least twice, B1/B2 remember keys recently evicted from each. Hits in
+    the ghost lists move the target size p of T1 towards whichever side
+    would have kept the key.
+    """
+    name = 'arc'
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def access(self, key) -> None:
+        if key in self.t1:
+            del self.t1[key]
+            self.t2[key] = None
+        else:
+            self.t2.move_to_end(key)
+
+    def record(self, key) -> None:
+        pass
+
+    def replace(self, key) -> str:
+        if self.t1 and (len(self.t1) > self.p or (key in self.b2 and len(self.t1) == self.p)):
+            victim = self.t1.popitem(last=False)[0]
+            self.b1[victim] = None
+        else:
+            victim = self.t2.popitem(last=False)[0]
+            self.b2[victim] = None
+        return victim
+
+    def insert(self, key) -> list:
+        evicted = []
+        if key in self.b1:
+            self.p = min(self.capacity, self.p + max(len(self.b2) // max(len(self.b1), 1), 1))
+            del self.b1[key]
+            if len(self.t1) + len(self.t2) >= self.capacity:
+                evicted.append(self.replace(key))
+            self.t2[key] = None
+            return evicted
+        if key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // max(len(self.b2), 1), 1))
+            if len(self.t1) + len(self.t2) >= self.capacity:
+                evicted.append(self.replace(key))
+            del self.b2[key]
+            self.t2[key] = None
+            return evicted
+        if len(self.t1) + len(self.b1) >= self.capacity:
+            if len(self.t1) < self.capacity:
+                self.b1.popitem(last=False)
+                if len(self.t1) + len(self.t2) >= self.capacity:
+                    evicted.append(self.replace(key))
+            else:
+                evicted.append(self.t1.popitem(last=False)[0])
+        elif len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= self.capacity:
+            if len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= 2 * self.capacity:
+                self.b2.popitem(last=False)
+            if len(self.t1) + len(self.t2) >= self.capacity:
+                evicted.append(self.replace(key))
+        self.t1[key] = None
+        return evicted
+
+    def remove(self, key) -> None:
+        self.t1.pop(key, None)
+        self.t2.pop(key, None)
+
+
+class CountMinSketch:
+    """
+    4-bit style frequency sketch with periodic halving so old popularity
+    fades out
+    """
+    def __init__(self, capacity: int, depth: int = 4):
+        self.width = 1 << max(4, (capacity * 2 - 1).bit_length())
+        self.depth = depth
+        self.table = [array('B', bytes(self.width)) for _ in range(depth)]
+        self.sample_size = 10 * max(capacity, 1)
+        self.additions = 0
+
+    def indexes(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], 'little')
+        h2 = int.from_bytes(digest[4:], 'little') | 1
+        mask = self.width - 1
+        return [(h1 + i * h2) & mask for i in range(self.depth)]
+
+    def increment(self, key) -> None:
+        for row, index in zip(self.table, self.indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key) -> int:
+        return min(row[index] for row, index in zip(self.table, self.indexes(key)))
+
+    def reset(self) -> None:
+        for depth, row in enumerate(self.table):
+            self.table[depth] = array('B', row.tobytes().translate(HALVE))
+        self.additions //= 2
+
+
+class TinyLFUPolicy:
+    """
+    W-TinyLFU: a small LRU window in front of a segmented LRU main area.
+    A key leaving the window only replaces the main area's victim when the
+    count-min sketch says it is used more often, which keeps scans out.
+    """
+    name = 'tinylfu'
+
+    def __init__(self, capacity: int, window_ratio: float = 0.01, protected_ratio: float = 0.8):
+        self.capacity = capacity
+        self.window_capacity = max(1, int(capacity * window_ratio))
+        self.main_capacity = max(1, capacity - self.window_capacity)
+        self.protected_capacity = max(1, int(self.main_capacity * protected_ratio))
+        self.sketch = CountMinSketch(capacity)
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+
+    def access(self, key) -> None:
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_capacity:
+                demoted = self.protected.popitem(last=False)[0]
+                self.probation[demoted] = None
+        else:
+            self.protected.move_to_end(key)
+
+    def record(self, key) -> None:
+        self.sketch.increment(key)
+
+    def insert(self, key) -> list:
+        self.window[key] = None
+        evicted = []
+        while len(self.window) > self.window_capacity:
+            candidate = self.window.popitem(last=False)[0]
+            if len(self.probation) + len(self.protected) < self.main_capacity:
+                self.probation[candidate] = None
+                continue
+            victim_queue = self.probation if self.probation else self.protected
+            victim = next(iter(victim_queue))
+            if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+                del victim_queue[victim]
+                self.probation[candidate] = None
+                evicted.append(victim)
+            else:
+                evicted.append(candidate)
+        return evicted
+
+    def remove(self, key) -> None:
+        self.window.pop(key, None)
+        self.probation.pop(key, None)
+        self.protected.pop(key, None)
+
+
+EVICTION_POLICIES = {
+    'lru': LRUPolicy,
+    'tinylfu': TinyLFUPolicy,
+    'arc': ARCPolicy,
+    '2q': TwoQPolicy,
+}
+
+
+def create_policy(name: str, capacity: int):
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f"Unknown eviction policy {name}")
+    return EVICTION_POLICIES[name](capacity)
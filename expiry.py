@@ -0,0 +1,125 @@
+import time
+
+# Every value HashTable stores starts with a tag: NO_EXPIRY, or EXPIRY_MARK
+# followed by 16 hex digits of the expiry time in epoch milliseconds, so the
+# deadline travels with the value through the disk tier, snapshots and key
+# migration. The tag is always there, so a user value can start with any
+# character without being mistaken for an expiry time. A key deleted with
+# a tombstone holds TOMBSTONE_MARK and the tombstone's expiry time only.
+NO_EXPIRY = '\x00'
+EXPIRY_MARK = '\x01'
+TOMBSTONE_MARK = '\x02'
+EXPIRY_DIGITS = 16
+
+
+def encode_expiring(value: str, expires_at: float = None) -> str:
+    if expires_at is None:
+        return NO_EXPIRY + value
+    return f"{EXPIRY_MARK}{int(expires_at * 1000):0{EXPIRY_DIGITS}x}{value}"
+
+
+def encode_tombstone(expires_at: float) -> str:
+    return f"{TOMBSTONE_MARK}{int(expires_at * 1000):0{EXPIRY_DIGITS}x}"
+
+
+def decode_expiring(value) -> tuple:
+    """
+    Split a stored value into (expires_at or None, value), value is None
+    for a tombstone. Values without a tag, left on disk from before every
+    value was tagged, come back as they are.
+    """
+    if not isinstance(value, str) or not value:
+        return None, value
+    if value[0] == NO_EXPIRY:
+        return None, value[1:]
+    if value[0] in (EXPIRY_MARK, TOMBSTONE_MARK) and len(value) > EXPIRY_DIGITS:
+        digits = value[1:EXPIRY_DIGITS + 1]
+        if all(digit in '0123456789abcdef' for digit in digits):
+            if value[0] == TOMBSTONE_MARK:
+                return int(digits, 16) / 1000, None
+            return int(digits, 16) / 1000, value[EXPIRY_DIGITS + 1:]
+    return None, value
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel of key deadlines. Level 0 has 256 slots of
+    one tick each, every further level 64 slots that each span a full turn
+    of the level below. A key goes into the slot matching its deadline on
+    the lowest level that reaches that far, so scheduling and cancelling
+    are O(1). Advancing walks one level 0 slot per tick and, whenever a
+    lower level wraps around, spreads the next slot of the level above
+    over the levels below.
+    """
+    def __init__(self, tick: float = 0.1, levels: int = 4, now: float = None):
+        self.tick = tick
+        self.current = int((time.time() if now is None else now) / tick)
+        self.shifts = [0] + [8 + 6 * level for level in range(levels - 1)]
+        self.wheels = [[{} for _ in range(256)]] + [[{} for _ in range(64)] for _ in range(levels - 1)]
+        self.horizon = 1 << (8 + 6 * (levels - 1))
+        self.locations = {}
+        # keys whose deadline has passed, waiting to be reclaimed
+        self.due = {}
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def schedule(self, key, deadline: float) -> None:
+        self.cancel(key)
+        self.place(key, int(deadline / self.tick) + 1)
+
+    def place(self, key, deadline_tick: int) -> None:
+        delta = deadline_tick - self.current
+        if delta <= 0:
+            self.due[key] = deadline_tick
+            self.locations[key] = None
+            return
+        # deadlines past the horizon wait in the top level and are placed
+        # again when their slot comes up
+        target = min(deadline_tick, self.current + self.horizon - 1)
+        level = 0
+        while level + 1 < len(self.wheels) and delta >= 1 << self.shifts[level + 1]:
+            level += 1
+        size = len(self.wheels[level])
+        slot = (target >> self.shifts[level]) % size
+        self.wheels[level][slot][key] = deadline_tick
+        self.locations[key] = (level, slot)
+
+    def cancel(self, key) -> None:
+        location = self.locations.pop(key, False)
+        if location is None:
+            self.due.pop(key, None)
+        elif location:
+            level, slot = location
+            del self.wheels[level][slot][key]
+
+    def advance(self, now: float, limit: int) -> list:
+        """
+        Move the wheel to `now` and return up to `limit` keys whose deadline
+        passed, the rest are returned by later calls
+        """
+        target = int(now / self.tick)
+        while self.current < target and len(self.due) < limit:
+            self.current += 1
+            for level in range(len(self.wheels) - 1, 0, -1):
+                if self.current & ((1 << self.shifts[level]) - 1) == 0:
+                    self.cascade(level)
+            slot = self.wheels[0][self.current % 256]
+            if slot:
+                for key in slot:
+                    self.locations[key] = None
+                self.due.update(slot)
+                slot.clear()
+        expired = []
+        while self.due and len(expired) < limit:
+            key, _ = self.due.popitem()
+            del self.locations[key]
+            expired.append(key)
+        return expired
+
+    def cascade(self, level: int) -> None:
+        slot = self.wheels[level][(self.current >> self.shifts[level]) % 64]
+        entries = list(slot.items())
+        slot.clear()
+        for key, deadline_tick in entries:
+            self.place(key, deadline_tick)
@@ -1,10 +1,207 @@
 from lruCache import LRUCache
+from arrayLruCache import ArrayLRUCache
+from policyCache import PolicyCache
+from shardedLruCache import ShardedLRUCache
+from snapshot import save_snapshot, load_snapshot
+from expiry import TimerWheel, encode_expiring, encode_tombstone, decode_expiring
+from storage import validate_item
+import threading
+import time
+
 class HashTable:
-    def __init__(self, capacity=10, disk_path="cache_disk"):
-        self.cache = LRUCache(capacity, disk_path)
-        
-    def set(self, key, value):
-        self.cache.put(key, value)
-    
+    def __init__(self, capacity=10, disk_path="cache_disk", storage="log", shards=None, capacity_bytes=None,
+                 eviction_policy="lru", write_back=False, durability="none", compressor=None):
+        if capacity_bytes and eviction_policy != "lru":
+            raise ValueError("A byte capacity is only supported with the lru eviction policy")
+        storage_options = {"write_back": write_back, "durability": durability, "compressor": compressor}
+        # a sharded cache is needed as soon as more than one thread uses the table
+        if shards:
+            self.cache = ShardedLRUCache(capacity, disk_path, storage, shards, capacity_bytes, eviction_policy,
+                                         **storage_options)
+        elif eviction_policy != "lru":
+            self.cache = PolicyCache(capacity, disk_path, storage, eviction_policy, **storage_options)
+        elif capacity_bytes:
+            self.cache = ArrayLRUCache(capacity_bytes, disk_path, storage, **storage_options)
+        else:
+            self.cache = LRUCache(capacity, disk_path, storage, **storage_options)
+        # deadlines of keys set with a time to live, the value itself
+        # carries its expiry time so a timer lost to a restart or a key
+        # migration only delays reclaiming it, reads never return it
+        self.timers = TimerWheel()
+        self.timers_lock = threading.Lock()
+        self.expired_keys = 0
+        # keys on disk from before a restart whose expiry is not scheduled yet
+        self.sweep_keys = []
+
+    def set(self, key, value, ttl=None):
+        validate_item(key, value)
+        if ttl is not None:
+            expires_at = time.time() + ttl
+            self.cache.put(key, encode_expiring(value, expires_at))
+            with self.timers_lock:
+                self.timers.schedule(key, expires_at)
+            return
+        self.cache.put(key, encode_expiring(value))
+        self.cancel_expiry(key)
+
+    def cancel_expiry(self, key):
+        if key in self.timers.locations:
+            with self.timers_lock:
+                self.timers.cancel(key)
+
+    def unwrap(self, key, value):
+        """
+        Strip the expiry tag from a stored value, -1 once it has passed
+        or for a tombstone
+        """
+        expires_at, value = decode_expiring(value)
+        if expires_at is not None and expires_at <= time.time():
+            self.reclaim(key)
+            return -1
+        return -1 if value is None else value
+
     def get(self, key):
-        return self.cache.get(key)
+        return self.unwrap(key, self.cache.get(key))
+
+    def try_get_from_memory(self, key):
+        """
+        Live value held in memory, None when it has to be looked up the
+        slow way. Needs a sharded cache and never waits on a lock or the disk.
+        """
+        value = self.cache.try_get_from_memory(key)
+        if value is None:
+            return None
+        expires_at, value = decode_expiring(value)
+        if expires_at is not None and expires_at <= time.time():
+            # reclaiming it touches the disk
+            return None
+        # None for a tombstone as well
+        return value
+
+    def keys(self):
+        return self.cache.keys()
+
+    def peek(self, key):
+        return self.unwrap(key, self.cache.peek(key))
+
+    def peek_stored(self, key):
+        """
+        Stored value including its expiry time, for moving the key to
+        another server
+        """
+        value = self.cache.peek(key)
+        return -1 if self.unwrap(key, value) == -1 else value
+
+    def set_if_absent(self, key, value):
+        # a tombstone makes the cache refuse the key until it expires
+        validate_item(key, value)
+        expires_at, _ = decode_expiring(value)
+        if expires_at is not None and expires_at <= time.time():
+            return False
+        if self.peek(key) != -1 or not self.cache.put_if_absent(key, value):
+            return False
+        if expires_at is not None:
+            with self.timers_lock:
+                self.timers.schedule(key, expires_at)
+        return True
+
+    def delete(self, key, tombstone_ttl=None):
+        """
+        Returns whether the key existed. With tombstone_ttl the key is
+        replaced by a tombstone for that many seconds, which keeps
+        set_if_absent from bringing back an older copy meanwhile.
+        """
+        self.cancel_expiry(key)
+        if tombstone_ttl is None:
+            return self.peek(key) != -1 and self.cache.delete(key)
+        existed = self.peek(key) != -1
+        expires_at = time.time() + tombstone_ttl
+        self.cache.put(key, encode_tombstone(expires_at))
+        with self.timers_lock:
+            self.timers.schedule(key, expires_at)
+        return existed
+
+    def get_many(self, keys):
+        get = self.get
+        return [get(key) for key in keys]
+
+    def set_many(self, keys, values):
+        for key, value in zip(keys, values):
+            validate_item(key, value)
+        put = self.cache.put
+        for key, value in zip(keys, values):
+            put(key, encode_expiring(value))
+            self.cancel_expiry(key)
+
+    def delete_many(self, keys):
+        """
+        Number of keys that existed
+        """
+        delete = self.delete
+        return sum(1 for key in keys if delete(key))
+
+    def reclaim(self, key):
+        # a timer still scheduled for the key finds nothing expired later
+        if self.cache.delete_if_expired(key, time.time()):
+            self.expired_keys += 1
+
+    def reclaim_expired(self, limit=1000):
+        """
+        Delete up to limit keys whose time to live ran out, plus a slice of
+        the keys left to sweep after a restart. Returns the number deleted.
+        """
+        now = time.time()
+        with self.timers_lock:
+            due = self.timers.advance(now, limit)
+        reclaimed = self.expired_keys
+        for key in due:
+            self.reclaim(key)
+        if self.sweep_keys:
+            batch = self.sweep_keys[-100:]
+            del self.sweep_keys[-100:]
+            for key in batch:
+                expires_at, _ = decode_expiring(self.cache.peek(key))
+                if expires_at is None:
+                    continue
+                if expires_at <= now:
+                    self.reclaim(key)
+                else:
+                    with self.timers_lock:
+                        if key not in self.timers.locations:
+                            self.timers.schedule(key, expires_at)
+        return self.expired_keys - reclaimed
+
+    def save_snapshot(self, path, clean=False):
+        """
+        Write the keys held in memory with their recency order to path
+        """
+        items = self.cache.snapshot_items()
+        save_snapshot(path, items, clean)
+        return len(items)
+
+    def load_snapshot(self, path):
+        """
+        Warm the cache from a snapshot, returns the number of keys loaded.
+        A snapshot from before a crash may be older than what was evicted
+        to disk since, so keys on disk keep their disk value. The restored
+        keys are saved again right away without the clean flag, so they
+        survive a crash before the next snapshot and the file is not
+        trusted over the disk once writes follow.
+        """
+        snapshot = load_snapshot(path)
+        if snapshot is None:
+            return 0
+        items, clean = snapshot
+        restored = self.cache.restore_items(items, skip_spilled=not clean)
+        self.save_snapshot(path)
+        return restored
+
+    def schedule_sweep(self):
+        """
+        Queue every stored key for the expiry check of reclaim_expired, on
+        startup the deadlines of keys already on disk are unknown
+        """
+        self.sweep_keys = list(self.cache.keys())
+
+    def close(self):
+        self.cache.close()
\ No newline at end of file
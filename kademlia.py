@@ -3,16 +3,121 @@ import socket
 import threading
 import sys
 import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logger import Logger
+from protocol import send_frame, recv_frame
+
+logger = Logger(name='KademliaLogger')
+
+
+class ConnectionPool:
+    """
+    Keeps idle TCP connections to other nodes so an RPC does not pay for a
+    new handshake. A connection is checked out for one request/response
+    pair and returned afterwards, broken ones are dropped.
+    """
+    def __init__(self, timeout: float = 2.0, max_idle: int = 4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, address: tuple) -> socket.socket:
+        with self.lock:
+            connections = self.idle.get(address)
+            if connections:
+                return connections.pop()
+        sock = socket.create_connection(address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def release(self, address: tuple, sock: socket.socket) -> None:
+        with self.lock:
+            connections = self.idle.setdefault(address, [])
+            if len(connections) < self.max_idle:
+                connections.append(sock)
+                return
+        sock.close()
+
+    def send(self, contact: dict, message: dict) -> dict:
+        address = (contact['ip'], contact['port'])
+        sock = self.acquire(address)
+        try:
+            send_frame(sock, json.dumps(message).encode())
+            payload = recv_frame(sock)
+            if payload is None:
+                raise ConnectionError(f"Connection to {address} closed")
+        except Exception:
+            sock.close()
+            raise
+        self.release(address, sock)
+        return json.loads(payload)
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock in connections:
+                sock.close()
+
+
+class InProcessTransport:
+    """
+    Delivers RPCs by calling the target node directly, with an optional
+    simulated network delay. Used to run many nodes in one process.
+    """
+    def __init__(self, latency=None):
+        self.nodes = {}
+        self.latency = latency
+
+    def register(self, node) -> None:
+        self.nodes[(node.ip, node.port)] = node
+
+    def send(self, contact: dict, message: dict) -> dict:
+        node = self.nodes.get((contact['ip'], contact['port']))
+        if node is None:
+            raise ConnectionError(f"No node at {contact['ip']}:{contact['port']}")
+        if self.latency is not None:
+            # one way there, one way back
+            time.sleep(self.latency() + self.latency())
+        return json.loads(json.dumps(node.handle_request(json.loads(json.dumps(message)))))
+
 
 class KademliaNode:
-    def __init__(self, ip, port, k=20, alpha=3):
+    """
+    Kademlia node. Stored values live for `ttl` seconds: the original
+    publisher republishes its values with a fresh ttl and every node
+    holding a value republishes it every `republish_interval` with what is
+    left of it. Values found by a lookup are also cached, with a shorter
+    expiry, at the closest node on the lookup path that lacked them.
+    """
+    def __init__(self, ip, port, k=20, alpha=3, transport=None, executor=None, ttl=86400,
+                 republish_interval=3600, cache_size=10000, min_cache_ttl=60, path_caching=True):
         self.ip = ip
         self.port = port
         self.id = self.hash(f"{ip}:{port}")
         self.k = k
         self.alpha = alpha
         self.routing_table = [[] for _ in range(160)]
+        # contacts seen while their bucket was full, most recent last
+        self.replacements = [[] for _ in range(160)]
+        self.pinging = set()
+        # key id -> (key, value, expires_at, published_at)
         self.data = {}
+        self.published = set()
+        # key id -> (value, expires_at) for values cached along lookup paths
+        self.cache = OrderedDict()
+        self.ttl = ttl
+        self.republish_interval = republish_interval
+        self.cache_size = cache_size
+        self.min_cache_ttl = min_cache_ttl
+        self.path_caching = path_caching
+        self.values_served = 0
+        self.lock = threading.Lock()
+        self.transport = transport if transport is not None else ConnectionPool()
+        self.executor = executor
 
     def hash(self, key):
         return int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16)
@@ -24,80 +129,339 @@ class KademliaNode:
         distance = self.xor_distance(self.id, node_id)
         return distance.bit_length() - 1
 
+    def contact(self):
+        return {'id': self.id, 'ip': self.ip, 'port': self.port}
+
     def update_routing_table(self, node_id, ip, port):
+        """
+        Record that a node was seen. Buckets are ordered least recently
+        seen first. A contact arriving at a full bucket waits in the
+        replacement cache while the least recently seen contact is pinged,
+        and only replaces it if that ping fails.
+        """
+        if node_id == self.id:
+            return
         bucket_index = self.find_bucket(node_id)
-        bucket = self.routing_table[bucket_index]
-        if node_id not in [n['id'] for n in bucket]:
+        with self.lock:
+            bucket = self.routing_table[bucket_index]
+            for position, known in enumerate(bucket):
+                if known['id'] == node_id:
+                    bucket.append(bucket.pop(position))
+                    return
+            contact = {'id': node_id, 'ip': ip, 'port': port}
             if len(bucket) < self.k:
-                bucket.append({'id': node_id, 'ip': ip, 'port': port})
-            else:
-                bucket.pop(0)
-                bucket.append({'id': node_id, 'ip': ip, 'port': port})
+                bucket.append(contact)
+                return
+            replacements = self.replacements[bucket_index]
+            replacements[:] = [known for known in replacements if known['id'] != node_id]
+            replacements.append(contact)
+            if len(replacements) > self.k:
+                replacements.pop(0)
+            oldest = bucket[0]
+            if oldest['id'] in self.pinging:
+                return
+            self.pinging.add(oldest['id'])
+        self.get_executor().submit(self.ping_oldest, oldest)
+
+    def ping_oldest(self, contact):
+        try:
+            # a reply moves the contact to the tail of its bucket
+            self.send_message(contact, 'PING')
+        except Exception:
+            self.remove_contact(contact['id'])
+        finally:
+            with self.lock:
+                self.pinging.discard(contact['id'])
+
+    def remove_contact(self, node_id):
+        """
+        Drop an unresponsive contact, its place goes to the most recently
+        seen replacement
+        """
+        bucket_index = self.find_bucket(node_id)
+        with self.lock:
+            bucket = self.routing_table[bucket_index]
+            remaining = [known for known in bucket if known['id'] != node_id]
+            if len(remaining) == len(bucket):
+                return
+            replacements = self.replacements[bucket_index]
+            if replacements:
+                remaining.append(replacements.pop())
+            self.routing_table[bucket_index] = remaining
+
+    def closest_nodes(self, target_id, count=None):
+        """
+        The `count` (default k) known contacts closest to target_id, taken
+        from every bucket
+        """
+        with self.lock:
+            contacts = [contact for bucket in self.routing_table for contact in bucket]
+        contacts.sort(key=lambda n: self.xor_distance(n['id'], target_id))
+        return contacts[:count or self.k]
 
     def find_node(self, target_id):
-        bucket_index = self.find_bucket(target_id)
-        bucket = self.routing_table[bucket_index]
-        return sorted(bucket, key=lambda n: self.xor_distance(n['id'], target_id))[:self.alpha]
+        return self.closest_nodes(target_id, self.alpha)
+
+    def send_message(self, contact, command, **fields):
+        """
+        Send one RPC and learn the responding node. Raises when the node
+        cannot be reached.
+        """
+        message = dict(fields, command=command, sender=self.contact())
+        response = self.transport.send(contact, message)
+        self.update_routing_table(contact['id'], contact['ip'], contact['port'])
+        return response
 
-    def store(self, key, value):
+    def handle_request(self, message):
+        """
+        Answer one RPC, transport independent
+        """
+        sender = message.get('sender')
+        if sender:
+            self.update_routing_table(sender['id'], sender['ip'], sender['port'])
+        command = message['command']
+        if command == 'PING':
+            return {'id': self.id}
+        if command == 'STORE':
+            ttl = min(float(message.get('ttl') or self.ttl), self.ttl)
+            if message.get('cache'):
+                self.cache_value(self.hash(message['key']), message['value'], ttl)
+            else:
+                self.store_local(message['key'], message['value'], ttl)
+            return {'status': 'OK'}
+        if command == 'FIND_NODE':
+            return {'nodes': self.closest_nodes(message['target'])}
+        if command == 'FIND_VALUE':
+            key_id = self.hash(message['key'])
+            value = self.local_value(key_id)
+            if value is not None:
+                with self.lock:
+                    self.values_served += 1
+                return {'value': value}
+            return {'nodes': self.closest_nodes(key_id)}
+        return {'error': f"Unknown command {command}"}
+
+    def store_local(self, key, value, ttl):
+        now = time.time()
         key_id = self.hash(key)
-        self.data[key_id] = value
-        closest_nodes = self.find_node(key_id)
-        for node in closest_nodes:
-            self.send_message(node['ip'], node['port'], 'STORE', key, value)
+        with self.lock:
+            self.data[key_id] = (key, value, now + ttl, now)
+            self.cache.pop(key_id, None)
+
+    def cache_value(self, key_id, value, ttl):
+        with self.lock:
+            if key_id in self.data:
+                return
+            self.cache.pop(key_id, None)
+            self.cache[key_id] = (value, time.time() + ttl)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def local_value(self, key_id):
+        """
+        Unexpired value stored or cached here, None otherwise
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.data.get(key_id)
+            if entry is not None and entry[2] > now:
+                return entry[1]
+            entry = self.cache.get(key_id)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+        return None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.alpha, thread_name_prefix='kademlia-rpc')
+        return self.executor
+
+    def iterative_find(self, target_id, key=None):
+        """
+        Iterative lookup for the k nodes closest to target_id. Up to alpha
+        FIND_NODE (or FIND_VALUE when a key is given) RPCs are in flight at
+        once, each answer adds closer contacts to the shortlist, and the
+        lookup ends when the k closest contacts have all answered or
+        failed. A found value is cached at the closest node on the path
+        that did not have it. Returns (closest contacts, value or None, hops, rpcs), hops
+        being the number of referrals followed to the answering node.
+        """
+        shortlist = {contact['id']: contact for contact in self.closest_nodes(target_id)}
+        depth = {node_id: 1 for node_id in shortlist}
+        queried = set()
+        responded = set()
+        failed = set()
+        in_flight = {}
+        rpcs = 0
+        executor = self.get_executor()
+        while True:
+            candidates = sorted(shortlist, key=lambda node_id: node_id ^ target_id)
+            closest = [node_id for node_id in candidates if node_id not in failed][:self.k]
+            pending = [node_id for node_id in closest if node_id not in queried]
+            for node_id in pending[:max(0, self.alpha - len(in_flight))]:
+                queried.add(node_id)
+                rpcs += 1
+                if key is None:
+                    future = executor.submit(self.send_message, shortlist[node_id], 'FIND_NODE', target=target_id)
+                else:
+                    future = executor.submit(self.send_message, shortlist[node_id], 'FIND_VALUE', key=key)
+                in_flight[future] = node_id
+            if not in_flight:
+                found = [shortlist[node_id] for node_id in closest if node_id in responded]
+                hops = depth[found[0]['id']] if found else 0
+                return found, None, hops, rpcs
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = in_flight.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logger.debug("Node %s did not answer: %s", node_id, e)
+                    failed.add(node_id)
+                    self.remove_contact(node_id)
+                    continue
+                responded.add(node_id)
+                if response.get('value') is not None:
+                    found = [shortlist[other] for other in closest if other in responded]
+                    without_value = [other for other in closest if other in responded and other != node_id]
+                    if without_value and self.path_caching:
+                        holder = without_value[0]
+                        closer = sum(1 for other in shortlist
+                                     if other not in failed and other ^ target_id < holder ^ target_id)
+                        self.cache_on_path(shortlist[holder], key, response['value'], closer)
+                    return found, response['value'], depth[node_id], rpcs
+                for contact in response.get('nodes', []):
+                    if contact['id'] != self.id and contact['id'] not in shortlist:
+                        shortlist[contact['id']] = contact
+                        depth[contact['id']] = depth[node_id] + 1
+
+    def cache_on_path(self, holder, key, value, closer):
+        """
+        Cache a found value at the closest node that answered without it.
+        The expiry halves for every node the lookup saw closer to the key,
+        so copies far from the key fade quickly.
+        """
+        ttl = max(self.min_cache_ttl, self.ttl / (1 << min(closer, 30)))
+        self.get_executor().submit(self.send_message, holder, 'STORE', key=key, value=value, ttl=ttl, cache=True)
+
+    def join(self, ip, port):
+        """
+        Bootstrap from a known node: learn its id, then look up our own id
+        so the nodes near us learn about us and fill our buckets
+        """
+        response = self.transport.send({'ip': ip, 'port': port}, {'command': 'PING', 'sender': self.contact()})
+        self.update_routing_table(response['id'], ip, port)
+        self.iterative_find(self.id)
+
+    def store(self, key, value, ttl=None):
+        """
+        Publish a value on the k nodes closest to its key. Returns the
+        number of nodes that accepted it.
+        """
+        ttl = ttl or self.ttl
+        self.store_local(key, value, ttl)
+        with self.lock:
+            self.published.add(self.hash(key))
+        return self.replicate(key, value, ttl)
+
+    def replicate(self, key, value, ttl):
+        closest_nodes, _, _, _ = self.iterative_find(self.hash(key))
+        executor = self.get_executor()
+        futures = [executor.submit(self.send_message, node, 'STORE', key=key, value=value, ttl=ttl)
+                   for node in closest_nodes]
+        stored = 0
+        for future in futures:
+            try:
+                future.result()
+                stored += 1
+            except Exception as e:
+                logger.error(f"Error storing {key}: {e}")
+        return stored
 
     def lookup(self, key):
         key_id = self.hash(key)
-        if key_id in self.data:
-            return self.data[key_id]
-        closest_nodes = self.find_node(key_id)
-        for node in closest_nodes:
-            response = self.send_message(node['ip'], node['port'], 'FIND_VALUE', key)
-            if response:
-                return response
-        return None
+        value = self.local_value(key_id)
+        if value is not None:
+            return value
+        _, value, _, _ = self.iterative_find(key_id, key)
+        return value
 
-    def send_message(self, ip, port, command, key, value=None):
-        message = json.dumps({'command': command, 'key': key, 'value': value})
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((ip, port))
-            s.sendall(message.encode())
-            response = s.recv(1024).decode()
-            return json.loads(response).get('value')
+    def maintain(self):
+        """
+        Drop expired values and republish the ones due. Publishers restart
+        the ttl of their own values, other holders pass on what is left.
+        """
+        now = time.time()
+        with self.lock:
+            for key_id in [key_id for key_id, entry in self.data.items() if entry[2] <= now]:
+                del self.data[key_id]
+                self.published.discard(key_id)
+            for key_id in [key_id for key_id, entry in self.cache.items() if entry[1] <= now]:
+                del self.cache[key_id]
+            due = [(key_id, entry) for key_id, entry in self.data.items()
+                   if now - entry[3] >= self.republish_interval]
+            published = set(self.published)
+        for key_id, (key, value, expires_at, _) in due:
+            ttl = self.ttl if key_id in published else expires_at - now
+            with self.lock:
+                if key_id in self.data:
+                    self.data[key_id] = (key, value, now + ttl, now)
+            self.replicate(key, value, ttl)
 
-    def handle_message(self, client_socket):
-        message = json.loads(client_socket.recv(1024).decode())
-        command = message['command']
-        key = message['key']
-        value = message.get('value')
-        if command == 'STORE':
-            self.data[self.hash(key)] = value
-            response = {'status': 'OK'}
-        elif command == 'FIND_VALUE':
-            key_id = self.hash(key)
-            if key_id in self.data:
-                response = {'value': self.data[key_id]}
-            else:
-                response = {'value': None}
-        client_socket.sendall(json.dumps(response).encode())
-        client_socket.close()
+    def maintenance_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"Error during maintenance: {e}")
+
+    def handle_connection(self, client_socket):
+        """
+        Serve RPCs on one connection until the peer closes it
+        """
+        try:
+            while True:
+                payload = recv_frame(client_socket)
+                if payload is None:
+                    break
+                response = self.handle_request(json.loads(payload))
+                send_frame(client_socket, json.dumps(response).encode())
+        except Exception as e:
+            logger.error(f"Error handling message: {e}")
+        finally:
+            client_socket.close()
 
     def run(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind((self.ip, self.port))
-        server.listen(5)
-        print(f"Node {self.id} listening on {self.ip}:{self.port}")
+        server.listen(128)
+        logger.info(f"Node {self.id} listening on {self.ip}:{self.port}")
+        maintenance_thread = threading.Thread(target=self.maintenance_loop, args=(min(60, self.republish_interval),))
+        maintenance_thread.daemon = True
+        maintenance_thread.start()
 
         while True:
             client_socket, client_address = server.accept()
-            threading.Thread(target=self.handle_message, args=(client_socket,)).start()
+            thread = threading.Thread(target=self.handle_connection, args=(client_socket,))
+            thread.daemon = True
+            thread.start()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python kademlia_node.py <IP> <PORT>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python kademlia.py <IP> <PORT> [BOOTSTRAP_IP:BOOTSTRAP_PORT]")
         sys.exit(1)
 
     ip = sys.argv[1]
     port = int(sys.argv[2])
     node = KademliaNode(ip, port)
-    node.run()
\ No newline at end of file
+    if len(sys.argv) == 4:
+        bootstrap_ip, bootstrap_port = sys.argv[3].split(':')
+        server_thread = threading.Thread(target=node.run)
+        server_thread.daemon = True
+        server_thread.start()
+        node.join(bootstrap_ip, int(bootstrap_port))
+        server_thread.join()
+    else:
+        node.run()
@@ -1,25 +1,143 @@
+import atexit
+import itertools
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Every Logger hands its records to one queue drained by a single writer
+# thread, so request threads never format or write to stderr themselves and
+# lines from all loggers come out in the order they were logged.
+log_queue = queue.SimpleQueue()
+log_listener = None
+listener_lock = threading.Lock()
+loggers = []
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the writer thread. Message
+    arguments are passed along as they are, so they must not be mutated
+    after the call.
+    """
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks reference frames that will be gone by then
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def start_writer() -> None:
+    global log_listener
+    with listener_lock:
+        if log_listener is not None:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        log_listener = logging.handlers.QueueListener(log_queue, handler)
+        log_listener.start()
+        atexit.register(stop_writer)
+
+
+def stop_writer() -> None:
+    """
+    Write out everything still queued and stop the writer thread
+    """
+    global log_listener
+    with listener_lock:
+        if log_listener is not None:
+            log_listener.stop()
+            log_listener = None
+
+
+def configure_logging(level=None, sample_every=None, slow_threshold=None, rate_limit=None) -> None:
+    """
+    Apply settings to every Logger, see Logger for their meaning
+    """
+    for logger in loggers:
+        logger.configure(level, sample_every, slow_threshold, rate_limit)
+
 
 class Logger:
-    def __init__(self, name='Logger', level=logging.DEBUG):
+    """
+    Messages take %-style arguments that are only formatted if the line is
+    written. Per-request lines go through request(), which keeps 1 in
+    `sample_every` of them plus every one slower than `slow_threshold`
+    seconds. At most `rate_limit` lines per second are written, the rest
+    are counted and reported once logging resumes.
+    """
+    def __init__(self, name='Logger', level=logging.DEBUG, sample_every=1, slow_threshold=None, rate_limit=None):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        self.logger.propagate = False
+        self.logger.addHandler(DeferredQueueHandler(log_queue))
+        self.sample_every = sample_every
+        self.slow_threshold = slow_threshold
+        self.rate_limit = rate_limit
+        self.request_count = itertools.count()
+        self.tokens = rate_limit or 0
+        self.refilled_at = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+        loggers.append(self)
+        start_writer()
+
+    def configure(self, level=None, sample_every=None, slow_threshold=None, rate_limit=None) -> None:
+        if level is not None:
+            self.logger.setLevel(level)
+        if sample_every is not None:
+            self.sample_every = max(1, sample_every)
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if rate_limit is not None:
+            self.rate_limit = rate_limit or None
+            self.tokens = rate_limit
+
+    def allow(self) -> bool:
+        """
+        Token bucket refilled at rate_limit lines per second
+        """
+        if self.rate_limit is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            self.logger.warning("Rate limit dropped %d log messages", suppressed)
+        return True
+
+    def log(self, level, message, *args) -> None:
+        if self.logger.isEnabledFor(level) and self.allow():
+            self.logger.log(level, message, *args)
+
+    def debug(self, message, *args):
+        self.log(logging.DEBUG, message, *args)
 
-    def debug(self, message):
-        self.logger.debug(message)
+    def info(self, message, *args):
+        self.log(logging.INFO, message, *args)
 
-    def info(self, message):
-        self.logger.info(message)
+    def warning(self, message, *args):
+        self.log(logging.WARNING, message, *args)
 
-    def warning(self, message):
-        self.logger.warning(message)
+    def error(self, message, *args):
+        self.log(logging.ERROR, message, *args)
 
-    def error(self, message):
-        self.logger.error(message)
+    def critical(self, message, *args):
+        self.log(logging.CRITICAL, message, *args)
 
-    def critical(self, message):
-        self.logger.critical(message)
\ No newline at end of file
+    def request(self, message, *args, duration=None):
+        """
+        Sampled INFO line for a single request that took `duration` seconds
+        """
+        if next(self.request_count) % self.sample_every and (
+                duration is None or self.slow_threshold is None or duration < self.slow_threshold):
+            return
+        self.log(logging.INFO, message, *args)
@@ -1,10 +1,15 @@
 from typing import Dict
 from linkList import Node, LinkedList
 from performance_statistics import PerformanceStatistics
-import json
+from storage import create_storage
+from bloomFilter import BloomFilter
+from expiry import decode_expiring
+from logger import Logger
 import os
 import time
 
+logger = Logger(name='CacheLogger')
+
 class LRUCache:
     """
     Implementation of cache storage with LRU eviction policy
@@ -13,41 +18,90 @@ class LRUCache:
     cache_map: Dict[int, Node]
     history: LinkedList
     disk_path: str
+    storage: object
     stats: PerformanceStatistics
 
-    def __init__(self, capacity: int, disk_path: str = "cache_disk"):
+    def __init__(self, capacity: int, disk_path: str = "cache_disk", storage: str = "log",
+                 bloom_capacity: int = 1000000, **storage_options):
         self.capacity = capacity
         self.cache_map = {}
         self.history = LinkedList()
         self.disk_path = disk_path
         self.stats = PerformanceStatistics()
-        if not os.path.exists(self.disk_path):
-            os.makedirs(self.disk_path)
+        self.storage = create_storage(storage, disk_path, **storage_options)
+        self.bloom_path = os.path.join(disk_path, "bloom.bin")
+        self.bloom = BloomFilter.load(self.bloom_path)
+        if self.bloom is None:
+            # no clean shutdown to load from, rebuild from the disk tier
+            self.bloom = BloomFilter(bloom_capacity)
+            for key in self.storage.keys():
+                self.bloom.add(key)
+        else:
+            # the saved filter goes stale with the next eviction
+            os.remove(self.bloom_path)
 
     def get(self, key: int) -> int:
         """
         Retrieve value by its key or -1 otherwise
         """
-        self.stats.record_read_request()
-        start_time = time.time()
         if key in self.cache_map:
-            value_node: Node = self.cache_map[key]
-            if self.history.head != value_node:
-                # make item the most recently used
-                self.history.unlink(value_node)
-                self.history.add_to_head(value_node)
+            return self.get_from_memory(key)
+        return self.get_from_disk(key)
+
+    def contains(self, key: int) -> bool:
+        """
+        Check whether the key is held in memory
+        """
+        return key in self.cache_map
+
+    def get_from_memory(self, key: int) -> int:
+        """
+        Retrieve a value held in memory and make it the most recently used
+        """
+        self.stats.record_read_request()
+        start_time = time.perf_counter_ns()
+        value_node: Node = self.cache_map[key]
+        if self.history.head != value_node:
+            # make item the most recently used
+            self.history.unlink(value_node)
+            self.history.add_to_head(value_node)
+        self.stats.record_hit()
+        self.stats.record_memory_hit()
+        self.stats.record_cache_read_time(start_time)
+        return value_node.value
+
+    def get_from_disk(self, key: int) -> int:
+        """
+        Retrieve a value from the disk tier or -1 otherwise.
+        Only touches the disk, so it is safe to run off the request thread.
+        """
+        start_time = time.perf_counter_ns()
+        if not self.bloom.might_contain(key):
+            # never spilled, answer without touching the disk
+            return self.record_disk_read(start_time, -1, bloom_negative=True)
+        return self.record_disk_read(start_time, self.read_from_disk(key))
+
+    def promote(self, key: int, value: int) -> int:
+        """
+        Hook for get to act on a value read from disk, LRU leaves it there
+        """
+        return value
+
+    def record_disk_read(self, start_time: int, value: int, bloom_negative: bool = False) -> int:
+        """
+        Count a lookup in the disk tier that started at start_time, returns value
+        """
+        self.stats.record_read_request()
+        if bloom_negative:
+            self.stats.record_bloom_negative()
+        elif value == -1:
+            self.stats.record_bloom_false_positive()
+        if value != -1:
             self.stats.record_hit()
-            self.stats.record_cache_read_time(start_time)
-            return value_node.value
         else:
-            # Try to read from disk
-            value = self.read_from_disk(key)
-            if value != -1:
-                self.stats.record_hit()
-            else:
-                self.stats.record_miss()
-            self.stats.record_disk_read_time(start_time)
-            return value
+            self.stats.record_miss()
+        self.stats.record_disk_read_time(start_time, found=value != -1)
+        return value
 
     def put(self, key: int, value: int) -> None:
         """
@@ -77,8 +131,20 @@ class LRUCache:
         if lru_item is None:
             return
 
-        self.write_to_disk(lru_item.key, lru_item.value)
         self.remove_item(lru_item)
+        self.spill(lru_item.key, lru_item.value)
+
+    def spill(self, key: int, value: int) -> None:
+        """
+        Write an evicted item to the disk tier. The item has already left
+        memory, so a failing write drops it instead of wedging every later put.
+        """
+        self.bloom.add(key)
+        try:
+            self.write_to_disk(key, value)
+        except Exception as e:
+            self.stats.record_eviction_failure()
+            logger.error(f"Error writing evicted key {key!r} to disk: {e}")
 
     def remove_item(self, item: Node) -> None:
         """
@@ -87,21 +153,108 @@ class LRUCache:
         self.history.unlink(item)
         del self.cache_map[item.key]
 
+    def keys(self) -> set:
+        """
+        Every key held in memory or in the disk tier
+        """
+        return set(self.cache_map).union(self.storage.keys())
+
+    def peek(self, key: int) -> int:
+        """
+        Retrieve a value without changing its recency or the statistics,
+        -1 if missing
+        """
+        if key in self.cache_map:
+            return self.memory_value(key)
+        if not self.bloom.might_contain(key):
+            return -1
+        return self.read_from_disk(key)
+
+    def memory_value(self, key: int) -> int:
+        return self.cache_map[key].value
+
+    def put_if_absent(self, key: int, value: int) -> bool:
+        """
+        Insert the pair unless the key is already stored in memory or on
+        disk. Returns whether it was inserted.
+        """
+        if self.peek(key) != -1:
+            return False
+        self.put(key, value)
+        return True
+
+    def delete(self, key: int) -> bool:
+        """
+        Remove a key from memory and the disk tier. Returns whether it existed.
+        """
+        existed = self.peek(key) != -1
+        if key in self.cache_map:
+            self.remove_from_memory(key)
+        if self.bloom.might_contain(key):
+            self.storage.delete(key)
+        return existed
+
+    def delete_if_expired(self, key: int, now: float) -> bool:
+        """
+        Delete the key if its stored value carries an expiry time before
+        now. Checking and deleting in one call keeps a value written since
+        the expiry was scheduled.
+        """
+        expires_at, _ = decode_expiring(self.peek(key))
+        if expires_at is None or expires_at > now:
+            return False
+        self.delete(key)
+        return True
+
+    def remove_from_memory(self, key: int) -> None:
+        self.remove_item(self.cache_map[key])
+
+    def snapshot_items(self) -> list:
+        """
+        (key, value) pairs held in memory, least recently used first
+        """
+        items = []
+        node = self.history.tail
+        while node is not None:
+            items.append((node.key, node.value))
+            node = node.prev
+        return items
+
+    def restore_items(self, items: list, skip_spilled: bool = False) -> int:
+        """
+        Bulk-load pairs ordered least recently used first, so the last one
+        ends up the most recently used. With skip_spilled, keys the disk
+        tier holds are left to it since it may have a newer value. Returns
+        the number of keys loaded.
+        """
+        restored = 0
+        for key, value in items:
+            if skip_spilled and self.bloom.might_contain(key) and self.read_from_disk(key) != -1:
+                continue
+            self.put(key, value)
+            restored += 1
+        # warming up is not client traffic
+        self.stats.write_requests -= restored
+        return restored
+
     def write_to_disk(self, key: int, value: int) -> None:
         """
         Write the key-value pair to the disk
         """
-        file_path = os.path.join(self.disk_path, f"{key}.json")
-        with open(file_path, 'w') as f:
-            json.dump({key: value}, f)
+        self.storage.write(key, value)
 
     def read_from_disk(self, key: int) -> int:
         """
         Read the key-value pair from the disk
         """
-        file_path = os.path.join(self.disk_path, f"{key}.json")
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-                return data[str(key)]
-        return -1
\ No newline at end of file
+        return self.storage.read(key)
+
+    def close(self) -> None:
+        """
+        Persist the Bloom filter and close the disk tier
+        """
+        self.bloom.save(self.bloom_path)
+        # a write-back buffer reports the evictions it could not write
+        dropped = self.storage.close()
+        if dropped:
+            self.stats.record_eviction_failure(dropped)
\ No newline at end of file
@@ -0,0 +1,119 @@
+import bisect
+import json
+import time
+from logger import Logger
+
+logger = Logger(name='MigrationLogger')
+
+RING_SIZE = 1 << 64
+# Deletes made while keys are being moved leave a tombstone on the new
+# owners for this many seconds, so a copy of the key still on its way
+# cannot bring it back.
+TOMBSTONE_TTL = 24 * 3600
+
+
+def add_range(ranges: list, start: int, end: int) -> None:
+    """
+    Append [start, end) to a sorted list of ranges, merging it with the
+    last one when they touch
+    """
+    if ranges and ranges[-1][1] == start:
+        ranges[-1][1] = end
+    else:
+        ranges.append([start, end])
+
+
+def transfer_plan(old_ring, new_ring, count: int) -> tuple:
+    """
+    Compare the preference lists of two rings range by range. Returns
+    ({(source, destination): ranges} of keys a server has to receive,
+    {server: ranges} of keys a remaining server no longer has to hold).
+    Ranges are [start, end) intervals of ring hashes.
+    """
+    points = sorted(set(old_ring.sorted_keys).union(new_ring.sorted_keys))
+    old_table = old_ring.successors(count)
+    new_table = new_ring.successors(count)
+    copies = {}
+    drops = {}
+    boundaries = [0] + points + [RING_SIZE]
+    for start, end in zip(boundaries, boundaries[1:]):
+        if start == end:
+            continue
+        # a key hashing into [start, end) belongs to the first ring point above it
+        old_preference = old_table[bisect.bisect_left(old_ring.sorted_keys, end) % len(old_table)]
+        new_preference = new_table[bisect.bisect_left(new_ring.sorted_keys, end) % len(new_table)]
+        for destination in new_preference:
+            if destination not in old_preference:
+                add_range(copies.setdefault((old_preference[0], destination), []), start, end)
+        for server in old_preference:
+            if server not in new_preference and server in new_ring.nodes:
+                add_range(drops.setdefault(server, []), start, end)
+    return copies, drops
+
+
+class KeyMigration:
+    """
+    Moves keys between servers after a membership change. Keys are pulled
+    from the source in pages with 'scan' and stored on the destination with
+    'migrate', which never overwrites a value written since the ring
+    changed. Pages are throttled to `rate` keys per second so the transfer
+    does not starve regular traffic.
+    """
+    def __init__(self, server_pools: dict, copies: dict, drops: dict, batch_size: int = 256, rate: float = 10000):
+        self.server_pools = server_pools
+        self.copies = copies
+        self.drops = drops
+        self.batch_size = batch_size
+        self.rate = rate
+        self.state = "copying"
+        self.copied_keys = 0
+        self.dropped_keys = 0
+
+    def copy_keys(self) -> None:
+        for (source, destination), ranges in self.copies.items():
+            logger.info(f"Moving {len(ranges)} ranges from {source} to {destination}")
+            pool = self.server_pools[destination]
+            for items in self.scan(source, ranges):
+                self.check_results(pool.request([('migrate', key, value) for key, value in items]))
+                self.copied_keys += len(items)
+
+    def drop_keys(self) -> None:
+        self.state = "cleaning"
+        for server, ranges in self.drops.items():
+            pool = self.server_pools[server]
+            for items in self.scan(server, ranges):
+                pool.request([('del', key, None) for key, _ in items])
+                self.dropped_keys += len(items)
+
+    def scan(self, server, ranges: list):
+        """
+        Yield pages of [key, value] pairs held by server in the given ranges
+        """
+        pool = self.server_pools[server]
+        options = json.dumps({"ranges": ranges, "count": self.batch_size})
+        cursor = None
+        while True:
+            start_time = time.perf_counter()
+            result = pool.request([('scan', cursor, options)])[0]
+            if result.startswith("Error"):
+                raise RuntimeError(f"Scan of {server} failed: {result}")
+            page = json.loads(result)
+            if page["items"]:
+                yield page["items"]
+                # throttle to the configured key rate
+                time.sleep(max(0.0, len(page["items"]) / self.rate - (time.perf_counter() - start_time)))
+            cursor = page["cursor"]
+            if cursor is None:
+                return
+
+    def check_results(self, results: list) -> None:
+        for result in results:
+            if result.startswith("Error"):
+                raise RuntimeError(f"Migrating a key failed: {result}")
+
+    def get_statistics(self) -> dict:
+        return {
+            "state": self.state,
+            "copied_keys": self.copied_keys,
+            "dropped_keys": self.dropped_keys,
+        }
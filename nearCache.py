@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class NearCache:
+    """
+    Small LRU cache of recently read values kept in front of the storage
+    servers. Entries expire after `ttl` seconds, which bounds how stale a
+    value can get when it is written without passing through this cache.
+    """
+    def __init__(self, capacity: int, ttl: float = 1.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Cached value of key, None if missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_statistics(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "near_cache_hits": self.hits,
+                "near_cache_misses": self.misses,
+                "near_cache_hit_rate": self.hits / lookups if lookups > 0 else 0,
+                "near_cache_evictions": self.evictions,
+                "near_cache_expirations": self.expirations,
+                "near_cache_invalidations": self.invalidations,
+            }
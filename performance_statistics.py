@@ -1,17 +1,179 @@
 import time
+from array import array
+
+# Histogram buckets are exact below 2 ** (SUB_BUCKET_BITS + 1) ns and then
+# split every power of two into 2 ** SUB_BUCKET_BITS linear sub-buckets,
+# which bounds the relative error of a recorded value to 1/16.
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKET_COUNT = 64 * SUB_BUCKETS
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR style log-linear histogram of nanosecond latencies. Recording is a
+    single array increment, and histograms from different shards or
+    servers merge exactly by adding their bucket counts.
+    """
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def bucket_value(index: int) -> int:
+        """
+        Midpoint of the values falling into a bucket
+        """
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return ((index - shift * SUB_BUCKETS) << shift) + (1 << (shift - 1))
+
+    def record(self, value: int) -> None:
+        # bucket index computed inline, this runs on every request
+        if value < 2 * SUB_BUCKETS:
+            index = max(value, 0)
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            index = shift * SUB_BUCKETS + (value >> shift)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other) -> None:
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Count, mean and percentiles in microseconds
+        """
+        report = {"count": self.count, "mean_us": self.total / self.count / 1000 if self.count else 0}
+        for percent in PERCENTILES:
+            report[f"p{percent:g}_us"] = self.percentile(percent) / 1000
+        report["max_us"] = self.max / 1000
+        return report
+
+    def to_dict(self) -> dict:
+        return {
+            "counts": {index: count for index, count in enumerate(self.counts) if count},
+            "total": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        histogram = cls()
+        for index, count in data["counts"].items():
+            histogram.counts[int(index)] = count
+            histogram.count += count
+        histogram.total = data["total"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def merge_histograms(target: dict, histograms: dict) -> None:
+    """
+    Merge a {name: LatencyHistogram} mapping into another one
+    """
+    for name, histogram in histograms.items():
+        if name not in target:
+            target[name] = LatencyHistogram()
+        target[name].merge(histogram)
+
+
+class CompressionStatistics:
+    """
+    Bytes before and after compression and the CPU time spent on it, for
+    the disk tier or the wire. Payloads that were not worth compressing
+    count with their own size.
+    """
+    def __init__(self):
+        self.payloads = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compress_time = 0
+        self.decompressed = 0
+        self.decompress_time = 0
+
+    def merge(self, other) -> None:
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def summary(self) -> dict:
+        """
+        Counters, the overall ratio and the CPU time in seconds
+        """
+        return {
+            "payloads": self.payloads,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0,
+            "compress_time": self.compress_time / 1e9,
+            "decompressed": self.decompressed,
+            "decompress_time": self.decompress_time / 1e9,
+        }
+
+    @classmethod
+    def from_summary(cls, data: dict):
+        statistics = cls()
+        for name in ("payloads", "compressed", "raw_bytes", "stored_bytes", "decompressed"):
+            setattr(statistics, name, data.get(name, 0))
+        statistics.compress_time = round(data.get("compress_time", 0) * 1e9)
+        statistics.decompress_time = round(data.get("decompress_time", 0) * 1e9)
+        return statistics
+
 
 class PerformanceStatistics:
     def __init__(self):
+        self.eviction_policy = 'lru'
         self.hit_count = 0
+        self.memory_hit_count = 0
         self.miss_count = 0
         self.read_requests = 0
         self.write_requests = 0
         self.cache_read_time = 0
         self.disk_read_time = 0
+        self.bloom_negatives = 0
+        self.bloom_false_positives = 0
+        self.eviction_failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # latency histograms by operation: memory_hit, disk_hit, miss on
+        # the cache, get, set, ... and queue_wait on the server
+        self.histograms = {}
+        # CompressionStatistics by where the data went: disk or wire
+        self.compression = {}
 
     def record_hit(self):
         self.hit_count += 1
 
+    def record_memory_hit(self):
+        self.memory_hit_count += 1
+
     def record_miss(self):
         self.miss_count += 1
 
@@ -21,21 +183,155 @@ class PerformanceStatistics:
     def record_write_request(self):
         self.write_requests += 1
 
-    def record_cache_read_time(self, start_time):
-        self.cache_read_time += time.time() - start_time
+    def record_latency(self, name, start_ns):
+        """
+        Record the time since start_ns (from time.perf_counter_ns) under name,
+        returns the elapsed nanoseconds
+        """
+        elapsed = time.perf_counter_ns() - start_ns
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(elapsed)
+        return elapsed
+
+    def record_cache_read_time(self, start_ns):
+        self.cache_read_time += self.record_latency('memory_hit', start_ns) / 1e9
+
+    def record_disk_read_time(self, start_ns, found=True):
+        self.disk_read_time += self.record_latency('disk_hit' if found else 'miss', start_ns) / 1e9
+
+    def record_bytes(self, bytes_in=0, bytes_out=0):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def record_compression(self, name, size, stored, elapsed_ns):
+        statistics = self.compression.get(name)
+        if statistics is None:
+            statistics = self.compression[name] = CompressionStatistics()
+        statistics.payloads += 1
+        statistics.compressed += stored < size
+        statistics.raw_bytes += size
+        statistics.stored_bytes += stored
+        statistics.compress_time += elapsed_ns
 
-    def record_disk_read_time(self, start_time):
-        self.disk_read_time += time.time() - start_time
+    def record_decompression(self, name, elapsed_ns):
+        statistics = self.compression.get(name)
+        if statistics is None:
+            statistics = self.compression[name] = CompressionStatistics()
+        statistics.decompressed += 1
+        statistics.decompress_time += elapsed_ns
+
+    def record_bloom_negative(self):
+        self.bloom_negatives += 1
+
+    def record_bloom_false_positive(self):
+        self.bloom_false_positives += 1
+
+    def record_eviction_failure(self, count: int = 1):
+        self.eviction_failures += count
+
+    def get_bloom_false_positive_rate(self):
+        negative_lookups = self.bloom_negatives + self.bloom_false_positives
+        return self.bloom_false_positives / negative_lookups if negative_lookups > 0 else 0
+
+    def merge(self, other):
+        """
+        Add the counters of another PerformanceStatistics into this one
+        """
+        self.eviction_policy = other.eviction_policy
+        self.hit_count += other.hit_count
+        self.memory_hit_count += other.memory_hit_count
+        self.miss_count += other.miss_count
+        self.read_requests += other.read_requests
+        self.write_requests += other.write_requests
+        self.cache_read_time += other.cache_read_time
+        self.disk_read_time += other.disk_read_time
+        self.bloom_negatives += other.bloom_negatives
+        self.bloom_false_positives += other.bloom_false_positives
+        self.eviction_failures += other.eviction_failures
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        merge_histograms(self.histograms, other.histograms)
+        for name, statistics in other.compression.items():
+            self.compression.setdefault(name, CompressionStatistics()).merge(statistics)
 
     def get_hit_rate(self):
         total_requests = self.hit_count + self.miss_count
         return self.hit_count / total_requests if total_requests > 0 else 0
 
+    def get_memory_hit_rate(self):
+        total_requests = self.hit_count + self.miss_count
+        return self.memory_hit_count / total_requests if total_requests > 0 else 0
+
     def get_statistics(self):
         return {
+            "eviction_policy": self.eviction_policy,
             "hit_rate": self.get_hit_rate(),
+            "memory_hit_rate": self.get_memory_hit_rate(),
+            "hits": self.hit_count,
+            "memory_hits": self.memory_hit_count,
+            "misses": self.miss_count,
             "read_requests": self.read_requests,
             "write_requests": self.write_requests,
             "cache_read_time": self.cache_read_time,
-            "disk_read_time": self.disk_read_time
-        }
\ No newline at end of file
+            "disk_read_time": self.disk_read_time,
+            "bloom_negatives": self.bloom_negatives,
+            "bloom_false_positives": self.bloom_false_positives,
+            "bloom_false_positive_rate": self.get_bloom_false_positive_rate(),
+            "eviction_failures": self.eviction_failures,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "compression": {name: statistics.summary() for name, statistics in sorted(self.compression.items())},
+            "latency": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            "histograms": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+        }
+
+
+def aggregate_statistics(stats_list: list, compression: dict = None) -> dict:
+    """
+    Combine get_statistics() reports of several servers or workers. Rates
+    are recomputed from the summed counters and latency histograms are
+    merged bucket by bucket, so the percentiles are exact for the whole
+    cluster. compression holds CompressionStatistics to add to theirs.
+    """
+    aggregated_stats = {
+        "hit_rate": 0,
+        "memory_hit_rate": 0,
+        "hits": 0,
+        "memory_hits": 0,
+        "misses": 0,
+        "read_requests": 0,
+        "write_requests": 0,
+        "cache_read_time": 0,
+        "disk_read_time": 0,
+        "bloom_negatives": 0,
+        "bloom_false_positives": 0,
+        "bloom_false_positive_rate": 0,
+        "eviction_failures": 0,
+        "bytes_in": 0,
+        "bytes_out": 0,
+        "expired_keys": 0,
+        "expiring_keys": 0,
+    }
+    counters = [name for name in aggregated_stats if not name.endswith("_rate")]
+    histograms = {}
+    compression = dict(compression or {})
+    for stats in stats_list:
+        for name in counters:
+            aggregated_stats[name] += stats.get(name, 0)
+        merge_histograms(histograms, {name: LatencyHistogram.from_dict(data)
+                                      for name, data in stats.get("histograms", {}).items()})
+        for name, summary in stats.get("compression", {}).items():
+            compression.setdefault(name, CompressionStatistics()).merge(CompressionStatistics.from_summary(summary))
+    lookups = aggregated_stats["hits"] + aggregated_stats["misses"]
+    if lookups > 0:
+        aggregated_stats["hit_rate"] = aggregated_stats["hits"] / lookups
+        aggregated_stats["memory_hit_rate"] = aggregated_stats["memory_hits"] / lookups
+    negative_lookups = aggregated_stats["bloom_negatives"] + aggregated_stats["bloom_false_positives"]
+    if negative_lookups > 0:
+        aggregated_stats["bloom_false_positive_rate"] = aggregated_stats["bloom_false_positives"] / negative_lookups
+    aggregated_stats["compression"] = {name: statistics.summary() for name, statistics in sorted(compression.items())}
+    aggregated_stats["latency"] = {name: histogram.summary() for name, histogram in sorted(histograms.items())}
+    aggregated_stats["histograms"] = {name: histogram.to_dict() for name, histogram in sorted(histograms.items())}
+    return aggregated_stats
@@ -0,0 +1,79 @@
+from lruCache import LRUCache
+from evictionPolicies import create_policy
+import time
+
+
+class PolicyCache(LRUCache):
+    """
+    Cache whose eviction order is decided by a pluggable policy from
+    evictionPolicies. Values read from the disk tier are promoted back into
+    memory, so the policy decides which keys stay hot.
+    """
+    def __init__(self, capacity: int, disk_path: str = "cache_disk", storage: str = "log", policy: str = "lru",
+                 **storage_options):
+        super().__init__(capacity, disk_path, storage, **storage_options)
+        self.history = None
+        self.policy = create_policy(policy, capacity)
+        self.stats.eviction_policy = self.policy.name
+        # keys promoted from disk that are unchanged do not need rewriting
+        self.clean = set()
+
+    def get(self, key):
+        if key in self.cache_map:
+            return self.get_from_memory(key)
+        return self.promote(key, self.get_from_disk(key))
+
+    def promote(self, key, value):
+        """
+        Let the policy count a lookup that missed memory and admit the
+        value found on disk, if any
+        """
+        self.policy.record(key)
+        if value != -1:
+            self.admit(key, value)
+            self.clean.add(key)
+        return value
+
+    def get_from_memory(self, key):
+        self.stats.record_read_request()
+        start_time = time.perf_counter_ns()
+        value = self.cache_map[key]
+        self.policy.access(key)
+        self.stats.record_hit()
+        self.stats.record_memory_hit()
+        self.stats.record_cache_read_time(start_time)
+        return value
+
+    def put(self, key, value) -> None:
+        self.stats.record_write_request()
+        self.clean.discard(key)
+        if key in self.cache_map:
+            self.cache_map[key] = value
+            self.policy.access(key)
+            return
+        self.policy.record(key)
+        self.admit(key, value)
+
+    def memory_value(self, key):
+        return self.cache_map[key]
+
+    def snapshot_items(self) -> list:
+        # policies keep no single recency order, insertion order is close enough
+        return list(self.cache_map.items())
+
+    def remove_from_memory(self, key) -> None:
+        del self.cache_map[key]
+        self.policy.remove(key)
+        self.clean.discard(key)
+
+    def admit(self, key, value) -> None:
+        self.cache_map[key] = value
+        for victim in self.policy.insert(key):
+            self.evict(victim)
+
+    def evict(self, key) -> None:
+        value = self.cache_map.pop(key)
+        if key in self.clean:
+            self.clean.discard(key)
+            return
+        self.spill(key, value)
\ No newline at end of file
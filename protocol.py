@@ -0,0 +1,496 @@
+import socket
+import asyncio
+import hashlib
+import struct
+import threading
+import itertools
+from concurrent.futures import Future
+
+# The first byte a peer sends after connecting selects the wire format.
+# Legacy clients start straight away with a JSON array ('['), anything that
+# starts with MAGIC_BINARY speaks the framed binary protocol below.
+MAGIC_BINARY = 0xB1
+# Binary protocol with compression: the connecting peer follows the magic
+# byte with a hello frame, the other side answers with the codec it picked
+# (see compression.CompressionOptions). Unless that is 'none', every frame
+# payload after that starts with a codec id, 0 for uncompressed.
+MAGIC_COMPRESSED = 0xB2
+
+OP_GET = 1
+OP_SET = 2
+OP_STATS = 3
+# Membership changes: 'scan' pages through a server's keys in ring hash
+# ranges, 'migrate' stores a key only if it is absent and 'del' drops it.
+# A 'del' with a value leaves a tombstone for that many seconds, which
+# 'migrate' does not overwrite.
+OP_DEL = 4
+OP_SCAN = 5
+OP_MIGRATE = 6
+# Admin commands handled by the coordinator.
+OP_JOIN = 7
+OP_LEAVE = 8
+# Multi-key commands. Their keys (and for mset the values) are lists, sent
+# as length-prefixed items in the value field.
+OP_MGET = 9
+OP_MSET = 10
+OP_MDEL = 11
+# set with a time to live, the value is a (value, seconds) pair sent as two
+# items in the value field
+OP_SETEX = 12
+
+OP_CODES = {'get': OP_GET, 'set': OP_SET, 'stats': OP_STATS, 'del': OP_DEL, 'scan': OP_SCAN,
+            'migrate': OP_MIGRATE, 'join': OP_JOIN, 'leave': OP_LEAVE,
+            'mget': OP_MGET, 'mset': OP_MSET, 'mdel': OP_MDEL, 'setex': OP_SETEX}
+OP_NAMES = {code: name for name, code in OP_CODES.items()}
+MULTI_KEY_OPS = ('mget', 'mset', 'mdel')
+# Ops that always carry a key, and those that always carry a value. Their
+# fields decode to '' when empty, for the others an empty field is None.
+KEY_OPS = ('get', 'set', 'setex', 'del', 'migrate', 'join', 'leave')
+VALUE_OPS = ('set', 'migrate')
+
+# Every frame is a 4 byte length prefix followed by the payload.
+FRAME_HEADER = struct.Struct('!I')
+# Payload header: request id + number of commands/results in the frame.
+MESSAGE_HEADER = struct.Struct('!II')
+# Command: op code, key length, value length.
+COMMAND_HEADER = struct.Struct('!BHI')
+# Result: length of the encoded result string.
+RESULT_HEADER = struct.Struct('!I')
+# Item of a multi-key command: length of the key or value.
+ITEM_HEADER = struct.Struct('!I')
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def to_bytes(data: str) -> bytes:
+    return data.encode('utf-8', 'surrogateescape')
+
+
+def from_bytes(data: bytes) -> str:
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def ring_hash(key: str) -> int:
+    """
+    Position of a key on the consistent hash ring
+    """
+    return int.from_bytes(hashlib.blake2b(to_bytes(key), digest_size=8).digest(), 'big')
+
+
+def parse_key_command(op: str, args: list):
+    return (op, args[0], None) if len(args) == 1 else None
+
+
+def parse_set(op: str, args: list):
+    if len(args) == 4 and args[2].lower() == 'ex':
+        # set KEY VALUE ex SECONDS
+        try:
+            ttl = float(args[3])
+        except ValueError:
+            return None
+        return ('setex', args[0], (args[1], ttl)) if 0 < ttl < float('inf') else None
+    return (op, args[0], args[1]) if len(args) == 2 else None
+
+
+def parse_stats(op: str, args: list):
+    return (op, None, None) if not args else None
+
+
+def parse_del(op: str, args: list):
+    if len(args) == 1:
+        return (op, args[0], None)
+    return ('mdel', args, None) if args else None
+
+
+def parse_mget(op: str, args: list):
+    return (op, args, None) if args else None
+
+
+def parse_mset(op: str, args: list):
+    return (op, args[0::2], args[1::2]) if args and len(args) % 2 == 0 else None
+
+
+def parse_membership(op: str, args: list):
+    # SERVER_IP:SERVER_PORT[:WEIGHT], checked by the coordinator
+    return (op, args[0], None) if len(args) == 1 and ':' in args[0] else None
+
+
+COMMAND_PARSERS = {
+    'get': parse_key_command,
+    'set': parse_set,
+    'stats': parse_stats,
+    'del': parse_del,
+    'mget': parse_mget,
+    'mset': parse_mset,
+    'join': parse_membership,
+    'leave': parse_membership,
+}
+
+
+def parse_command(command: str):
+    """
+    Parse a text command into an (op, key, value) tuple, None if invalid.
+    Keys and values are any run of non-whitespace characters, the binary
+    protocol carries arbitrary bytes.
+    """
+    args = command.split()
+    if not args:
+        return None
+    parser = COMMAND_PARSERS.get(args[0])
+    return parser(args[0], args[1:]) if parser is not None else None
+
+
+def format_command(command: tuple) -> str:
+    """
+    Turn an (op, key, value) tuple back into its text form
+    """
+    op, key, value = command
+    if op == 'mset':
+        return ' '.join([op] + [item for pair in zip(key, value) for item in pair])
+    if op in MULTI_KEY_OPS:
+        return ' '.join(['del' if op == 'mdel' else op] + key)
+    if op == 'setex':
+        return f"set {key} {value[0]} ex {value[1]:g}"
+    return ' '.join(part for part in command if part is not None)
+
+
+def pack_items(items) -> bytes:
+    chunks = []
+    for item in items:
+        item_bytes = to_bytes(item)
+        chunks.append(ITEM_HEADER.pack(len(item_bytes)))
+        chunks.append(item_bytes)
+    return b''.join(chunks)
+
+
+def unpack_items(data: bytes) -> list:
+    items = []
+    offset = 0
+    while offset < len(data):
+        (length,) = ITEM_HEADER.unpack_from(data, offset)
+        offset += ITEM_HEADER.size
+        items.append(from_bytes(data[offset:offset + length]))
+        offset += length
+    return items
+
+
+def encode_request(request_id: int, commands: list) -> bytes:
+    chunks = [MESSAGE_HEADER.pack(request_id, len(commands))]
+    for op, key, value in commands:
+        if op in MULTI_KEY_OPS:
+            key_bytes = b''
+            value_bytes = pack_items(key if op != 'mset' else (item for pair in zip(key, value) for item in pair))
+        elif op == 'setex':
+            key_bytes = to_bytes(key)
+            value_bytes = pack_items((repr(value[1]), value[0]))
+        else:
+            key_bytes = to_bytes(key) if key is not None else b''
+            value_bytes = to_bytes(value) if value is not None else b''
+        chunks.append(COMMAND_HEADER.pack(OP_CODES[op], len(key_bytes), len(value_bytes)))
+        chunks.append(key_bytes)
+        chunks.append(value_bytes)
+    return b''.join(chunks)
+
+
+def decode_request(payload: bytes) -> tuple:
+    request_id, count = MESSAGE_HEADER.unpack_from(payload, 0)
+    offset = MESSAGE_HEADER.size
+    commands = []
+    for _ in range(count):
+        op_code, key_len, value_len = COMMAND_HEADER.unpack_from(payload, offset)
+        offset += COMMAND_HEADER.size
+        if op_code not in OP_NAMES:
+            raise ProtocolError(f"Unknown op code {op_code}")
+        op = OP_NAMES[op_code]
+        key = from_bytes(payload[offset:offset + key_len]) if key_len or op in KEY_OPS else None
+        offset += key_len
+        if op in MULTI_KEY_OPS:
+            items = unpack_items(payload[offset:offset + value_len])
+            key, value = (items[0::2], items[1::2]) if op == 'mset' else (items, None)
+        elif op == 'setex':
+            ttl, stored = unpack_items(payload[offset:offset + value_len])
+            value = (stored, float(ttl))
+        else:
+            value = from_bytes(payload[offset:offset + value_len]) if value_len or op in VALUE_OPS else None
+        offset += value_len
+        commands.append((op, key, value))
+    return request_id, commands
+
+
+def has_empty_key(command: tuple) -> bool:
+    """
+    Whether a parsed command names the empty key, which is never stored
+    """
+    op, key, _ = command
+    if op in MULTI_KEY_OPS:
+        return '' in key
+    return op in KEY_OPS and key == ''
+
+
+def encode_response(request_id: int, results: list) -> bytes:
+    chunks = [MESSAGE_HEADER.pack(request_id, len(results))]
+    for result in results:
+        result_bytes = to_bytes(result)
+        chunks.append(RESULT_HEADER.pack(len(result_bytes)))
+        chunks.append(result_bytes)
+    return b''.join(chunks)
+
+
+def decode_response(payload: bytes) -> tuple:
+    request_id, count = MESSAGE_HEADER.unpack_from(payload, 0)
+    offset = MESSAGE_HEADER.size
+    results = []
+    for _ in range(count):
+        (length,) = RESULT_HEADER.unpack_from(payload, offset)
+        offset += RESULT_HEADER.size
+        results.append(from_bytes(payload[offset:offset + length]))
+        offset += length
+    return request_id, results
+
+
+def recv_exact(sock: socket.socket, size: int):
+    """
+    Read exactly size bytes from the socket, None if the peer closed
+    """
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+def send_frame(sock: socket.socket, payload: bytes, compressor=None) -> None:
+    if compressor is not None:
+        payload = compressor.encode(payload)
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket, compressor=None):
+    """
+    Read one length-prefixed frame, None if the peer closed
+    """
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+    payload = recv_exact(sock, length)
+    if payload is not None and compressor is not None:
+        payload = decompress_payload(payload, compressor)
+    return payload
+
+
+def decompress_payload(payload: bytes, compressor) -> bytes:
+    try:
+        payload = compressor.decode(payload)
+    except Exception as e:
+        raise ProtocolError(f"Invalid compressed frame: {e}")
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit")
+    return payload
+
+
+def accept_peer(sock: socket.socket, compression=None) -> tuple:
+    """
+    Peek at the negotiation byte, returns (binary, compressor). Consumes it
+    when the peer speaks binary and answers its compression hello, leaves
+    the stream untouched for legacy JSON peers.
+    """
+    first = sock.recv(1, socket.MSG_PEEK)
+    if not first or first[0] not in (MAGIC_BINARY, MAGIC_COMPRESSED):
+        return False, None
+    sock.recv(1)
+    if first[0] == MAGIC_BINARY:
+        return True, None
+    hello = recv_frame(sock)
+    if hello is None:
+        raise ConnectionError("Peer closed during compression negotiation")
+    reply, compressor = negotiate(unpack_items(hello), compression)
+    send_frame(sock, pack_items(reply))
+    return True, compressor
+
+
+def negotiate(hello: list, compression) -> tuple:
+    if compression is None:
+        return ['none', '0'], None
+    return compression.accept(hello)
+
+
+class PipelinedConnection:
+    """
+    Binary protocol connection that keeps many requests in flight.
+    Every request gets an id and a Future that is resolved by the reader
+    thread when the matching response arrives, in whatever order.
+    """
+    def __init__(self, address, compression=None):
+        self.address = address
+        if isinstance(address, str):
+            # Unix socket path
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self.compressor = None
+        if compression is None:
+            self.sock.sendall(bytes([MAGIC_BINARY]))
+        else:
+            hello = pack_items(compression.hello())
+            self.sock.sendall(bytes([MAGIC_COMPRESSED]) + FRAME_HEADER.pack(len(hello)) + hello)
+            reply = recv_frame(self.sock)
+            if reply is None:
+                raise ConnectionError(f"{address} closed during compression negotiation")
+            self.compressor = compression.finish(unpack_items(reply))
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.send_lock = threading.Lock()
+        self.closed = False
+        reader = threading.Thread(target=self.read_responses)
+        reader.daemon = True
+        reader.start()
+
+    def submit(self, commands: list) -> Future:
+        future = Future()
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionError(f"Connection to {self.address} is closed")
+            request_id = next(self.request_ids) & 0xFFFFFFFF
+            self.pending[request_id] = future
+            send_frame(self.sock, encode_request(request_id, commands), self.compressor)
+        return future
+
+    def request(self, commands: list, timeout: float = None) -> list:
+        return self.submit(commands).result(timeout)
+
+    def read_responses(self) -> None:
+        try:
+            while True:
+                payload = recv_frame(self.sock, self.compressor)
+                if payload is None:
+                    break
+                request_id, results = decode_response(payload)
+                future = self.pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(results)
+        except (OSError, ProtocolError, struct.error):
+            pass
+        finally:
+            self.fail_pending(ConnectionError(f"Connection to {self.address} lost"))
+
+    def fail_pending(self, error: Exception) -> None:
+        with self.send_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ServerPool:
+    """
+    Pool of pipelined connections to one server or coordinator. Sub-batches are spread
+    round-robin so a single slow socket does not serialize the server.
+    """
+    def __init__(self, address, size: int = 4, compression=None):
+        self.address = address
+        self.compression = compression
+        self.connections = [PipelinedConnection(address, compression) for _ in range(size)]
+        self.next_connection = itertools.cycle(range(size))
+        self.lock = threading.Lock()
+
+    def submit(self, commands: list) -> Future:
+        with self.lock:
+            index = next(self.next_connection)
+            connection = self.connections[index]
+            if connection.closed:
+                connection = self.connections[index] = PipelinedConnection(self.address, self.compression)
+        return connection.submit(commands)
+
+    def request(self, commands: list, timeout: float = None) -> list:
+        return self.submit(commands).result(timeout)
+
+    def close(self) -> None:
+        for connection in self.connections:
+            connection.close()
+
+
+class AsyncPipelinedConnection:
+    """
+    asyncio counterpart of PipelinedConnection, responses are matched to
+    requests by id on the event loop
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, compressor=None):
+        self.reader = reader
+        self.writer = writer
+        self.compressor = compressor
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.closed = False
+        self.reader_task = asyncio.ensure_future(self.read_responses())
+
+    @classmethod
+    async def open(cls, address: tuple, compression=None):
+        reader, writer = await asyncio.open_connection(*address)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if compression is None:
+            writer.write(bytes([MAGIC_BINARY]))
+            return cls(reader, writer)
+        hello = pack_items(compression.hello())
+        writer.write(bytes([MAGIC_COMPRESSED]) + FRAME_HEADER.pack(len(hello)) + hello)
+        (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        reply = unpack_items(await reader.readexactly(length))
+        return cls(reader, writer, compression.finish(reply))
+
+    def submit(self, commands: list) -> asyncio.Future:
+        if self.closed:
+            raise ConnectionError("Connection is closed")
+        request_id = next(self.request_ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        payload = encode_request(request_id, commands)
+        if self.compressor is not None:
+            payload = self.compressor.encode(payload)
+        self.writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+        return future
+
+    async def read_responses(self) -> None:
+        error = ConnectionError("Connection lost")
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+                payload = await self.reader.readexactly(length)
+                if self.compressor is not None:
+                    payload = decompress_payload(payload, self.compressor)
+                request_id, results = decode_response(payload)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(results)
+        except (asyncio.IncompleteReadError, OSError, ProtocolError, struct.error) as e:
+            error = ConnectionError(f"Connection lost: {e}")
+        finally:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    def close(self) -> None:
+        self.closed = True
+        self.reader_task.cancel()
+        self.writer.close()
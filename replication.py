@@ -0,0 +1,176 @@
+import threading
+import time
+from expiry import NO_EXPIRY, EXPIRY_MARK, encode_expiring, decode_expiring
+
+MISSING_KEY = "Error: Non existent key"
+# The coordinator stamps every value it writes: VERSION_MARK + 16 hex digit
+# version + the value tagged with its expiry time as in expiry.py. Since
+# every write is stamped, the stamp is always stripped before the value is
+# looked at and a value cannot pass for a stamp.
+VERSION_MARK = '\x00'
+VERSION_DIGITS = 16
+
+
+def encode_versioned(value: str, version: int, expires_at: float = None) -> str:
+    return f"{VERSION_MARK}{version:0{VERSION_DIGITS}x}{encode_expiring(value, expires_at)}"
+
+
+def decode_versioned(value: str) -> tuple:
+    """
+    Split a stored value into (version, expires_at or None, value). Values
+    stored without the coordinator have no stamp and count as the oldest
+    version.
+    """
+    digits = value[1:VERSION_DIGITS + 1]
+    if (value.startswith(VERSION_MARK) and len(value) > VERSION_DIGITS + 1
+            and value[VERSION_DIGITS + 1] in (NO_EXPIRY, EXPIRY_MARK)
+            and all(digit in '0123456789abcdef' for digit in digits)):
+        expires_at, value = decode_expiring(value[VERSION_DIGITS + 1:])
+        return int(digits, 16), expires_at, value
+    return 0, None, value
+
+
+class VersionClock:
+    """
+    Wall clock nanosecond version stamps that never go backwards within
+    one coordinator
+    """
+    def __init__(self):
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def next(self) -> int:
+        with self.lock:
+            self.last = max(self.last + 1, time.time_ns())
+            return self.last
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent replica round trips, used to derive the delay
+    after which a read is hedged to another replica
+    """
+    def __init__(self, window: int = 1024, initial_delay: float = 0.01, min_delay: float = 0.001):
+        self.window = window
+        self.samples = []
+        self.position = 0
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            if len(self.samples) < self.window:
+                self.samples.append(seconds)
+            else:
+                self.samples[self.position] = seconds
+                self.position = (self.position + 1) % self.window
+
+    def percentile(self, percent: float) -> float:
+        with self.lock:
+            if len(self.samples) < 20:
+                return self.initial_delay
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return max(self.min_delay, ordered[index])
+
+
+class QuorumOperation:
+    """
+    State of one replicated command. A set goes to every replica and
+    succeeds once `required` of them acknowledged it. A get starts on the
+    first `required` replicas, moves on to the next replica when one fails
+    or is slow, and returns the value with the newest version.
+    """
+    def __init__(self, position: int, command: tuple, replicas: list, required: int):
+        self.position = position
+        self.op, self.key, self.value = command
+        self.replicas = replicas
+        self.required = min(required, len(replicas))
+        self.next_replica = 0
+        self.outstanding = 0
+        self.successes = 0
+        self.responses = {}
+        self.error = "Error: Server unavailable"
+        self.deleted = False
+        self.done = False
+
+    def is_read(self) -> bool:
+        return self.op == 'get'
+
+    def initial_targets(self) -> list:
+        count = self.required if self.is_read() else len(self.replicas)
+        return [self.take_replica() for _ in range(count)]
+
+    def take_replica(self):
+        """
+        Next replica that has not been asked yet, None if all were
+        """
+        if self.next_replica >= len(self.replicas):
+            return None
+        replica = self.replicas[self.next_replica]
+        self.next_replica += 1
+        self.outstanding += 1
+        return replica
+
+    def needs_hedge(self) -> bool:
+        return not self.done and self.is_read() and self.next_replica < len(self.replicas)
+
+    def record_result(self, replica, result: str) -> None:
+        self.outstanding -= 1
+        if self.done:
+            return
+        if result == MISSING_KEY and self.is_read():
+            self.responses[replica] = (-1, None, None)
+            self.successes += 1
+        elif result == MISSING_KEY and self.op == 'del':
+            self.successes += 1
+        elif result.startswith("Error"):
+            self.error = result
+        elif self.is_read():
+            self.responses[replica] = decode_versioned(result)
+            self.successes += 1
+        else:
+            self.deleted = self.deleted or result == "Deleted"
+            self.successes += 1
+        self.done = self.successes >= self.required or self.exhausted()
+
+    def record_failure(self) -> None:
+        self.outstanding -= 1
+        if not self.done:
+            self.done = self.exhausted()
+
+    def exhausted(self) -> bool:
+        return self.outstanding == 0 and self.next_replica >= len(self.replicas)
+
+    def result(self) -> str:
+        if self.successes == 0:
+            return self.error
+        if self.successes < self.required:
+            return "Error: Read quorum not reached" if self.is_read() else "Error: Write quorum not reached"
+        if self.op == 'del':
+            return "Deleted" if self.deleted else MISSING_KEY
+        if not self.is_read():
+            return "Inserted"
+        _, expires_at, value = self.latest()
+        if value is None:
+            return MISSING_KEY
+        # the expiry time the coordinator set, so a replica whose own timer
+        # lags cannot revive the key
+        if expires_at is not None and expires_at <= time.time():
+            return MISSING_KEY
+        return value
+
+    def latest(self) -> tuple:
+        return max(self.responses.values(), key=lambda response: response[0])
+
+    def stale_replicas(self) -> list:
+        """
+        Replicas that answered with an older version than the winner
+        """
+        if self.successes < self.required:
+            return []
+        version, _, value = self.latest()
+        if value is None:
+            return []
+        return [replica for replica, response in self.responses.items() if response[0] < version]
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+import zlib
+from lruCache import LRUCache
+from arrayLruCache import ArrayLRUCache
+from policyCache import PolicyCache
+from performance_statistics import PerformanceStatistics
+
+
+class ShardedLRUCache:
+    """
+    Thread-safe LRU cache. The keyspace is split into independently locked
+    LRUCache segments, each with its own capacity, disk tier and statistics,
+    so threads working on different shards never contend. Disk reads run
+    outside the shard lock.
+    """
+    def __init__(self, capacity: int, disk_path: str = "cache_disk", storage: str = "log", shards: int = 16,
+                 capacity_bytes: int = None, eviction_policy: str = "lru", **storage_options):
+        self.shard_count = shards
+        shard_paths = [os.path.join(disk_path, f"shard{i}") for i in range(shards)] if shards > 1 else [disk_path]
+        if eviction_policy != "lru":
+            shard_capacity = max(1, capacity // shards)
+            self.shards = [PolicyCache(shard_capacity, path, storage, eviction_policy, **storage_options) for path in shard_paths]
+        elif capacity_bytes:
+            shard_bytes = max(1, capacity_bytes // shards)
+            self.shards = [ArrayLRUCache(shard_bytes, path, storage, **storage_options) for path in shard_paths]
+        else:
+            shard_capacity = max(1, capacity // shards)
+            self.shards = [LRUCache(shard_capacity, path, storage, **storage_options) for path in shard_paths]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        # bumped on every write to a shard, a disk read that overlapped one
+        # may have seen either value and is repeated under the lock
+        self.generations = [0] * shards
+
+    def shard_index(self, key) -> int:
+        # crc32 is stable across processes, so keys find their disk shard after a restart
+        return zlib.crc32(str(key).encode('utf-8', 'surrogateescape')) % self.shard_count
+
+    def get(self, key):
+        return self.read(key, promote=True)
+
+    def put(self, key, value) -> None:
+        index = self.shard_index(key)
+        with self.locks[index]:
+            self.generations[index] += 1
+            self.shards[index].put(key, value)
+
+    def try_get_from_memory(self, key):
+        """
+        Value held in memory, None if it is not or the shard is busy.
+        Never waits, so it is safe to call from an event loop.
+        """
+        index = self.shard_index(key)
+        lock = self.locks[index]
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            shard = self.shards[index]
+            return shard.get_from_memory(key) if shard.contains(key) else None
+        finally:
+            lock.release()
+
+    def read(self, key, promote: bool):
+        """
+        Look the key up in memory, then in the disk tier without holding
+        the shard lock. With promote, a policy cache admits the value
+        found on disk as its get would.
+        """
+        index = self.shard_index(key)
+        shard = self.shards[index]
+        lock = self.locks[index]
+        start_time = time.perf_counter_ns()
+        with lock:
+            if shard.contains(key):
+                return shard.get_from_memory(key)
+            if not shard.bloom.might_contain(key):
+                value = shard.get_from_disk(key)
+                return shard.promote(key, value) if promote else value
+            generation = self.generations[index]
+        value = shard.read_from_disk(key)
+        with lock:
+            if self.generations[index] != generation:
+                # the key may have been written during the read, look again
+                if shard.contains(key):
+                    return shard.get_from_memory(key)
+                value = shard.get_from_disk(key)
+            else:
+                value = shard.record_disk_read(start_time, value)
+            return shard.promote(key, value) if promote else value
+
+    def keys(self) -> set:
+        keys = set()
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                keys.update(shard.keys())
+        return keys
+
+    def peek(self, key):
+        index = self.shard_index(key)
+        with self.locks[index]:
+            return self.shards[index].peek(key)
+
+    def put_if_absent(self, key, value) -> bool:
+        index = self.shard_index(key)
+        with self.locks[index]:
+            self.generations[index] += 1
+            return self.shards[index].put_if_absent(key, value)
+
+    def delete(self, key) -> bool:
+        index = self.shard_index(key)
+        with self.locks[index]:
+            self.generations[index] += 1
+            return self.shards[index].delete(key)
+
+    def delete_if_expired(self, key, now: float) -> bool:
+        index = self.shard_index(key)
+        with self.locks[index]:
+            self.generations[index] += 1
+            return self.shards[index].delete_if_expired(key, now)
+
+    def snapshot_items(self) -> list:
+        """
+        Pairs held in memory, least recently used first within each shard
+        """
+        items = []
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                items.extend(shard.snapshot_items())
+        return items
+
+    def restore_items(self, items: list, skip_spilled: bool = False) -> int:
+        by_shard = [[] for _ in self.shards]
+        for key, value in items:
+            by_shard[self.shard_index(key)].append((key, value))
+        restored = 0
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                self.generations[index] += 1
+                restored += shard.restore_items(by_shard[index], skip_spilled)
+        return restored
+
+    @property
+    def stats(self) -> PerformanceStatistics:
+        combined = PerformanceStatistics()
+        for shard in self.shards:
+            combined.merge(shard.stats)
+        return combined
+
+    def shard_statistics(self) -> list:
+        return [shard.stats.get_statistics() for shard in self.shards]
+
+    def close(self) -> None:
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                shard.close()
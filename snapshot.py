@@ -0,0 +1,76 @@
+import os
+import struct
+import zlib
+
+# Snapshot file: header, then one entry per cached key from the least to
+# the most recently used, then a CRC32 over everything before it.
+MAGIC = b'DHTS'
+VERSION = 1
+HEADER = struct.Struct('!4sBBQ')
+ENTRY_HEADER = struct.Struct('!II')
+TRAILER = struct.Struct('!I')
+
+# Written by a clean shutdown, so nothing can be newer than the snapshot.
+FLAG_CLEAN = 1
+
+
+def encode(data) -> bytes:
+    return str(data).encode('utf-8', 'surrogateescape')
+
+
+def decode(data: bytes) -> str:
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def save_snapshot(path: str, items: list, clean: bool = False) -> None:
+    """
+    Atomically write (key, value) pairs, ordered from least to most
+    recently used
+    """
+    chunks = [HEADER.pack(MAGIC, VERSION, FLAG_CLEAN if clean else 0, len(items))]
+    for key, value in items:
+        key_bytes = encode(key)
+        value_bytes = encode(value)
+        chunks.append(ENTRY_HEADER.pack(len(key_bytes), len(value_bytes)))
+        chunks.append(key_bytes)
+        chunks.append(value_bytes)
+    data = b''.join(chunks)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.write(TRAILER.pack(zlib.crc32(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str):
+    """
+    Read a snapshot written by save_snapshot, returns (items, clean) or
+    None if it is missing, torn or corrupt
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size + TRAILER.size:
+        return None
+    body = data[:-TRAILER.size]
+    (crc,) = TRAILER.unpack_from(data, len(body))
+    if zlib.crc32(body) != crc:
+        return None
+    magic, version, flags, count = HEADER.unpack_from(body, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    items = []
+    offset = HEADER.size
+    for _ in range(count):
+        key_length, value_length = ENTRY_HEADER.unpack_from(body, offset)
+        offset += ENTRY_HEADER.size
+        key = decode(body[offset:offset + key_length])
+        offset += key_length
+        items.append((key, decode(body[offset:offset + value_length])))
+        offset += value_length
+    return items, bool(flags & FLAG_CLEAN)
@@ -0,0 +1,574 @@
+import hashlib
+import itertools
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from compression import Compressor
+from logger import Logger
+
+logger = Logger(name='StorageLogger')
+
+NOT_FOUND = -1
+
+# Record: crc32, flags, key length, value length, then key and value bytes.
+# The crc covers everything after itself.
+RECORD_HEADER = struct.Struct('!IBHI')
+FLAG_PUT = 0
+FLAG_DELETE = 1
+# set on puts whose value went through the compressor
+FLAG_COMPRESSED = 2
+
+# Sealed segments end with a footer holding the segment's index entries
+# followed by a trailer (footer offset, entry count, magic).
+FOOTER_ENTRY = struct.Struct('!BHII')
+TRAILER = struct.Struct('!QII')
+TRAILER_MAGIC = 0x4C534654
+
+
+# key lengths are stored in 16 bits
+MAX_KEY_BYTES = 0xFFFF
+
+
+def encode(data: str) -> bytes:
+    return data.encode('utf-8', 'surrogateescape')
+
+
+def validate_item(key, value) -> None:
+    """
+    Raise ValueError for a pair the disk tier could not store, so it is
+    rejected when written instead of failing once it gets evicted
+    """
+    if not isinstance(key, str) or not isinstance(value, str):
+        raise ValueError("Keys and values must be strings")
+    try:
+        key_bytes = encode(key)
+        encode(value)
+    except UnicodeEncodeError:
+        raise ValueError("Keys and values must be valid UTF-8")
+    if len(key_bytes) > MAX_KEY_BYTES:
+        raise ValueError("Key too long")
+
+
+def decode(data: bytes) -> str:
+    return data.decode('utf-8', 'surrogateescape')
+
+
+class JsonFileStorage:
+    """
+    Original disk tier: one JSON file per key. Files are named after a
+    hash of the key, so a key cannot name a path outside the directory,
+    and hold {key: value}.
+    """
+    def __init__(self, path: str, durability: str = "none"):
+        self.path = path
+        self.durability = durability
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.rename_legacy_files()
+
+    def file_path(self, key) -> str:
+        return os.path.join(self.path, hashlib.sha256(encode(key)).hexdigest() + ".json")
+
+    def rename_legacy_files(self) -> None:
+        """
+        Move files named after the key itself, as older versions wrote
+        them, to their hashed name
+        """
+        for name in os.listdir(self.path):
+            digest = name[:-len('.json')]
+            if not name.endswith('.json') or (len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)):
+                continue
+            legacy_path = os.path.join(self.path, name)
+            for key in self.read_file(legacy_path):
+                os.replace(legacy_path, self.file_path(key))
+
+    @staticmethod
+    def read_file(file_path: str) -> dict:
+        try:
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, key, value) -> None:
+        file_path = self.file_path(key)
+        with open(file_path, 'w') as f:
+            json.dump({key: value}, f)
+            if self.durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+
+    def write_batch(self, items: list) -> None:
+        for key, value in items:
+            self.write(key, value)
+
+    def read(self, key):
+        return self.read_file(self.file_path(key)).get(key, NOT_FOUND)
+
+    def delete(self, key) -> None:
+        file_path = self.file_path(key)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    def keys(self) -> list:
+        keys = []
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                keys.extend(self.read_file(os.path.join(self.path, name)))
+        return keys
+
+    def close(self) -> None:
+        pass
+
+
+def legacy_json_files(path: str) -> list:
+    """
+    Files the original server spilled straight into path, one
+    <key>.json per key holding {key: value}
+    """
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith('.json') and os.path.isfile(os.path.join(path, name))]
+
+
+class LogStructuredStorage:
+    """
+    Disk tier made of append-only segment files and an in-memory index of
+    key -> (segment id, value offset, value length). Writes are sequential
+    appends to the active segment and a read is a single pread.
+    When the active segment is full it is sealed with a footer so recovery
+    can load its index without scanning the data. Overwritten and deleted
+    records are reclaimed by a background compaction thread.
+    """
+    def __init__(self, path: str, durability: str = "none", segment_size: int = 64 * 1024 * 1024,
+                 compaction_threshold: float = 0.5, compaction_interval: float = 30.0, compressor=None):
+        self.path = path
+        self.durability = durability
+        # values worth it are stored compressed, records remember which
+        self.compressor = compressor if compressor is not None else Compressor(None)
+        self.segment_size = segment_size
+        self.compaction_threshold = compaction_threshold
+        self.compaction_interval = compaction_interval
+        self.index = {}
+        self.segment_fds = {}
+        self.live_bytes = {}
+        self.total_bytes = {}
+        self.tombstones = {}
+        self.lock = threading.RLock()
+        self.closed = threading.Event()
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.recover()
+        compaction_thread = threading.Thread(target=self.compaction_loop)
+        compaction_thread.daemon = True
+        compaction_thread.start()
+
+    def segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.path, f"segment-{segment_id:06d}.log")
+
+    def list_segments(self) -> list:
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith('segment-') and name.endswith('.log'):
+                segments.append(int(name[len('segment-'):-len('.log')]))
+        return sorted(segments)
+
+    def recover(self) -> None:
+        """
+        Rebuild the index from the segment files. Sealed segments are loaded
+        from their footer, the unsealed tail segment is scanned and cut at
+        the first torn or corrupt record.
+        """
+        segments = self.list_segments()
+        for segment_id in segments:
+            fd = os.open(self.segment_path(segment_id), os.O_RDWR | os.O_APPEND)
+            self.segment_fds[segment_id] = fd
+            self.live_bytes[segment_id] = 0
+            self.total_bytes[segment_id] = 0
+            self.tombstones[segment_id] = set()
+            footer = self.read_footer(fd)
+            if footer is None:
+                entries = self.scan_segment(fd)
+                if segment_id != segments[-1]:
+                    logger.warning(f"Segment {segment_id} has no footer, recovered by scanning")
+            else:
+                entries, data_size = footer
+            for flags, key, offset, length in entries:
+                self.apply(segment_id, flags, key, offset, length)
+            if footer is not None:
+                # the footer only lists live records, the rest of the data is dead
+                self.total_bytes[segment_id] = data_size
+        if segments and self.read_footer(self.segment_fds[segments[-1]]) is None:
+            self.active_id = segments[-1]
+            self.active_offset = os.fstat(self.segment_fds[self.active_id]).st_size
+        else:
+            self.open_segment((segments[-1] + 1) if segments else 1)
+        logger.info(f"Recovered {len(self.index)} keys from {len(segments)} segments")
+
+    def apply(self, segment_id: int, flags: int, key: str, offset: int, length: int) -> None:
+        record_size = RECORD_HEADER.size + len(encode(key)) + length
+        self.total_bytes[segment_id] += record_size
+        previous = self.index.pop(key, None)
+        if previous is not None:
+            self.live_bytes[previous[0]] -= previous[3]
+        if flags == FLAG_DELETE:
+            self.tombstones[segment_id].add(key)
+        else:
+            self.tombstones[segment_id].discard(key)
+            self.index[key] = (segment_id, offset, length, record_size, flags)
+            self.live_bytes[segment_id] += record_size
+
+    def read_footer(self, fd: int):
+        size = os.fstat(fd).st_size
+        if size < TRAILER.size:
+            return None
+        footer_offset, count, magic = TRAILER.unpack(os.pread(fd, TRAILER.size, size - TRAILER.size))
+        if magic != TRAILER_MAGIC or footer_offset > size - TRAILER.size:
+            return None
+        footer = os.pread(fd, size - TRAILER.size - footer_offset, footer_offset)
+        entries = []
+        position = 0
+        for _ in range(count):
+            flags, key_length, offset, length = FOOTER_ENTRY.unpack_from(footer, position)
+            position += FOOTER_ENTRY.size
+            key = decode(footer[position:position + key_length])
+            position += key_length
+            entries.append((flags, key, offset, length))
+        return entries, footer_offset
+
+    def scan_segment(self, fd: int) -> list:
+        size = os.fstat(fd).st_size
+        data = os.pread(fd, size, 0)
+        entries = []
+        position = 0
+        while position + RECORD_HEADER.size <= size:
+            crc, flags, key_length, value_length = RECORD_HEADER.unpack_from(data, position)
+            end = position + RECORD_HEADER.size + key_length + value_length
+            if end > size or zlib.crc32(data[position + 4:end]) != crc:
+                break
+            key_start = position + RECORD_HEADER.size
+            key = decode(data[key_start:key_start + key_length])
+            entries.append((flags, key, key_start + key_length, value_length))
+            position = end
+        if position < size:
+            logger.warning(f"Truncating {size - position} bytes of torn records")
+            os.ftruncate(fd, position)
+        return entries
+
+    def open_segment(self, segment_id: int) -> None:
+        fd = os.open(self.segment_path(segment_id), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segment_fds[segment_id] = fd
+        self.live_bytes[segment_id] = 0
+        self.total_bytes[segment_id] = 0
+        self.tombstones[segment_id] = set()
+        self.active_id = segment_id
+        self.active_offset = 0
+
+    def seal_active_segment(self) -> None:
+        """
+        Write the footer of the active segment and start a new one
+        """
+        chunks = []
+        count = 0
+        for key, (segment_id, offset, length, _, flags) in self.index.items():
+            if segment_id == self.active_id:
+                key_bytes = encode(key)
+                chunks.append(FOOTER_ENTRY.pack(flags, len(key_bytes), offset, length) + key_bytes)
+                count += 1
+        for key in self.tombstones[self.active_id]:
+            key_bytes = encode(key)
+            chunks.append(FOOTER_ENTRY.pack(FLAG_DELETE, len(key_bytes), 0, 0) + key_bytes)
+            count += 1
+        fd = self.segment_fds[self.active_id]
+        os.write(fd, b''.join(chunks) + TRAILER.pack(self.active_offset, count, TRAILER_MAGIC))
+        os.fsync(fd)
+        self.open_segment(self.active_id + 1)
+
+    def encode_record(self, flags: int, key: str, value: bytes) -> bytes:
+        key_bytes = encode(key)
+        body = RECORD_HEADER.pack(0, flags, len(key_bytes), len(value))[4:] + key_bytes + value
+        return struct.pack('!I', zlib.crc32(body)) + body
+
+    def append(self, flags: int, key: str, value: bytes) -> None:
+        self.append_batch([(flags, key, value)])
+
+    def append_batch(self, records: list) -> None:
+        """
+        Append records with as few write calls as possible, one per segment
+        the batch touches
+        """
+        with self.lock:
+            buffer = []
+            pending = []
+            for flags, key, value in records:
+                record = self.encode_record(flags, key, value)
+                if self.active_offset + len(record) > self.segment_size and self.active_offset > 0:
+                    self.flush_records(buffer, pending)
+                    buffer, pending = [], []
+                    self.seal_active_segment()
+                value_offset = self.active_offset + len(record) - len(value)
+                buffer.append(record)
+                pending.append((flags, key, value_offset, len(value)))
+                self.active_offset += len(record)
+            self.flush_records(buffer, pending)
+
+    def flush_records(self, buffer: list, pending: list) -> None:
+        if not buffer:
+            return
+        os.write(self.segment_fds[self.active_id], b''.join(buffer))
+        for flags, key, value_offset, length in pending:
+            self.apply(self.active_id, flags, key, value_offset, length)
+
+    def put_record(self, key, value) -> tuple:
+        data = encode(value)
+        compressed = self.compressor.compress(data)
+        if compressed is not None:
+            return FLAG_PUT | FLAG_COMPRESSED, str(key), compressed
+        return FLAG_PUT, str(key), data
+
+    def write(self, key, value) -> None:
+        self.append(*self.put_record(key, value))
+        if self.durability != "none":
+            self.sync()
+
+    def write_batch(self, items: list) -> None:
+        """
+        Group commit: one write and at most one fsync for the whole batch
+        """
+        self.append_batch([self.put_record(key, value) for key, value in items])
+        if self.durability != "none":
+            self.sync()
+
+    def read(self, key):
+        with self.lock:
+            entry = self.index.get(str(key))
+            if entry is None:
+                return NOT_FOUND
+            segment_id, offset, length, _, flags = entry
+            data = os.pread(self.segment_fds[segment_id], length, offset)
+        if flags & FLAG_COMPRESSED:
+            data = self.compressor.decompress(data)
+        return decode(data)
+
+    def delete(self, key) -> None:
+        with self.lock:
+            if str(key) in self.index:
+                self.append(FLAG_DELETE, str(key), b'')
+
+    def keys(self) -> list:
+        with self.lock:
+            return list(self.index)
+
+    def sync(self) -> None:
+        with self.lock:
+            os.fsync(self.segment_fds[self.active_id])
+
+    def compaction_loop(self) -> None:
+        while not self.closed.wait(self.compaction_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting segments: {e}")
+
+    def compact(self) -> int:
+        """
+        Rewrite the live records of mostly-dead sealed segments into the
+        active segment and delete the old files. Returns the number of
+        segments reclaimed.
+        """
+        with self.lock:
+            oldest = min(self.segment_fds)
+            candidates = [segment_id for segment_id in self.segment_fds
+                          if segment_id != self.active_id and self.total_bytes[segment_id] > 0
+                          and self.live_bytes[segment_id] / self.total_bytes[segment_id] < self.compaction_threshold]
+        reclaimed = 0
+        for segment_id in sorted(candidates):
+            with self.lock:
+                live = [(key, entry) for key, entry in self.index.items() if entry[0] == segment_id]
+                for key, (_, offset, length, _, flags) in live:
+                    self.append(flags, key, os.pread(self.segment_fds[segment_id], length, offset))
+                # a tombstone can only be dropped once no older segment may
+                # still hold a value for its key
+                if segment_id != oldest:
+                    for key in list(self.tombstones[segment_id]):
+                        if key not in self.index:
+                            self.append(FLAG_DELETE, key, b'')
+                os.fsync(self.segment_fds[self.active_id])
+                os.close(self.segment_fds.pop(segment_id))
+                del self.live_bytes[segment_id], self.total_bytes[segment_id], self.tombstones[segment_id]
+                os.remove(self.segment_path(segment_id))
+                oldest = min(self.segment_fds)
+                reclaimed += 1
+        if reclaimed:
+            logger.info(f"Compaction reclaimed {reclaimed} segments")
+        return reclaimed
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.lock:
+            for fd in self.segment_fds.values():
+                os.close(fd)
+            self.segment_fds = {}
+
+
+# seconds flush and close wait on a disk tier whose writes keep failing
+FLUSH_TIMEOUT = 10.0
+
+
+class WriteBackBuffer:
+    """
+    Write-back front for a storage engine. Writes land in a bounded dirty
+    buffer that reads are answered from, and a background thread flushes
+    the buffer to the engine in groups so the request path never waits on
+    the disk unless the buffer is full.
+    """
+    def __init__(self, storage, max_dirty: int = 4096, batch_size: int = 512, flush_interval: float = 0.005,
+                 flush_timeout: float = FLUSH_TIMEOUT):
+        self.storage = storage
+        self.max_dirty = max_dirty
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_timeout = flush_timeout
+        # when the engine's writes started failing, None while they succeed
+        self.failing_since = None
+        self.last_error = None
+        self.dirty = {}
+        self.condition = threading.Condition()
+        # held while a group is written so a delete cannot be undone by it
+        self.flush_lock = threading.Lock()
+        self.closed = False
+        flush_thread = threading.Thread(target=self.flush_loop)
+        flush_thread.daemon = True
+        flush_thread.start()
+
+    def write(self, key, value) -> None:
+        with self.condition:
+            while len(self.dirty) >= self.max_dirty and key not in self.dirty:
+                # buffer full, wait for the flusher to make room
+                self.condition.notify_all()
+                self.condition.wait()
+            self.dirty.pop(key, None)
+            self.dirty[key] = value
+            if len(self.dirty) >= self.batch_size:
+                self.condition.notify_all()
+
+    def write_batch(self, items: list) -> None:
+        for key, value in items:
+            self.write(key, value)
+
+    def read(self, key):
+        with self.condition:
+            if key in self.dirty:
+                return self.dirty[key]
+        return self.storage.read(key)
+
+    def delete(self, key) -> None:
+        with self.flush_lock:
+            with self.condition:
+                self.dirty.pop(key, None)
+            self.storage.delete(key)
+
+    def keys(self) -> list:
+        with self.condition:
+            pending = list(self.dirty)
+        return list(set(self.storage.keys()).union(pending))
+
+    def flush_loop(self) -> None:
+        while True:
+            with self.condition:
+                if not self.dirty and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                if self.closed and not self.dirty:
+                    return
+                batch = list(itertools.islice(self.dirty.items(), self.batch_size))
+            if not batch:
+                continue
+            with self.flush_lock:
+                with self.condition:
+                    # drop entries deleted since the batch was taken
+                    batch = [(key, value) for key, value in batch if self.dirty.get(key) is value]
+                try:
+                    self.storage.write_batch(batch)
+                except Exception as e:
+                    logger.error(f"Error flushing write-back buffer: {e}")
+                    with self.condition:
+                        self.last_error = e
+                        if self.failing_since is None:
+                            self.failing_since = time.monotonic()
+                        self.condition.notify_all()
+                    time.sleep(self.flush_interval)
+                    continue
+                with self.condition:
+                    self.failing_since = None
+                    for key, value in batch:
+                        # keep entries that were overwritten while flushing
+                        if self.dirty.get(key) is value:
+                            del self.dirty[key]
+                    self.condition.notify_all()
+
+    def flush(self) -> bool:
+        """
+        Block until everything buffered so far is written. Gives up and
+        returns False once the engine's writes have failed for
+        flush_timeout seconds in a row.
+        """
+        with self.condition:
+            while self.dirty:
+                if self.failing_since is not None and time.monotonic() - self.failing_since >= self.flush_timeout:
+                    return False
+                self.condition.notify_all()
+                self.condition.wait(self.flush_interval)
+            return True
+
+    def close(self) -> int:
+        """
+        Flush and close the engine. Returns the number of buffered writes
+        dropped because the engine kept failing.
+        """
+        self.flush()
+        with self.flush_lock:
+            with self.condition:
+                self.closed = True
+                dropped = len(self.dirty)
+                self.dirty.clear()
+                self.condition.notify_all()
+        if dropped:
+            logger.error(f"Dropped {dropped} buffered writes, the disk tier kept failing: {self.last_error}")
+        self.storage.close()
+        return dropped
+
+
+STORAGE_ENGINES = {
+    'log': LogStructuredStorage,
+    'json': JsonFileStorage,
+}
+
+
+DURABILITY_MODES = ('none', 'batch', 'write')
+
+
+def create_storage(engine: str, path: str, durability: str = "none", write_back: bool = False, compressor=None):
+    """
+    Build a disk tier. durability controls fsync: never ('none'), once per
+    flushed group ('batch') or before every write returns ('write').
+    With write_back, evictions are buffered and flushed in the background,
+    except in 'write' mode which needs every write on disk before the put
+    returns. 'batch' always goes through the buffer, without it every
+    write would be a group of its own and get its own fsync. A compressor
+    (compression.Compressor) is used by the log engine only.
+    """
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine {engine}")
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Unknown durability mode {durability}")
+    if engine == 'log':
+        storage = LogStructuredStorage(path, durability, compressor=compressor)
+    else:
+        storage = STORAGE_ENGINES[engine](path, durability)
+    if (write_back or durability == "batch") and durability != "write":
+        storage = WriteBackBuffer(storage)
+    return storage
@@ -0,0 +1,58 @@
+import socket
+import threading
+import time
+import pytest
+from dht import DHT
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port):
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.02)
+    raise TimeoutError(f"nothing listening on port {port}")
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def servers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    addresses = []
+    for _ in range(3):
+        port = free_port()
+        start(DHT('127.0.0.1', port, capacity=100).listen_to_clients)
+        wait_for_port(port)
+        addresses.append(('127.0.0.1', port))
+    return addresses
+
+
+@pytest.fixture
+def coordinator_at(servers):
+    """
+    Start a coordinator for the servers listening in the background,
+    returns the node and its address
+    """
+    from coordinator_node import CoordinatorNode
+
+    def start_coordinator(**options):
+        port = free_port()
+        node = CoordinatorNode('127.0.0.1', port, servers, **options)
+        start(node.listen_to_clients)
+        wait_for_port(port)
+        return node, ('127.0.0.1', port)
+    return start_coordinator
@@ -0,0 +1,107 @@
+import threading
+import time
+from admission import FairQueue
+from protocol import PipelinedConnection
+
+
+def drain(queue: FairQueue, count: int) -> list:
+    return [queue.get()[0] for _ in range(count)]
+
+
+def test_clients_take_turns():
+    queue = FairQueue(quantum=1, slo=0)
+    for client in 'abc':
+        queue.register(client)
+        for index in range(3):
+            queue.put(client, f'{client}{index}')
+    assert drain(queue, 9) == ['a0', 'b0', 'c0', 'a1', 'b1', 'c1', 'a2', 'b2', 'c2']
+
+
+def test_big_batches_get_the_same_share_of_commands_as_single_commands():
+    queue = FairQueue(client_limit=1000, quantum=64, slo=0)
+    queue.register('batches')
+    queue.register('singles')
+    for _ in range(20):
+        queue.put('batches', ('batches', 64), 64)
+    for _ in range(1000):
+        queue.put('singles', ('singles', 1), 1)
+    served = {'batches': 0, 'singles': 0}
+    while served['batches'] < 10 * 64:
+        client, cost = queue.get()[0]
+        served[client] += cost
+    assert abs(served['batches'] - served['singles']) <= 64
+
+
+def test_batch_bigger_than_the_quantum_waits_for_enough_turns():
+    queue = FairQueue(client_limit=1000, quantum=64, slo=0)
+    queue.register('big')
+    queue.register('small')
+    queue.put('big', 'big', 150)
+    for index in range(200):
+        queue.put('small', f'small{index}')
+    order = drain(queue, 201)
+    # 150 commands need three quanta, the other client is served a quantum on each of the two turns between
+    assert order.index('big') == 2 * 64
+    assert [item for item in order if item != 'big'] == [f'small{index}' for index in range(200)]
+
+
+def test_requests_waiting_past_the_slo_are_shed():
+    queue = FairQueue(slo=0.02)
+    queue.register('client')
+    queue.put('client', 'old', 5)
+    time.sleep(0.03)
+    queue.put('client', 'new', 1)
+    assert queue.get() == ('old', True)
+    assert queue.get() == ('new', False)
+    statistics = queue.get_statistics()
+    assert statistics['queue_shed_requests'] == 1
+    assert statistics['queue_shed_commands'] == 5
+
+
+def test_full_client_queue_blocks_until_a_request_is_served():
+    queue = FairQueue(client_limit=2, slo=0)
+    queue.register('client')
+    queue.put('client', 1)
+    queue.put('client', 2)
+    third = threading.Thread(target=queue.put, args=('client', 3))
+    third.start()
+    third.join(0.1)
+    assert third.is_alive()
+    assert queue.get() == (1, False)
+    third.join(1)
+    assert not third.is_alive()
+    assert drain(queue, 2) == [2, 3]
+    assert queue.get_statistics()['queue_backpressure_waits'] == 1
+
+
+def test_disconnected_client_is_forgotten_after_its_requests_are_served():
+    queue = FairQueue(slo=0)
+    queue.register('client')
+    queue.put('client', 1)
+    queue.unregister('client')
+    assert queue.get_statistics()['queue_clients'] == 1
+    assert queue.get() == (1, False)
+    assert queue.get_statistics()['queue_clients'] == 0
+
+
+def test_coordinator_answers_shed_requests_with_an_overloaded_error(coordinator_at):
+    node, address = coordinator_at(queue_slo=0.05, compression='none')
+    process_batch = node.process_batch
+    started = threading.Event()
+
+    def slow_first_batch(commands):
+        if not started.is_set():
+            started.set()
+            time.sleep(0.2)
+        return process_batch(commands)
+
+    node.process_batch = slow_first_batch
+    connection = PipelinedConnection(address)
+    first = connection.submit([('set', 'key', 'value')])
+    started.wait(5)
+    # queued behind the slow batch for longer than the SLO
+    later = [connection.submit([('get', 'key', None), ('get', 'other', None)]) for _ in range(3)]
+    assert first.result(5) == ['Inserted']
+    assert [future.result(5) for future in later] == [['Error: overloaded'] * 2] * 3
+    assert connection.request([('get', 'key', None)], 5) == ['value']
+    connection.close()
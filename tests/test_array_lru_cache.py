@@ -0,0 +1,78 @@
+import random
+import tracemalloc
+from arrayLruCache import ArrayLRUCache, SlotIndex
+from lruCache import LRUCache
+
+
+def bytes_per_entry(make_cache, items):
+    """
+    Memory the cache itself holds per entry, the strings are allocated
+    before tracing starts
+    """
+    tracemalloc.start()
+    cache = make_cache()
+    before = tracemalloc.get_traced_memory()[0]
+    for key, value in items:
+        cache.put(key, value)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(cache.cache_map) == len(items)
+    cache.close()
+    return used / len(items)
+
+
+def test_bytes_per_entry_bound(tmp_path):
+    items = [(f"key{number:09d}", f"value{number:09d}") for number in range(100000)]
+    array_bytes = bytes_per_entry(lambda: ArrayLRUCache(len(items) * 26, str(tmp_path / 'array')), items)
+    node_bytes = bytes_per_entry(lambda: LRUCache(len(items), str(tmp_path / 'node')), items)
+    # the slot arrays and the index double as they grow, hence the headroom
+    assert array_bytes < 64
+    assert array_bytes < node_bytes / 2
+
+
+def test_matches_lru_cache(tmp_path):
+    rng = random.Random(1)
+    array_cache = ArrayLRUCache(200, str(tmp_path / 'array'))
+    for step in range(5000):
+        key = f"k{rng.randrange(60)}"
+        action = rng.random()
+        if action < 0.5:
+            array_cache.put(key, 'v' * rng.randrange(1, 20) + str(step))
+            assert array_cache.used_bytes <= 200
+        elif action < 0.6:
+            array_cache.delete(key)
+        else:
+            array_cache.get(key)
+    items = array_cache.snapshot_items()
+    assert sum(len(key) + len(value) for key, value in items) == array_cache.used_bytes
+    assert sorted(array_cache.cache_map) == sorted(key for key, _ in items)
+    for key, value in items:
+        assert array_cache.peek(key) == value
+    array_cache.close()
+
+
+def test_replacing_a_value_keeps_its_slot_and_evicts_others(tmp_path):
+    cache = ArrayLRUCache(20, str(tmp_path))
+    cache.put('a', '1234')
+    cache.put('b', '1234')
+    slot = cache.cache_map['a']
+    cache.put('a', '1' * 18)
+    assert cache.cache_map['a'] == slot
+    assert 'b' not in cache.cache_map
+    assert cache.get('b') == '1234'
+    assert cache.used_bytes == 19
+    cache.close()
+
+
+def test_slot_index_survives_deletions_and_resizes():
+    keys = [f"key{number}" for number in range(5000)]
+    index = SlotIndex(keys, size=8)
+    for slot, key in enumerate(keys):
+        index[key] = slot
+    for key in keys[::3]:
+        del index[key]
+    assert len(index) == len(keys) - len(keys[::3])
+    for slot, key in enumerate(keys):
+        assert (key in index) == (slot % 3 != 0)
+        if slot % 3:
+            assert index[key] == slot
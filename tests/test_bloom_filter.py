@@ -0,0 +1,63 @@
+import random
+from bloomFilter import BloomFilter
+from lruCache import LRUCache
+
+KEYS = [f'key{index}' for index in range(20000)] + ['', 'ключ', '\udcff', 'a' * 1000]
+
+
+def test_added_keys_are_always_found():
+    bloom = BloomFilter(expected_items=len(KEYS))
+    for key in KEYS:
+        bloom.add(key)
+    assert all(bloom.might_contain(key) for key in KEYS)
+
+
+def test_false_positive_rate_stays_near_its_target():
+    bloom = BloomFilter(expected_items=10000, false_positive_rate=0.01)
+    for key in KEYS[:10000]:
+        bloom.add(key)
+    rng = random.Random(3)
+    absent = [f'absent{rng.getrandbits(64)}' for _ in range(50000)]
+    assert sum(bloom.might_contain(key) for key in absent) / len(absent) < 0.02
+
+
+def test_saved_filter_loads_with_the_same_answers(tmp_path):
+    bloom = BloomFilter(expected_items=len(KEYS))
+    for key in KEYS[::2]:
+        bloom.add(key)
+    bloom.save(str(tmp_path / 'bloom.bin'))
+    loaded = BloomFilter.load(str(tmp_path / 'bloom.bin'))
+    assert [loaded.might_contain(key) for key in KEYS] == [bloom.might_contain(key) for key in KEYS]
+    assert loaded.count == bloom.count
+
+
+def test_torn_filter_file_is_not_loaded(tmp_path):
+    bloom = BloomFilter(expected_items=1000)
+    bloom.save(str(tmp_path / 'bloom.bin'))
+    data = (tmp_path / 'bloom.bin').read_bytes()
+    (tmp_path / 'bloom.bin').write_bytes(data[:len(data) // 2])
+    assert BloomFilter.load(str(tmp_path / 'bloom.bin')) is None
+
+
+def test_cache_never_hides_evicted_keys(tmp_path):
+    cache = LRUCache(10, str(tmp_path), bloom_capacity=1000)
+    for index in range(500):
+        cache.put(f'key{index}', str(index))
+    assert all(cache.get(f'key{index}') == str(index) for index in range(500))
+    assert cache.get('never-written') == -1
+    assert cache.stats.bloom_negatives + cache.stats.bloom_false_positives == 1
+    cache.close()
+
+
+def test_filter_survives_clean_restarts_and_is_rebuilt_after_a_crash(tmp_path):
+    cache = LRUCache(10, str(tmp_path), bloom_capacity=1000)
+    for index in range(200):
+        cache.put(f'key{index}', str(index))
+    cache.close()
+    cache = LRUCache(10, str(tmp_path), bloom_capacity=1000)
+    assert all(cache.get(f'key{index}') == str(index) for index in range(190))
+    # no close, the saved filter was removed on load and has to be rebuilt
+    cache.storage.close()
+    cache = LRUCache(10, str(tmp_path), bloom_capacity=1000)
+    assert all(cache.get(f'key{index}') == str(index) for index in range(190))
+    cache.close()
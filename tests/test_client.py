@@ -0,0 +1,110 @@
+import asyncio
+import socket
+import threading
+import pytest
+from dhtClient import AsyncDHTClient, DHTClient, DHTError
+from protocol import PipelinedConnection, decode_request, encode_response, recv_exact, recv_frame, send_frame
+from conftest import start
+
+
+def answer_in_reverse(listener: socket.socket, count: int, answered: int = None) -> None:
+    """
+    Server that reads count requests and answers the first answered of
+    them last one first, each result naming the key of its request
+    """
+    conn, _ = listener.accept()
+    recv_exact(conn, 1)
+    requests = [decode_request(recv_frame(conn)) for _ in range(count)]
+    for request_id, commands in reversed(requests[:answered]):
+        send_frame(conn, encode_response(request_id, [f'{command[1]}' for command in commands]))
+    conn.close()
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen()
+    yield sock
+    sock.close()
+
+
+def test_responses_arriving_out_of_order_go_to_their_requests(listener):
+    start(answer_in_reverse, listener, 3)
+    connection = PipelinedConnection(listener.getsockname())
+    futures = [connection.submit([('get', f'key{index}', None)]) for index in range(3)]
+    assert [future.result(5) for future in futures] == [['key0'], ['key1'], ['key2']]
+    connection.close()
+
+
+def test_pending_requests_fail_when_the_connection_is_lost(listener):
+    start(answer_in_reverse, listener, 3, 2)
+    connection = PipelinedConnection(listener.getsockname())
+    futures = [connection.submit([('get', key, None)]) for key in ('key', 'other', 'unanswered')]
+    assert [future.result(5) for future in futures[:2]] == [['key'], ['other']]
+    with pytest.raises(ConnectionError):
+        futures[2].result(5)
+    with pytest.raises(ConnectionError):
+        connection.submit([('get', 'key', None)])
+
+
+def test_calls_made_while_a_frame_is_in_flight_go_out_as_one_frame(coordinator_at):
+    _, address = coordinator_at()
+    client = DHTClient(address, pool_size=1, compression='none')
+    submit = client.pool.submit
+    frames = []
+    sending = threading.Event()
+    release = threading.Event()
+
+    def record(commands):
+        frames.append(list(commands))
+        if len(frames) == 1:
+            sending.set()
+            release.wait(5)
+        return submit(commands)
+
+    client.pool.submit = record
+    first = client.set('first', 'value')
+    sending.wait(5)
+    futures = [client.set(f'key{index}', str(index)) for index in range(50)]
+    release.set()
+    assert first.result(5) is True
+    assert all(future.result(5) is True for future in futures)
+    assert len(frames) == 2
+    assert [command[1] for command in frames[1]] == [f'key{index}' for index in range(50)]
+    assert [client.get(f'key{index}').result(5) for index in range(50)] == [str(index) for index in range(50)]
+    client.close()
+
+
+def test_results_are_converted_per_command(coordinator_at):
+    _, address = coordinator_at()
+    with DHTClient(address, compression='none') as client:
+        assert client.set('key', 'value').result(5) is True
+        assert client.mset({'a': '1', 'b': '2'}).result(5) is True
+        assert client.get('key').result(5) == 'value'
+        assert client.get('missing').result(5) is None
+        assert client.mget(['a', 'missing', 'b']).result(5) == ['1', None, '2']
+        assert client.delete('key').result(5) is True
+        assert client.delete('key').result(5) is False
+        assert client.mdelete(['a', 'b', 'missing']).result(5) == 2
+        with pytest.raises(DHTError):
+            client.get('').result(5)
+
+
+def test_async_calls_in_one_loop_iteration_share_a_frame(coordinator_at):
+    _, address = coordinator_at()
+
+    async def run():
+        client = await AsyncDHTClient.connect(address, pool_size=2, compression='none')
+        frames = []
+        for connection in client.connections:
+            submit = connection.submit
+            connection.submit = lambda commands, submit=submit: frames.append(len(commands)) or submit(commands)
+        assert all(await asyncio.gather(*(client.set(f'key{index}', str(index)) for index in range(20))))
+        values = await asyncio.gather(*(client.get(f'key{index}') for index in range(20)))
+        client.close()
+        return frames, values
+
+    frames, values = asyncio.run(run())
+    assert frames == [20, 20]
+    assert values == [str(index) for index in range(20)]
@@ -0,0 +1,49 @@
+import os
+import threading
+import pytest
+from compression import CODECS, Compressor
+from performance_statistics import PerformanceStatistics
+
+TEXT = b'{"user": "someone", "items": [1, 2, 3], "note": "repeated text"} ' * 40
+
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+@pytest.mark.parametrize('dictionary', [None, TEXT[:256]])
+def test_round_trip(codec, dictionary):
+    compressor = Compressor(codec, threshold=64, dictionary=dictionary)
+    encoded = compressor.encode(TEXT)
+    assert len(encoded) < len(TEXT)
+    assert compressor.decode(encoded) == TEXT
+    assert Compressor(None, dictionary=dictionary).decode(encoded) == TEXT
+    assert compressor.decode(compressor.encode(b'short')) == b'short'
+
+
+def test_backs_off_on_incompressible_data():
+    compressor = Compressor('zlib', threshold=16, give_up=2, backoff=3)
+    noise = os.urandom(256)
+    assert compressor.compress(noise) is None
+    assert compressor.compress(noise) is None
+    assert compressor.skip == 3
+    for _ in range(3):
+        assert compressor.compress(TEXT) is None
+    assert compressor.compress(TEXT) is not None
+
+
+def test_shared_between_threads():
+    stats = PerformanceStatistics()
+    compressor = Compressor('zlib', threshold=16, give_up=3, backoff=5, stats=stats)
+    noise = os.urandom(256)
+    calls = 2000
+
+    def run(payload):
+        for _ in range(calls):
+            compressor.decode(compressor.encode(payload))
+
+    threads = [threading.Thread(target=run, args=(payload,)) for payload in (noise, TEXT, noise, TEXT)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.compression['wire'].payloads == 4 * calls
+    assert 0 <= compressor.skip <= 5
+    assert 0 <= compressor.misses < 3
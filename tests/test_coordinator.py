@@ -0,0 +1,55 @@
+import json
+import socket
+import time
+import migration
+from coordinator_node import CoordinatorNode
+
+
+def test_failed_migration_blocks_other_changes_until_retried(servers, monkeypatch):
+    coordinator = CoordinatorNode('127.0.0.1', 0, servers[:2])
+    keys = [f'key{index}' for index in range(300)]
+    assert set(coordinator.forward_commands([f'set {key} {key}' for key in keys])) == {'Inserted'}
+    copy_keys = migration.KeyMigration.copy_keys
+    failures = []
+
+    def fail_once(self):
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("server went away")
+        copy_keys(self)
+
+    monkeypatch.setattr(migration.KeyMigration, 'copy_keys', fail_once)
+    joined = f'127.0.0.1:{servers[2][1]}'
+    assert coordinator.forward_request_to_server(f'join {joined}').startswith('Migration started')
+    coordinator.migration_thread.join()
+    assert coordinator.migration.state == 'failed'
+    # the keys not moved yet are still read from their previous owners
+    assert coordinator.previous_ring is not None
+    assert coordinator.forward_commands([f'get {key}' for key in keys]) == keys
+    assert coordinator.forward_request_to_server(f'leave 127.0.0.1:{servers[0][1]}').startswith('Error')
+    assert coordinator.previous_ring is not None
+
+    assert coordinator.forward_request_to_server(f'join {joined}').startswith('Migration restarted')
+    coordinator.migration_thread.join()
+    assert coordinator.migration.state == 'done'
+    assert coordinator.previous_ring is None
+    assert coordinator.forward_commands([f'get {key}' for key in keys]) == keys
+
+
+def test_a_server_that_never_answers_counts_as_unavailable(servers):
+    hung = socket.socket()
+    hung.bind(('127.0.0.1', 0))
+    # connections complete in the backlog but are never read
+    hung.listen(16)
+    coordinator = CoordinatorNode('127.0.0.1', 0, [servers[0], hung.getsockname()], hedged_reads=False,
+                                  compression='none', server_timeout=0.3)
+    keys = [f'key{index}' for index in range(20)]
+    start_time = time.perf_counter()
+    results = coordinator.forward_commands([f'get {key}' for key in keys])
+    assert time.perf_counter() - start_time < 5
+    assert all(result.startswith('Error') for result in results)
+    owners = coordinator.consistent_hashing.get_nodes_batch(keys)
+    assert hung.getsockname() in owners and servers[0] in owners
+    stats = json.loads(coordinator.forward_request_to_server('stats'))
+    assert stats['unavailable_servers'] == 1
+    hung.close()
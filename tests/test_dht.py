@@ -0,0 +1,91 @@
+import asyncio
+import json
+import socket
+import threading
+import pytest
+from dht import AsyncDHT, DHT
+from protocol import MAGIC_BINARY, AsyncPipelinedConnection, decode_response, encode_request, recv_frame, send_frame
+
+
+@pytest.fixture
+def dht(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = DHT('127.0.0.1', 0, queue_workers=4, capacity=1000)
+    yield server
+    server.ht.close()
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def test_queue_workers_do_not_interleave_responses_on_one_connection(dht):
+    for _ in range(dht.queue_workers):
+        start(dht.process_requests_from_queue)
+    client, server = socket.socketpair()
+    start(dht.client_handler, server)
+    client.sendall(bytes([MAGIC_BINARY]))
+    values = {f'key{index}': chr(ord('a') + index) * 200000 for index in range(8)}
+    send_frame(client, encode_request(0, [('mset', list(values), list(values.values()))]))
+    assert decode_response(recv_frame(client)) == (0, ['Inserted'])
+    # large responses answered by different workers at the same time
+    for request_id in range(1, 41):
+        send_frame(client, encode_request(request_id, [('get', f'key{request_id % 8}', None)]))
+    client.settimeout(10)
+    for _ in range(40):
+        request_id, results = decode_response(recv_frame(client))
+        assert results == [values[f'key{request_id % 8}']]
+    client.close()
+
+
+def test_async_engine_answers_pipelined_requests_out_of_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = AsyncDHT('127.0.0.1', 0, capacity=100)
+
+    async def scenario():
+        listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        release = asyncio.Event()
+        execute = server.execute_command_async
+
+        async def execute_slowly(op, key=None, value=None):
+            if key == 'slow':
+                await release.wait()
+            return await execute(op, key, value)
+
+        server.execute_command_async = execute_slowly
+        connection = await AsyncPipelinedConnection.open(('127.0.0.1', port))
+        slow = connection.submit([('get', 'slow', None)])
+        # answered while the first request of the connection is still running
+        assert await asyncio.wait_for(connection.submit([('set', 'fast', '1')]), 5) == ['Inserted']
+        assert not slow.done()
+        release.set()
+        assert await asyncio.wait_for(slow, 5) == ['Error: Non existent key']
+        connection.close()
+        listener.close()
+
+    asyncio.run(scenario())
+    server.ht.close()
+
+
+def test_keys_spilled_by_the_original_server_are_imported(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacy = tmp_path / 'cache_disk'
+    legacy.mkdir()
+    for key in ('a', 'b', 'c'):
+        (legacy / f'{key}.json').write_text(json.dumps({key: key.upper()}))
+    server = DHT('127.0.0.1', 1, capacity=2)
+    # only reported without the flag
+    assert server.execute_command('get', 'a') == 'Error: Non existent key'
+    server.execute_command('set', 'b', 'newer')
+    # pushed out to the disk tier, which outlives the restart
+    server.execute_command('mset', ['x', 'y'], ['X', 'Y'])
+    server.ht.close()
+
+    server = DHT('127.0.0.1', 1, capacity=2, import_legacy=True)
+    assert [server.execute_command('get', key) for key in 'abc'] == ['A', 'newer', 'C']
+    assert not list(legacy.glob('*.json'))
+    server.ht.close()
@@ -0,0 +1,120 @@
+import random
+import pytest
+from evictionPolicies import EVICTION_POLICIES, ARCPolicy, LRUPolicy, TinyLFUPolicy, TwoQPolicy
+from policyCache import PolicyCache
+
+
+def admit(policy, key) -> list:
+    # what PolicyCache does for a key that is not cached
+    policy.record(key)
+    return policy.insert(key)
+
+
+def scan(policy, count: int) -> list:
+    evicted = []
+    for index in range(count):
+        evicted.extend(admit(policy, f'scan{index}'))
+    return evicted
+
+
+def test_lru_evicts_the_least_recently_used_key():
+    policy = LRUPolicy(3)
+    for key in 'abc':
+        assert admit(policy, key) == []
+    policy.access('a')
+    assert admit(policy, 'd') == ['b']
+    assert admit(policy, 'e') == ['c']
+    assert admit(policy, 'f') == ['a']
+
+
+def test_2q_evicts_new_keys_first_and_promotes_keys_seen_again():
+    policy = TwoQPolicy(4)
+    for key in 'abcd':
+        assert admit(policy, key) == []
+    # first in, first out of A1in
+    assert admit(policy, 'e') == ['a']
+    # 'a' is remembered in A1out, coming back puts it in the main queue
+    assert admit(policy, 'a') == ['b']
+    assert 'a' in policy.am
+    assert 'a' not in scan(policy, 50)
+
+
+def test_2q_main_queue_is_lru():
+    policy = TwoQPolicy(4)
+    for key in 'abcde':
+        admit(policy, key)
+    for key in 'ab':
+        admit(policy, key)
+    admit(policy, 'c')
+    assert list(policy.am) == ['a', 'b', 'c']
+    policy.access('a')
+    # A1in is at its share, the main queue gives up its least recently used key
+    policy.in_capacity = len(policy.a1in) + 1
+    assert admit(policy, 'x') == ['b']
+
+
+def test_arc_keeps_keys_seen_twice_through_a_scan():
+    policy = ARCPolicy(3)
+    for key in 'ab':
+        admit(policy, key)
+        policy.access(key)
+    evicted = scan(policy, 20)
+    assert evicted == [f'scan{index}' for index in range(19)]
+    assert set(policy.t2) == {'a', 'b'}
+
+
+def test_arc_ghost_hit_in_b1_grows_the_recency_side():
+    policy = ARCPolicy(3)
+    for key in 'ab':
+        admit(policy, key)
+        policy.access(key)
+    scan(policy, 3)
+    assert 'scan0' in policy.b1 and policy.p == 0
+    admit(policy, 'scan0')
+    assert policy.p > 0
+    assert 'scan0' in policy.t2
+
+
+def test_tinylfu_keeps_frequent_keys_through_a_scan():
+    policy = TinyLFUPolicy(100)
+    hot = [f'hot{index}' for index in range(50)]
+    for key in hot:
+        admit(policy, key)
+    # moves the last hot key out of the window, so every hot key is protected once used again
+    admit(policy, 'filler')
+    for _ in range(5):
+        for key in hot:
+            policy.access(key)
+    assert set(policy.protected) == set(hot)
+    evicted = scan(policy, 300)
+    assert len(evicted) == 300 + 1 - 50
+    assert not set(hot) & set(evicted)
+
+
+def test_tinylfu_admits_a_candidate_used_more_than_the_victim():
+    policy = TinyLFUPolicy(10)
+    for index in range(10):
+        admit(policy, f'cold{index}')
+    for _ in range(5):
+        policy.record('popular')
+    # the window holds one key, 'popular' is the candidate once it leaves
+    admit(policy, 'popular')
+    evicted = admit(policy, 'next')
+    assert 'popular' not in evicted
+    assert 'popular' in policy.probation
+
+
+@pytest.mark.parametrize('policy', sorted(EVICTION_POLICIES))
+def test_cache_holds_at_most_its_capacity_and_loses_nothing(tmp_path, policy):
+    cache = PolicyCache(50, str(tmp_path), policy=policy)
+    rng = random.Random(5)
+    model = {}
+    for step in range(3000):
+        key = f'key{int(rng.paretovariate(1.2)) % 400}'
+        if rng.random() < 0.3:
+            cache.put(key, str(step))
+            model[key] = str(step)
+        else:
+            assert cache.get(key) == model.get(key, -1)
+        assert len(cache.cache_map) <= 50
+    cache.close()
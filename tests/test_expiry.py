@@ -0,0 +1,116 @@
+import time
+import pytest
+from expiry import EXPIRY_MARK, NO_EXPIRY, TimerWheel, decode_expiring, encode_expiring
+from hashtable import HashTable
+
+# values that look like an expiry tag or an untagged legacy value
+TRICKY_VALUES = ['', 'plain', NO_EXPIRY, NO_EXPIRY + 'x', EXPIRY_MARK + '0' * 16 + 'payload',
+                 EXPIRY_MARK + 'f' * 16 + 'payload', EXPIRY_MARK, '\x00' * 20]
+
+
+@pytest.mark.parametrize('value', TRICKY_VALUES)
+def test_round_trip_without_expiry(value):
+    assert decode_expiring(encode_expiring(value)) == (None, value)
+
+
+@pytest.mark.parametrize('value', TRICKY_VALUES)
+def test_round_trip_with_expiry(value):
+    expires_at, decoded = decode_expiring(encode_expiring(value, 1700000000.123))
+    assert decoded == value
+    assert expires_at == pytest.approx(1700000000.123)
+
+
+def test_untagged_values_are_returned_as_they_are():
+    assert decode_expiring('legacy') == (None, 'legacy')
+    assert decode_expiring(-1) == (None, -1)
+
+
+def test_timer_wheel_returns_due_keys():
+    wheel = TimerWheel(tick=0.1, now=1000.0)
+    wheel.schedule('soon', 1000.5)
+    wheel.schedule('later', 1030.0)
+    wheel.schedule('far', 1000.0 + 3 * 24 * 3600)
+    wheel.schedule('cancelled', 1000.3)
+    wheel.cancel('cancelled')
+    assert wheel.advance(1000.4, 10) == []
+    assert wheel.advance(1001.0, 10) == ['soon']
+    assert wheel.advance(1031.0, 10) == ['later']
+    assert len(wheel) == 1
+    assert wheel.advance(1000.0 + 3 * 24 * 3600 + 1, 10) == ['far']
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_limits_keys_per_advance():
+    wheel = TimerWheel(tick=0.1, now=0.0)
+    for index in range(10):
+        wheel.schedule(index, 0.5)
+    assert len(wheel.advance(1.0, 4)) == 4
+    assert len(wheel.advance(1.0, 100)) == 6
+
+
+@pytest.fixture
+def table(tmp_path):
+    table = HashTable(capacity=2, disk_path=str(tmp_path))
+    yield table
+    table.close()
+
+
+@pytest.mark.parametrize('value', TRICKY_VALUES)
+def test_hashtable_keeps_values_that_look_tagged(table, value):
+    table.set('k', value)
+    # evicted to disk and read back
+    table.set('a', '1')
+    table.set('b', '2')
+    assert table.get('k') == value
+    assert table.delete('k')
+
+
+def test_hashtable_expires_keys(table):
+    table.set('short', 'value', ttl=0.05)
+    table.set('long', 'value', ttl=60)
+    assert table.get('short') == 'value'
+    time.sleep(0.2)
+    assert table.get('short') == -1
+    assert table.get('long') == 'value'
+    table.set('long', 'kept')
+    assert table.reclaim_expired() == 0
+    assert table.get('long') == 'kept'
+
+
+def test_delete_many_skips_expired_keys_and_cancels_timers(tmp_path):
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    table.set('live', 'value', ttl=60)
+    table.set('expired', 'value', ttl=0.01)
+    table.set('plain', 'value')
+    time.sleep(0.05)
+    assert table.delete_many(['live', 'expired', 'plain', 'missing']) == 2
+    assert len(table.timers) == 0
+    assert table.get_many(['live', 'expired', 'plain']) == [-1, -1, -1]
+    table.close()
+
+
+def test_tombstone_keeps_migrated_copies_out_until_it_expires(tmp_path):
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    copy = encode_expiring('old copy')
+    table.set('key', 'value')
+    assert table.delete('key', tombstone_ttl=0.2) is True
+    assert table.get('key') == -1
+    assert table.peek_stored('key') == -1
+    assert table.delete('key', tombstone_ttl=0.2) is False
+    assert table.set_if_absent('key', copy) is False
+    time.sleep(0.25)
+    assert table.set_if_absent('key', copy) is True
+    assert table.get('key') == 'old copy'
+    table.close()
+
+
+def test_tombstone_is_overwritten_by_set_and_reclaimed(tmp_path):
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    table.delete('written', tombstone_ttl=60)
+    table.set('written', 'new')
+    assert table.get('written') == 'new'
+    table.delete('reclaimed', tombstone_ttl=0.01)
+    time.sleep(0.2)
+    table.reclaim_expired()
+    assert table.cache.peek('reclaimed') == -1
+    table.close()
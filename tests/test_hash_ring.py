@@ -0,0 +1,73 @@
+import bisect
+from collections import Counter
+from coordinator_node import ConsistentHashing
+from migration import transfer_plan
+from protocol import ring_hash
+
+NODES = [('127.0.0.1', 5000 + index) for index in range(4)]
+KEYS = [f'key{index}' for index in range(20000)]
+
+
+def in_ranges(ranges: list, point: int) -> bool:
+    index = bisect.bisect_right([start for start, _ in ranges], point) - 1
+    return index >= 0 and point < ranges[index][1]
+
+
+def test_virtual_nodes_spread_keys_evenly():
+    shares = Counter(ConsistentHashing(NODES).get_nodes_batch(KEYS))
+    assert set(shares) == set(NODES)
+    mean = len(KEYS) / len(NODES)
+    assert all(abs(count - mean) < 0.2 * mean for count in shares.values())
+
+
+def test_weights_scale_the_share_of_keys():
+    ring = ConsistentHashing(NODES, weights={NODES[0]: 2.0})
+    shares = Counter(ring.get_nodes_batch(KEYS))
+    others = sum(shares[node] for node in NODES[1:]) / 3
+    assert 1.6 < shares[NODES[0]] / others < 2.4
+
+
+def test_batch_placement_matches_single_lookups():
+    ring = ConsistentHashing(NODES)
+    assert ring.get_nodes_batch(KEYS) == [ring.get_node(key) for key in KEYS]
+    preferences = ring.get_preference_lists_batch(KEYS, 3)
+    for key, preference in zip(KEYS, preferences):
+        assert preference == ring.get_preference_list(key, 3)
+        assert preference[0] == ring.get_node(key)
+        assert len(set(preference)) == 3
+
+
+def test_empty_ring_places_nothing():
+    ring = ConsistentHashing()
+    assert ring.get_node('key') is None
+    assert ring.get_nodes_batch(['a', 'b']) == [None, None]
+    assert ring.get_preference_lists_batch(['a'], 2) == [()]
+
+
+def test_a_joining_node_only_takes_keys_over():
+    ring = ConsistentHashing(NODES)
+    before = ring.get_nodes_batch(KEYS)
+    joined = ('127.0.0.1', 6000)
+    ring.add_node(joined)
+    after = ring.get_nodes_batch(KEYS)
+    moved = [new for old, new in zip(before, after) if old != new]
+    assert set(moved) == {joined}
+    assert abs(len(moved) - len(KEYS) / 5) < 0.2 * len(KEYS) / 5
+
+
+def test_transfer_plan_covers_every_key_that_changes_servers():
+    old_ring = ConsistentHashing(NODES)
+    new_ring = old_ring.copy()
+    new_ring.add_node(('127.0.0.1', 6000))
+    new_ring.remove_node(NODES[0])
+    copies, drops = transfer_plan(old_ring, new_ring, 2)
+    for key, old, new in zip(KEYS, old_ring.get_preference_lists_batch(KEYS, 2),
+                             new_ring.get_preference_lists_batch(KEYS, 2)):
+        point = ring_hash(key)
+        for destination in new:
+            if destination not in old:
+                assert in_ranges(copies[(old[0], destination)], point)
+        for server in old:
+            if server in new_ring.nodes:
+                assert in_ranges(drops.get(server, []), point) == (server not in new)
+    assert NODES[0] not in drops
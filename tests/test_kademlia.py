@@ -0,0 +1,184 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from kademlia import InProcessTransport, KademliaNode
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=8)
+    yield executor
+    executor.shutdown()
+
+
+def network(executor, count: int = 60, **options) -> list:
+    transport = InProcessTransport()
+    nodes = [KademliaNode('10.0.0.1', 10000 + index, transport=transport, executor=executor, **options)
+             for index in range(count)]
+    for node in nodes:
+        transport.register(node)
+    for node in nodes[1:]:
+        node.join(nodes[0].ip, nodes[0].port)
+    return nodes
+
+
+def settle(nodes: list) -> None:
+    """
+    Wait for the pings and cache stores sent in the background
+    """
+    time.sleep(0.05)
+    deadline = time.monotonic() + 5
+    while any(node.pinging for node in nodes) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_lookups_find_the_closest_nodes_and_every_stored_value(executor):
+    nodes = network(executor, k=8)
+    for index, node in enumerate(nodes[:20]):
+        assert node.store(f'key{index}', f'value{index}') == 8
+    for index in range(20):
+        assert nodes[-1 - index].lookup(f'key{index}') == f'value{index}'
+    target = nodes[0].hash('somewhere')
+    closest, value, hops, rpcs = nodes[-1].iterative_find(target)
+    expected = sorted((node for node in nodes if node is not nodes[-1]), key=lambda node: node.id ^ target)[:8]
+    assert [contact['id'] for contact in closest] == [node.id for node in expected]
+    assert value is None and hops >= 1 and rpcs >= len(closest)
+
+
+def test_lookups_route_around_nodes_that_left(executor):
+    nodes = network(executor, k=8)
+    nodes[0].store('key', 'value')
+    holders = [node for node in nodes if node.hash('key') in node.data]
+    transport = nodes[0].transport
+    for node in holders[:len(holders) // 2]:
+        del transport.nodes[(node.ip, node.port)]
+    searcher = next(node for node in nodes if node not in holders)
+    assert searcher.lookup('key') == 'value'
+
+
+def same_bucket_nodes(owner: KademliaNode, transport, count: int) -> list:
+    """
+    count nodes that fall into the owner's farthest bucket
+    """
+    nodes = []
+    port = 20000
+    while len(nodes) < count:
+        node = KademliaNode('10.0.0.2', port, k=owner.k, transport=transport, executor=owner.executor)
+        if owner.find_bucket(node.id) == 159:
+            nodes.append(node)
+        port += 1
+    return nodes
+
+
+def test_full_bucket_keeps_its_oldest_contact_while_it_answers(executor):
+    transport = InProcessTransport()
+    owner = KademliaNode('10.0.0.1', 10000, k=2, transport=transport, executor=executor)
+    oldest, other, newcomer = same_bucket_nodes(owner, transport, 3)
+    for node in (oldest, other):
+        transport.register(node)
+        owner.update_routing_table(node.id, node.ip, node.port)
+    owner.update_routing_table(newcomer.id, newcomer.ip, newcomer.port)
+    settle([owner])
+    # the oldest contact answered the ping and is now the most recently seen
+    assert [contact['id'] for contact in owner.routing_table[159]] == [other.id, oldest.id]
+    assert [contact['id'] for contact in owner.replacements[159]] == [newcomer.id]
+
+
+def test_full_bucket_replaces_its_oldest_contact_once_it_stops_answering(executor):
+    transport = InProcessTransport()
+    owner = KademliaNode('10.0.0.1', 10000, k=2, transport=transport, executor=executor)
+    oldest, other, newcomer = same_bucket_nodes(owner, transport, 3)
+    # the oldest contact is never registered, so it does not answer
+    transport.register(other)
+    for node in (oldest, other):
+        owner.update_routing_table(node.id, node.ip, node.port)
+    owner.update_routing_table(newcomer.id, newcomer.ip, newcomer.port)
+    settle([owner])
+    assert [contact['id'] for contact in owner.routing_table[159]] == [other.id, newcomer.id]
+    assert owner.replacements[159] == []
+
+
+def store_far_from_the_key(nodes: list, key: str, value: str) -> KademliaNode:
+    """
+    Leave the value only on the farthest of its holders, so the nodes a
+    lookup meets closer to the key lack it. Returns a node to search from,
+    sending one RPC at a time so the order of answers is fixed.
+    """
+    nodes[0].store(key, value)
+    key_id = nodes[0].hash(key)
+    # the publisher keeps a copy of its own wherever it is
+    holders = sorted((node for node in nodes[1:] if key_id in node.data), key=lambda node: node.id ^ key_id)
+    for node in [nodes[0]] + holders[:-1]:
+        del node.data[key_id]
+    searcher = max(nodes, key=lambda node: node.id ^ key_id)
+    searcher.alpha = 1
+    return searcher
+
+
+def test_found_values_are_cached_at_the_closest_node_that_lacked_them(executor):
+    nodes = network(executor, k=4, ttl=1000)
+    key_id = nodes[0].hash('key')
+    assert store_far_from_the_key(nodes, 'key', 'value').lookup('key') == 'value'
+    deadline = time.monotonic() + 5
+    while not any(key_id in node.cache for node in nodes) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    closest = min(nodes, key=lambda node: node.id ^ key_id)
+    assert [node for node in nodes if key_id in node.cache] == [closest]
+    assert closest.local_value(key_id) == 'value'
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, contact: dict, message: dict) -> dict:
+        self.messages.append((contact['port'], message))
+        return {'status': 'OK'}
+
+
+@pytest.mark.parametrize('closer, ttl', [(0, 1000), (1, 500), (3, 125), (8, 60)])
+def test_cached_copies_expire_sooner_the_more_nodes_are_closer_to_the_key(executor, closer, ttl):
+    transport = RecordingTransport()
+    node = KademliaNode('10.0.0.1', 10000, transport=transport, executor=executor, ttl=1000, min_cache_ttl=60)
+    node.cache_on_path({'id': 1, 'ip': '10.0.0.2', 'port': 10001}, 'key', 'value', closer)
+    executor.shutdown(wait=True)
+    port, message = transport.messages[0]
+    assert port == 10001
+    assert (message['command'], message['cache'], message['ttl']) == ('STORE', True, ttl)
+
+
+def test_path_caching_can_be_turned_off(executor):
+    nodes = network(executor, k=4, path_caching=False)
+    key_id = nodes[0].hash('key')
+    assert store_far_from_the_key(nodes, 'key', 'value').lookup('key') == 'value'
+    settle(nodes)
+    assert not any(key_id in node.cache for node in nodes)
+
+
+def test_expired_values_are_dropped(executor):
+    nodes = network(executor, count=10, k=4)
+    nodes[0].store('key', 'value', ttl=0.05)
+    time.sleep(0.1)
+    for node in nodes:
+        assert node.local_value(node.hash('key')) is None
+        node.maintain()
+        assert node.hash('key') not in node.data
+
+
+def test_republishing_restarts_the_ttl_only_for_the_publisher(executor):
+    nodes = network(executor, count=10, k=4, ttl=1000, republish_interval=0)
+    publisher = nodes[0]
+    publisher.store('key', 'value')
+    key_id = publisher.hash('key')
+    holder = next(node for node in nodes[1:] if key_id in node.data)
+    # the value was stored on the holder 400 seconds ago
+    key, value, expires_at, published_at = holder.data[key_id]
+    holder.data[key_id] = (key, value, expires_at - 400, published_at - 400)
+    holder.maintain()
+    others = [node for node in nodes if node is not holder and key_id in node.data]
+    assert others
+    for node in others:
+        assert node.data[key_id][2] < time.time() + 601
+    publisher.maintain()
+    for node in [holder] + others:
+        assert node.data[key_id][2] > time.time() + 999
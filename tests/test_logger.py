@@ -0,0 +1,71 @@
+import logging
+import time
+from logger import Logger, configure_logging
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def messages(self) -> list:
+        return [record.getMessage() for record in self.records]
+
+
+def recorded(name: str, **options) -> tuple:
+    logger = Logger(name=name, **options)
+    recorder = Recorder()
+    logger.logger.addHandler(recorder)
+    return logger, recorder
+
+
+def test_request_lines_are_sampled_but_slow_requests_are_always_logged():
+    logger, recorder = recorded('SampledLogger', sample_every=10, slow_threshold=0.5)
+    for index in range(100):
+        logger.request("request %d", index, duration=0.001)
+    logger.request("slow request", duration=1.0)
+    assert recorder.messages() == [f"request {index}" for index in range(0, 100, 10)] + ["slow request"]
+
+
+def test_lines_over_the_rate_limit_are_counted_and_reported():
+    logger, recorder = recorded('RateLimitedLogger', rate_limit=5)
+    for index in range(20):
+        logger.error("error %d", index)
+    assert recorder.messages() == [f"error {index}" for index in range(5)]
+    time.sleep(0.25)
+    logger.error("later")
+    assert recorder.messages()[5:] == ["Rate limit dropped 15 log messages", "later"]
+
+
+def test_arguments_of_filtered_lines_are_never_formatted():
+    formatted = []
+
+    class Expensive:
+        def __str__(self):
+            formatted.append(True)
+            return 'expensive'
+
+    logger, recorder = recorded('FilteredLogger', level=logging.WARNING)
+    logger.info("value %s", Expensive())
+    logger.request("value %s", Expensive())
+    assert recorder.records == [] and formatted == []
+    logger.warning("value %s", Expensive())
+    assert formatted == []
+    assert recorder.messages() == ["value expensive"]
+
+
+def test_configure_logging_applies_to_every_logger():
+    first, first_recorder = recorded('FirstConfiguredLogger')
+    second, second_recorder = recorded('SecondConfiguredLogger')
+    try:
+        configure_logging(level=logging.ERROR, sample_every=2)
+        for logger in (first, second):
+            logger.info("hidden")
+            logger.error("shown")
+            assert logger.sample_every == 2
+        assert first_recorder.messages() == second_recorder.messages() == ["shown"]
+    finally:
+        configure_logging(level=logging.DEBUG, sample_every=1)
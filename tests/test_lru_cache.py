@@ -0,0 +1,43 @@
+import pytest
+from arrayLruCache import ArrayLRUCache
+from hashtable import HashTable
+from lruCache import LRUCache
+from policyCache import PolicyCache
+
+
+def failing_write(key, value):
+    raise OSError("No space left on device")
+
+
+@pytest.mark.parametrize('make_cache', [
+    lambda path: LRUCache(2, path),
+    lambda path: ArrayLRUCache(40, path),
+    lambda path: PolicyCache(2, path, policy='arc'),
+])
+def test_failed_eviction_does_not_wedge_the_cache(tmp_path, make_cache):
+    cache = make_cache(str(tmp_path))
+    cache.write_to_disk = failing_write
+    for number in range(10):
+        cache.put(f'key{number}', 'value')
+    assert cache.get('key9') == 'value'
+    assert cache.stats.eviction_failures > 0
+    cache.close()
+
+
+@pytest.mark.parametrize('key, value', [
+    ('key', '\ud800'),
+    ('\udfff', 'value'),
+    ('key', 5),
+    ('k' * 0x10000, 'value'),
+])
+def test_hashtable_rejects_items_the_disk_cannot_store(tmp_path, key, value):
+    table = HashTable(capacity=1, disk_path=str(tmp_path))
+    with pytest.raises(ValueError):
+        table.set(key, value)
+    with pytest.raises(ValueError):
+        table.set_many(['other', key], ['value', value])
+    assert table.get('other') == -1
+    table.set('a', 'x' * 100)
+    table.set('b', 'y')
+    assert table.get('a') == 'x' * 100
+    table.close()
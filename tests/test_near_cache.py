@@ -0,0 +1,69 @@
+import time
+from coordinator_node import CoordinatorNode
+from nearCache import NearCache
+
+
+def test_entries_expire_after_their_ttl():
+    cache = NearCache(10, ttl=0.05)
+    cache.put('key', 'value')
+    assert cache.get('key') == 'value'
+    time.sleep(0.06)
+    assert cache.get('key') is None
+    assert cache.get_statistics()['near_cache_expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = NearCache(2)
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.get('a')
+    cache.put('c', '3')
+    assert [cache.get(key) for key in 'abc'] == ['1', None, '3']
+
+
+def test_invalidate_drops_the_entry():
+    cache = NearCache(10)
+    cache.put('key', 'value')
+    cache.invalidate('key')
+    cache.invalidate('missing')
+    assert cache.get('key') is None
+    assert cache.get_statistics()['near_cache_invalidations'] == 1
+
+
+def test_writes_through_the_coordinator_invalidate_cached_reads(servers):
+    coordinator = CoordinatorNode('127.0.0.1', 0, servers, near_cache_size=100, near_cache_ttl=60)
+    run = coordinator.forward_commands
+    assert run(['set key v1', 'get key']) == ['Inserted', 'v1']
+    assert run(['get key']) == ['v1']
+    assert run(['get key']) == ['v1']
+    assert coordinator.near_cache.hits == 1
+    assert run(['set key v2']) == ['Inserted']
+    assert run(['get key']) == ['v2']
+    assert run(['mset key v3 other x']) == ['Inserted']
+    assert run(['get key']) == ['v3']
+    assert run(['del key']) == ['Deleted']
+    assert run(['get key']) == ['Error: Non existent key']
+    assert run(['set key v4 ex 60']) == ['Inserted']
+    assert run(['get key']) == ['v4']
+    assert run(['del key other']) == ['Deleted 2']
+    assert run(['get key']) == ['Error: Non existent key']
+
+
+def test_a_key_written_earlier_in_the_batch_is_read_from_its_owner(servers):
+    coordinator = CoordinatorNode('127.0.0.1', 0, servers, near_cache_size=100, near_cache_ttl=60)
+    run = coordinator.forward_commands
+    assert run(['set key v1', 'get key']) == ['Inserted', 'v1']
+    assert run(['get key', 'set key v2', 'get key']) == ['v1', 'Inserted', 'v2']
+    assert run(['get key']) == ['v2']
+
+
+def test_writes_that_bypass_the_coordinator_show_up_after_the_ttl(servers):
+    coordinator = CoordinatorNode('127.0.0.1', 0, servers, near_cache_size=100, near_cache_ttl=0.2)
+    assert coordinator.forward_commands(['set key v1']) == ['Inserted']
+    assert coordinator.forward_commands(['get key']) == ['v1']
+    # another coordinator writing the same key
+    other = CoordinatorNode('127.0.0.1', 0, servers)
+    assert other.forward_commands(['set key v2']) == ['Inserted']
+    assert coordinator.forward_commands(['get key']) == ['v1']
+    time.sleep(0.25)
+    assert coordinator.forward_commands(['get key']) == ['v2']
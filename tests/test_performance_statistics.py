@@ -0,0 +1,66 @@
+import json
+import random
+import pytest
+from performance_statistics import (PERCENTILES, SUB_BUCKETS, LatencyHistogram, PerformanceStatistics,
+                                    aggregate_statistics)
+
+
+def latencies(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    # mostly microseconds with a long tail, plus the exact small buckets
+    return [int(rng.lognormvariate(11, 1.5)) for _ in range(count)] + list(range(40))
+
+
+def histogram_of(values: list) -> LatencyHistogram:
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_merge_is_exact():
+    values = latencies(30000, 1)
+    parts = [histogram_of(values[index::3]) for index in range(3)]
+    merged = LatencyHistogram()
+    for part in parts:
+        merged.merge(part)
+    whole = histogram_of(values)
+    assert merged.counts == whole.counts
+    assert (merged.count, merged.total, merged.max) == (whole.count, whole.total, whole.max)
+    for percent in PERCENTILES:
+        assert merged.percentile(percent) == whole.percentile(percent)
+
+
+@pytest.mark.parametrize('percent', PERCENTILES)
+def test_percentiles_are_within_the_bucket_error(percent):
+    values = sorted(latencies(20000, 2))
+    exact = values[int(max(1, -(-len(values) * percent // 100))) - 1]
+    assert abs(histogram_of(values).percentile(percent) - exact) <= exact / SUB_BUCKETS
+
+
+def test_small_values_are_exact():
+    for value in range(2 * SUB_BUCKETS):
+        assert histogram_of([value]).percentile(50) == value
+
+
+def test_serialized_histograms_merge_like_the_originals():
+    values = latencies(5000, 3)
+    histogram = histogram_of(values)
+    restored = LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    assert restored.counts == histogram.counts
+    assert restored.summary() == histogram.summary()
+
+
+def test_cluster_percentiles_equal_those_of_all_requests_together():
+    values = latencies(20000, 4)
+    servers = []
+    for index in range(4):
+        stats = PerformanceStatistics()
+        stats.histograms['get'] = histogram_of(values[index::4])
+        stats.record_hit()
+        # reports travel as JSON from the servers to the coordinator
+        servers.append(json.loads(json.dumps(stats.get_statistics())))
+    report = aggregate_statistics(servers)
+    assert report['latency']['get'] == histogram_of(values).summary()
+    assert report['hits'] == 4
+    assert report['hit_rate'] == 1
@@ -0,0 +1,111 @@
+import socket
+import pytest
+from compression import CODECS, Compressor
+from protocol import (ProtocolError, decode_request, decode_response, encode_request, encode_response,
+                      format_command, has_empty_key, pack_items, parse_command, recv_frame, send_frame,
+                      unpack_items)
+
+
+COMMANDS = [
+    ('get', 'key', None),
+    ('set', 'key', 'value'),
+    ('setex', 'key', ('value', 1.5)),
+    ('del', 'key', None),
+    ('del', 'key', '86400'),
+    ('stats', None, None),
+    ('scan', None, '{"ranges": [[0, 10]]}'),
+    ('scan', '3:512', '{"count": 10}'),
+    ('migrate', 'key', 'value'),
+    ('join', '127.0.0.1:5000', None),
+    ('mget', ['a', 'b'], None),
+    ('mset', ['a', 'b'], ['1', '2']),
+    ('mdel', ['a'], None),
+]
+
+
+def test_request_round_trip():
+    request_id, commands = decode_request(encode_request(7, COMMANDS))
+    assert request_id == 7
+    assert commands == COMMANDS
+
+
+def test_empty_fields_decode_to_empty_strings():
+    commands = [('set', 'poison', ''), ('set', '', 'value'), ('get', '', None), ('migrate', 'key', ''),
+                ('setex', 'key', ('', 2.0)), ('mset', ['', 'b'], ['', ''])]
+    assert decode_request(encode_request(1, commands))[1] == commands
+
+
+def test_optional_fields_stay_none():
+    _, commands = decode_request(encode_request(1, [('scan', None, None), ('stats', None, None)]))
+    assert commands == [('scan', None, None), ('stats', None, None)]
+
+
+def test_unknown_op_code_is_rejected():
+    payload = bytearray(encode_request(1, [('get', 'key', None)]))
+    payload[8] = 200
+    with pytest.raises(ProtocolError):
+        decode_request(bytes(payload))
+
+
+def test_binary_keys_and_values_round_trip():
+    command = ('set', 'k\x00\n ey', '\udcff\x01value')
+    assert decode_request(encode_request(1, [command]))[1] == [command]
+
+
+def test_response_round_trip():
+    results = ['Inserted', '', 'Error: Non existent key', '[1, 2]']
+    assert decode_response(encode_response(9, results)) == (9, results)
+
+
+def test_items_round_trip():
+    items = ['', 'a', 'b' * 1000]
+    assert unpack_items(pack_items(items)) == items
+
+
+@pytest.mark.parametrize('codec', [None] + list(CODECS))
+def test_frames_over_a_socket(codec):
+    left, right = socket.socketpair()
+    compressor = Compressor(codec, threshold=16)
+    try:
+        payloads = [b'', b'x', b'repeated value ' * 200]
+        for payload in payloads:
+            send_frame(left, payload, compressor)
+        assert [recv_frame(right, compressor) for _ in payloads] == payloads
+        left.close()
+        assert recv_frame(right, compressor) is None
+    finally:
+        left.close()
+        right.close()
+
+
+@pytest.mark.parametrize('text, parsed', [
+    ('get key', ('get', 'key', None)),
+    ('set key value', ('set', 'key', 'value')),
+    ('set key value ex 10', ('setex', 'key', ('value', 10.0))),
+    ('set key value EX 0.5', ('setex', 'key', ('value', 0.5))),
+    ('del key', ('del', 'key', None)),
+    ('del a b', ('mdel', ['a', 'b'], None)),
+    ('mget a b', ('mget', ['a', 'b'], None)),
+    ('mset a 1 b 2', ('mset', ['a', 'b'], ['1', '2'])),
+    ('stats', ('stats', None, None)),
+    ('join 127.0.0.1:5000', ('join', '127.0.0.1:5000', None)),
+])
+def test_parse_command(text, parsed):
+    assert parse_command(text) == parsed
+    assert parse_command(format_command(parsed)) == parsed
+
+
+@pytest.mark.parametrize('text', [
+    '', 'get', 'get a b', 'set key', 'set key value ex', 'set key value ex -1', 'set key value ex nan',
+    'set key value ex inf', 'set key value ex soon', 'mset a', 'mget', 'stats now', 'join nowhere', 'scan',
+])
+def test_parse_invalid_command(text):
+    assert parse_command(text) is None
+
+
+def test_has_empty_key():
+    assert has_empty_key(('get', '', None))
+    assert has_empty_key(('mset', ['a', ''], ['1', '2']))
+    assert not has_empty_key(('set', 'key', ''))
+    assert not has_empty_key(('scan', None, None))
+    assert not has_empty_key(('stats', None, None))
@@ -0,0 +1,65 @@
+import time
+import pytest
+from expiry import EXPIRY_MARK, NO_EXPIRY
+from replication import MISSING_KEY, VERSION_MARK, QuorumOperation, VersionClock, decode_versioned, encode_versioned
+
+# values that look like a version stamp, an expiry tag or both
+TRICKY_VALUES = ['', 'plain', VERSION_MARK, VERSION_MARK + '0' * 16 + 'payload',
+                 VERSION_MARK + 'f' * 16 + NO_EXPIRY + 'payload', EXPIRY_MARK + '0' * 16, '\x00' * 40]
+
+
+@pytest.mark.parametrize('value', TRICKY_VALUES)
+def test_round_trip_without_expiry(value):
+    assert decode_versioned(encode_versioned(value, 42)) == (42, None, value)
+
+
+@pytest.mark.parametrize('value', TRICKY_VALUES)
+def test_round_trip_with_expiry(value):
+    version, expires_at, decoded = decode_versioned(encode_versioned(value, 7, 1700000000.5))
+    assert (version, decoded) == (7, value)
+    assert expires_at == pytest.approx(1700000000.5)
+
+
+def test_unstamped_values_are_the_oldest_version():
+    assert decode_versioned('legacy') == (0, None, 'legacy')
+
+
+def test_version_clock_is_monotonic():
+    clock = VersionClock()
+    versions = [clock.next() for _ in range(1000)]
+    assert versions == sorted(set(versions))
+
+
+def read(responses: dict, required: int = 2) -> QuorumOperation:
+    operation = QuorumOperation(0, ('get', 'key', None), list(responses), required)
+    operation.initial_targets()
+    for replica in list(responses)[:required]:
+        operation.record_result(replica, responses[replica])
+    return operation
+
+
+def test_read_returns_newest_version_and_finds_stale_replicas():
+    operation = read({'a': encode_versioned('old', 1), 'b': encode_versioned('new', 2)})
+    assert operation.result() == 'new'
+    assert operation.stale_replicas() == ['a']
+
+
+def test_read_of_missing_key():
+    operation = read({'a': MISSING_KEY, 'b': MISSING_KEY})
+    assert operation.result() == MISSING_KEY
+    assert operation.stale_replicas() == []
+
+
+def test_read_ignores_expired_value():
+    operation = read({'a': encode_versioned('gone', 1, time.time() - 1), 'b': MISSING_KEY})
+    assert operation.result() == MISSING_KEY
+
+
+def test_write_quorum():
+    operation = QuorumOperation(0, ('set', 'key', encode_versioned('value', 1)), ['a', 'b', 'c'], 2)
+    assert operation.initial_targets() == ['a', 'b', 'c']
+    operation.record_result('a', "Inserted")
+    operation.record_failure()
+    assert operation.result() == "Error: Write quorum not reached"
+    operation.record_result('c', "Inserted")
+    assert operation.result() == "Inserted"
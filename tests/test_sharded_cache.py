@@ -0,0 +1,94 @@
+import random
+import threading
+import pytest
+from shardedLruCache import ShardedLRUCache
+
+
+def run_threads(count, target):
+    errors = []
+
+    def run(number):
+        try:
+            target(number)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+@pytest.mark.parametrize('storage', ['log', 'json'])
+@pytest.mark.parametrize('eviction_policy', ['lru', 'arc'])
+def test_matches_a_reference_model_under_concurrency(tmp_path, storage, eviction_policy):
+    cache = ShardedLRUCache(32, str(tmp_path), storage, shards=4, eviction_policy=eviction_policy)
+
+    def worker(number):
+        # every thread owns its keys, so its own model is the truth for them
+        rng = random.Random(number)
+        model = {}
+        keys = [f'{number}-{index}' for index in range(40)]
+        for step in range(1500):
+            key = rng.choice(keys)
+            action = rng.random()
+            if action < 0.4:
+                cache.put(key, f'{key}={step}')
+                model[key] = f'{key}={step}'
+            elif action < 0.5:
+                assert cache.delete(key) == (key in model)
+                model.pop(key, None)
+            elif action < 0.75:
+                assert cache.get(key) == model.get(key, -1)
+            else:
+                assert cache.read(key, promote=False) == model.get(key, -1)
+        assert {key: cache.peek(key) for key in keys} == {key: model.get(key, -1) for key in keys}
+
+    run_threads(8, worker)
+    cache.close()
+
+
+def test_reads_never_go_back_in_time(tmp_path):
+    cache = ShardedLRUCache(8, str(tmp_path), shards=2)
+    done = threading.Event()
+
+    def worker(number):
+        if number == 0:
+            for version in range(3000):
+                cache.put('hot', str(version))
+                # push the hot key out to disk now and then
+                cache.put(f'filler{version % 50}', 'x')
+            done.set()
+            return
+        last = -1
+        while not done.is_set():
+            value = cache.get('hot') if number % 2 else cache.read('hot', promote=False)
+            if value != -1:
+                assert int(value) >= last
+                last = int(value)
+
+    run_threads(5, worker)
+    cache.close()
+
+
+@pytest.mark.parametrize('write', ['put', 'delete'])
+def test_write_during_an_unlocked_disk_read_wins(tmp_path, write):
+    cache = ShardedLRUCache(1, str(tmp_path), shards=1)
+    cache.put('key', 'old')
+    cache.put('other', 'x')
+    shard = cache.shards[0]
+    read_from_disk = shard.read_from_disk
+
+    def racing_read(key):
+        # the shard lock is free while the disk is read, a retry reads normally
+        shard.read_from_disk = read_from_disk
+        value = read_from_disk(key)
+        cache.put('key', 'new') if write == 'put' else cache.delete('key')
+        return value
+
+    shard.read_from_disk = racing_read
+    assert cache.get('key') == ('new' if write == 'put' else -1)
+    cache.close()
@@ -0,0 +1,82 @@
+import os
+import pytest
+from hashtable import HashTable
+from snapshot import load_snapshot, save_snapshot
+
+
+def test_round_trip_keeps_order_and_values(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    items = [('a', '1'), ('', ''), ('ключ', 'значение'), ('b', '\x00' * 3 + 'x' * 10000)]
+    save_snapshot(path, items, clean=True)
+    assert load_snapshot(path) == (items, True)
+    save_snapshot(path, items)
+    assert load_snapshot(path) == (items, False)
+
+
+@pytest.mark.parametrize('damage', ['truncate', 'flip'])
+def test_torn_or_corrupt_snapshots_are_ignored(tmp_path, damage):
+    path = str(tmp_path / 'snapshot.bin')
+    save_snapshot(path, [('key', 'value')] * 10)
+    data = bytearray(open(path, 'rb').read())
+    if damage == 'truncate':
+        data = data[:len(data) // 2]
+    else:
+        data[len(data) // 2] ^= 0xFF
+    open(path, 'wb').write(data)
+    assert load_snapshot(path) is None
+
+
+def test_clean_restart_restores_memory_in_recency_order(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    table = HashTable(capacity=3, disk_path=str(tmp_path))
+    for key in 'abcde':
+        table.set(key, key.upper())
+    table.get('c')
+    table.save_snapshot(path, clean=True)
+    table.close()
+
+    table = HashTable(capacity=3, disk_path=str(tmp_path))
+    assert table.load_snapshot(path) == 3
+    assert [key for key, _ in table.cache.snapshot_items()] == ['d', 'e', 'c']
+    assert [table.get(key) for key in 'abcde'] == list('ABCDE')
+    table.close()
+
+
+def test_after_a_crash_keys_on_disk_keep_their_newer_value(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    table = HashTable(capacity=2, disk_path=str(tmp_path))
+    table.set('a', 'old')
+    table.set('b', 'B')
+    table.save_snapshot(path)
+    # 'a' is updated and then evicted to disk after the periodic snapshot
+    table.set('a', 'new')
+    table.set('c', 'C')
+    table.set('d', 'D')
+    table.close()
+
+    table = HashTable(capacity=2, disk_path=str(tmp_path))
+    table.load_snapshot(path)
+    assert table.get('a') == 'new'
+    assert table.get('b') == 'B'
+    table.close()
+
+
+def test_restored_keys_survive_a_crash_right_after_the_restart(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    for key in 'abc':
+        table.set(key, key.upper())
+    table.save_snapshot(path, clean=True)
+    table.close()
+
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    assert table.load_snapshot(path) == 3
+    assert os.path.exists(path)
+    # saved again without the clean flag, writes after the restart may be newer
+    assert load_snapshot(path)[1] is False
+    table.close()
+
+    table = HashTable(capacity=10, disk_path=str(tmp_path))
+    assert table.load_snapshot(path) == 3
+    assert [table.get(key) for key in 'abc'] == list('ABC')
+    table.close()
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+import pytest
+from lruCache import LRUCache
+from storage import NOT_FOUND, JsonFileStorage, WriteBackBuffer, create_storage
+
+KEYS = ['plain', '../outside', '/etc/passwd', 'a/b', '..', 'CON', 'ключ', '\udcff']
+
+
+@pytest.mark.parametrize('engine', ['json', 'log'])
+def test_round_trip(tmp_path, engine):
+    storage = create_storage(engine, str(tmp_path / 'disk'))
+    for key in KEYS:
+        storage.write(key, f'value of {key}')
+    assert sorted(storage.keys()) == sorted(KEYS)
+    for key in KEYS:
+        assert storage.read(key) == f'value of {key}'
+    storage.delete('../outside')
+    assert storage.read('../outside') == NOT_FOUND
+    storage.close()
+
+
+def test_json_keys_stay_inside_the_directory(tmp_path):
+    storage = JsonFileStorage(str(tmp_path / 'disk'))
+    storage.write('../outside', 'value')
+    assert os.listdir(tmp_path) == ['disk']
+    assert len(os.listdir(tmp_path / 'disk')) == 1
+
+
+def test_json_renames_legacy_files(tmp_path):
+    os.makedirs(tmp_path / 'disk')
+    with open(tmp_path / 'disk' / 'old.json', 'w') as f:
+        json.dump({'old': 'value'}, f)
+    storage = JsonFileStorage(str(tmp_path / 'disk'))
+    assert storage.read('old') == 'value'
+    assert storage.keys() == ['old']
+    assert 'old.json' not in os.listdir(tmp_path / 'disk')
+
+
+def test_batch_durability_groups_writes_through_the_buffer(tmp_path):
+    storage = create_storage('log', str(tmp_path / 'batch'), durability='batch')
+    assert isinstance(storage, WriteBackBuffer)
+    storage.write('key', 'value')
+    storage.close()
+    storage = create_storage('log', str(tmp_path / 'write'), durability='write', write_back=True)
+    assert not isinstance(storage, WriteBackBuffer)
+    storage.close()
+
+
+class FailingStorage:
+    def __init__(self):
+        self.closed = False
+
+    def write_batch(self, items):
+        raise OSError("disk full")
+
+    def read(self, key):
+        return NOT_FOUND
+
+    def close(self):
+        self.closed = True
+
+
+def test_close_gives_up_on_a_disk_that_keeps_failing(tmp_path):
+    failing = FailingStorage()
+    storage = WriteBackBuffer(failing, flush_timeout=0.2)
+    for index in range(10):
+        storage.write(f'key{index}', 'value')
+    assert storage.flush() is False
+    started = time.monotonic()
+    assert storage.close() == 10
+    assert time.monotonic() - started < 2
+    assert failing.closed
+
+
+def test_writes_dropped_on_close_count_as_eviction_failures(tmp_path):
+    cache = LRUCache(2, str(tmp_path), write_back=True)
+    cache.storage.storage.close()
+    cache.storage.storage = FailingStorage()
+    cache.storage.flush_timeout = 0.2
+    for index in range(5):
+        cache.put(f'key{index}', 'value')
+    cache.close()
+    assert cache.stats.eviction_failures == 3
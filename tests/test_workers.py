@@ -0,0 +1,87 @@
+import json
+import os
+import time
+import pytest
+from dht import DHT
+from conftest import free_port, start
+
+
+def listening(worker: DHT) -> DHT:
+    start(worker.listen_to_workers)
+    deadline = time.monotonic() + 5
+    while not os.path.exists(worker.worker_socket(worker.worker_id)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return worker
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """
+    The three workers of one node, each serving the keys forwarded to it
+    """
+    monkeypatch.chdir(tmp_path)
+    port = free_port()
+    node = [listening(DHT('127.0.0.1', port, capacity=100, worker_id=worker_id, workers=3))
+            for worker_id in range(3)]
+    yield node
+    for worker in node:
+        worker.ht.close()
+
+
+KEYS = [f'key{index}' for index in range(60)]
+
+
+def test_every_key_is_stored_only_by_its_owner(workers):
+    assert set(workers[0].handle_commands([f'set {key} {key}' for key in KEYS])) == {'Inserted'}
+    for worker in workers:
+        assert worker.handle_commands([f'get {key}' for key in KEYS]) == KEYS
+    owners = {worker.owner(key) for worker in workers for key in KEYS}
+    assert owners == {0, 1, 2}
+    for key in KEYS:
+        for worker in workers:
+            stored = worker.execute_command('get', key) == key
+            assert stored == (worker.worker_id == worker.owner(key))
+
+
+def test_multi_key_commands_are_split_and_reassembled_in_order(workers):
+    values = [f'value{index}' for index in range(len(KEYS))]
+    assert workers[1].handle_commands([f'mset {" ".join(f"{k} {v}" for k, v in zip(KEYS, values))}']) == ['Inserted']
+    mget = f'mget {" ".join(reversed(KEYS))} missing'
+    assert json.loads(workers[2].handle_commands([mget])[0]) == list(reversed(values)) + [None]
+    assert workers[0].handle_commands([f'del {" ".join(KEYS[:30])} missing']) == ['Deleted 30']
+    assert json.loads(workers[0].handle_commands([mget])[0]) == list(reversed(values[30:])) + [None] * 31
+
+
+def test_scans_page_through_every_worker(workers):
+    workers[0].handle_commands([f'set {key} {key}' for key in KEYS])
+    request = json.dumps({"ranges": [[0, 1 << 64]], "count": 7})
+    found = []
+    cursor = None
+    while True:
+        command = ('scan', cursor, request)
+        page = json.loads(workers[1].execute_batch([command])[0])
+        found.extend(key for key, _ in page["items"])
+        cursor = page["cursor"]
+        if cursor is None:
+            break
+    assert sorted(found) == sorted(KEYS)
+
+
+def test_stats_cover_every_worker(workers):
+    workers[0].handle_commands([f'set {key} {key}' for key in KEYS])
+    workers[0].handle_commands([f'get {key}' for key in KEYS])
+    statistics = json.loads(workers[0].handle_commands(['stats'])[0])
+    assert statistics["workers"] == 3
+    assert statistics["unavailable_workers"] == 0
+    assert statistics["write_requests"] == len(KEYS)
+    assert statistics["hits"] == len(KEYS)
+
+
+def test_keys_of_a_stopped_worker_fail_without_failing_the_rest(workers):
+    workers[1].handle_commands([f'set {key} {key}' for key in KEYS])
+    # worker 0 has not connected to worker 2 yet and finds nobody listening
+    os.unlink(workers[2].worker_socket(2))
+    results = workers[0].handle_commands([f'get {key}' for key in KEYS])
+    for key, result in zip(KEYS, results):
+        assert result == ("Error: Worker unavailable" if workers[0].owner(key) == 2 else key)
+    assert json.loads(workers[0].handle_commands(['stats'])[0])["unavailable_workers"] == 1